@@ -0,0 +1,205 @@
+"""
+Benchmarks for the sensor acquisition path.  These run against the emulated
+BME280 in `envwatcher.emulator`, so they work on any machine:
+
+    python -m envwatcher.benchmarks
+"""
+import os
+import time
+import shutil
+import tempfile
+import argparse
+
+import numpy as np
+
+from .bme280 import BME280Recorder, calibrate_raw_arrays
+from .emulator import EmulatedSMBus, EmulatedBME280
+
+
+def make_emulated_recorder(address=0x77, i2cbusnum=1, **emulator_kwargs):
+    """
+    Returns a `BME280Recorder` attached to a fresh emulated device (with no
+    calibration cache), and the `EmulatedSMBus` it uses.
+    """
+    bus = EmulatedSMBus({address: EmulatedBME280(**emulator_kwargs)})
+    recorder = BME280Recorder(address, i2cbusnum, bus=bus, calib_cache=None)
+    return recorder, bus
+
+
+def bench_read(nsamples=100, **emulator_kwargs):
+    """
+    Times `BME280Recorder.read` and counts the I2C transactions it makes.
+
+    Returns a dictionary of results.
+    """
+    b, bus = make_emulated_recorder(**emulator_kwargs)
+
+    bus.reset_counts()
+    times = np.empty(nsamples)
+    for i in range(nsamples):
+        st = time.perf_counter()
+        b.read()
+        times[i] = time.perf_counter() - st
+
+    results = {'samples': nsamples,
+               'transactions/sample': bus.ntransactions / nsamples,
+               'measure time estimate (ms)': b.t_measure_estimate[0],
+               'read() mean (ms)': times.mean()*1000,
+               'read() median (ms)': np.median(times)*1000,
+               'read() max (ms)': times.max()*1000}
+    for nm, count in sorted(bus.transactions.items()):
+        results[nm + '/sample'] = count / nsamples
+    return results
+
+
+def bench_calibrate(nsamples=10000, **emulator_kwargs):
+    """
+    Times calibrating one sample with the recorder's `CalibrationKernel` and
+    with `calibrate_raw_arrays`.
+
+    Returns a dictionary of results.
+    """
+    b, bus = make_emulated_recorder(**emulator_kwargs)
+    raw = b.read_raw()
+
+    st = time.perf_counter()
+    for i in range(nsamples):
+        b.read(raw)
+    kernel = (time.perf_counter() - st) / nsamples
+
+    st = time.perf_counter()
+    for i in range(nsamples):
+        calibrate_raw_arrays(b.calib_vals, *raw)
+    arrays = (time.perf_counter() - st) / nsamples
+
+    return {'samples': nsamples,
+            'read(raw) (us/sample)': kernel*1e6,
+            'calibrate_raw_arrays (us/sample)': arrays*1e6,
+            'speedup': arrays / kernel}
+
+
+def bench_group_read(nsensors=4, nsamples=50, **emulator_kwargs):
+    """
+    Times reading `nsensors` emulated sensors (two per bus) one after the
+    other, and together as a `BME280Group`.
+
+    Returns a dictionary of results.
+    """
+    from .sensor_group import BME280Group
+
+    recorders = [make_emulated_recorder((0x76, 0x77)[i % 2], i // 2 + 1,
+                                        **emulator_kwargs)[0]
+                 for i in range(nsensors)]
+    group = BME280Group(recorders)
+
+    st = time.perf_counter()
+    for i in range(nsamples):
+        for rec in recorders:
+            rec.read_raw()
+    sequential = (time.perf_counter() - st) / nsamples
+
+    st = time.perf_counter()
+    for i in range(nsamples):
+        group.read_raw()
+    grouped = (time.perf_counter() - st) / nsamples
+
+    return {'sensors': nsensors,
+            'samples': nsamples,
+            'sequential (ms/sample)': sequential*1000,
+            'group (ms/sample)': grouped*1000,
+            'speedup': sequential / grouped}
+
+
+class _TimedRecorder:
+    """
+    Wraps a recorder to record when each sample is taken, and asks
+    `output_session_file` to stop after `nsamples`.
+    """
+    def __init__(self, recorder, nsamples, stopfn):
+        self._recorder = recorder
+        self._nsamples = nsamples
+        self._stopfn = stopfn
+        self.sample_times = []
+
+    def __getattr__(self, name):
+        return getattr(self._recorder, name)
+
+    def read_raw(self, *args, **kwargs):
+        self.sample_times.append(time.perf_counter())
+        if len(self.sample_times) >= self._nsamples:
+            with open(self._stopfn, 'w') as f:
+                f.write('Stop recording!')
+        return self._recorder.read_raw(*args, **kwargs)
+
+
+def bench_session_loop(nsamples=20, waitsec=0.1, **emulator_kwargs):
+    """
+    Runs `output_session_file` on an emulated device and measures how far the
+    sample intervals stray from `waitsec`.
+
+    Returns a dictionary of results.
+    """
+    from .file_recorder import output_session_file
+
+    b, bus = make_emulated_recorder(**emulator_kwargs)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        progressfn = os.path.join(tmpdir, 'recorder_progress')
+        timed = _TimedRecorder(b, nsamples, progressfn + '_stop')
+        bus.reset_counts()
+        output_session_file(timed, os.path.join(tmpdir, 'bench'), waitsec,
+                            progressfn=progressfn, setled=False)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    intervals = np.diff(timed.sample_times)
+    jitter = intervals - waitsec
+    return {'samples': len(timed.sample_times),
+            'sample time (ms)': waitsec*1000,
+            'transactions/sample': bus.ntransactions / len(timed.sample_times),
+            'interval mean (ms)': intervals.mean()*1000,
+            'jitter std (ms)': jitter.std()*1000,
+            'jitter max abs (ms)': np.abs(jitter).max()*1000}
+
+
+def print_results(title, results):
+    print(title)
+    for nm, val in results.items():
+        if isinstance(val, float):
+            val = '{:.3f}'.format(val)
+        print('  {}: {}'.format(nm, val))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, default=100,
+                        help='number of read() calls to time')
+    parser.add_argument('--loop-samples', type=int, default=20,
+                        help='number of samples in the recorder loop benchmark')
+    parser.add_argument('--waitsec', type=float, default=0.1,
+                        help='sample time for the recorder loop benchmark')
+    parser.add_argument('--measure-time-ms', type=float, default=None,
+                        help='emulated conversion time (default: datasheet '
+                             'typical for the oversampling settings)')
+    parser.add_argument('--measure-jitter-ms', type=float, default=0,
+                        help='random jitter added to the conversion time')
+    parser.add_argument('--group-sensors', type=int, default=4,
+                        help='number of sensors in the sensor group benchmark')
+    args = parser.parse_args(argv)
+
+    emulator_kwargs = dict(measure_time_ms=args.measure_time_ms,
+                           measure_jitter_ms=args.measure_jitter_ms)
+    print_results('read()', bench_read(args.samples, **emulator_kwargs))
+    print_results('calibration', bench_calibrate(args.samples * 10,
+                                                 **emulator_kwargs))
+    print_results('output_session_file loop',
+                  bench_session_loop(args.loop_samples, args.waitsec,
+                                     **emulator_kwargs))
+    print_results('BME280Group.read_raw()',
+                  bench_group_read(args.group_sensors, args.samples // 2,
+                                   **emulator_kwargs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+A compact binary alternative to the CSV dataset files.
+
+The file starts with `MAGIC`, then a little-endian uint32 giving the length
+of a JSON header describing the fields, then the header itself.  After that
+come fixed-width records, one per sample, with the time as int64 seconds
+since the epoch.  New records are just appended, and the whole file can be
+read with `numpy.memmap` without parsing anything.
+"""
+import os
+import sys
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'ENVWBIN1'
+# the records start on a multiple of this
+HEADER_ALIGN = 16
+
+
+def raw_fields(names=('pressure', 'temperature', 'humidity')):
+    """
+    The fields of a "_raw" dataset of the ADC values `names`
+    """
+    return [('time', '<i8')] + [(nm, '<i4') for nm in names]
+
+
+def cal_fields(names=('pressure', 'temperature', 'humidity')):
+    """
+    The fields of a "_cal" dataset of the calibrated values `names`
+    """
+    return [('time', '<i8')] + [(nm, '<f8') for nm in names]
+
+
+RAW_FIELDS = raw_fields()
+CAL_FIELDS = cal_fields()
+# optional, goes right after "time"
+TIME_FRAC_FIELD = ('time_frac', '<f4')
+
+
+def is_binary_dataset(fn):
+    with open(fn, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def binary_header(fields):
+    """
+    The bytes that start a dataset with the given fields (a list of
+    (name, numpy dtype string) pairs).
+    """
+    header = json.dumps({'fields': [list(field) for field in fields]})
+    header = header.encode('ascii')
+    fixedlen = len(MAGIC) + 4
+    header += b' ' * (-(fixedlen + len(header)) % HEADER_ALIGN)
+    return MAGIC + struct.pack('<I', len(header)) + header
+
+
+def create_binary_dataset(fn, fields):
+    """
+    Creates an empty dataset file `fn` with the given fields (a list of
+    (name, numpy dtype string) pairs).
+    """
+    with open(fn, 'wb') as f:
+        f.write(binary_header(fields))
+
+
+def binary_dataset_bytes(records):
+    """
+    The contents of a dataset file holding the record array `records`.
+    """
+    fields = [(nm, records.dtype[nm].str) for nm in records.dtype.names]
+    return binary_header(fields) + np.asarray(records, dtype=fields).tobytes()
+
+
+def read_binary_header(fn):
+    """
+    Returns the record dtype of the dataset `fn` and the byte offset where the
+    records start.
+    """
+    with open(fn, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('"{}" is not a binary dataset'.format(fn))
+        headerlen = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(headerlen).decode('ascii'))
+    dt = np.dtype([tuple(field) for field in header['fields']])
+    return dt, len(MAGIC) + 4 + headerlen
+
+
+def append_binary_records(fn, records, dtype):
+    """
+    Appends `records` (anything that can be made into an array of `dtype`)
+    to the dataset `fn`.
+    """
+    with open(fn, 'ab') as f:
+        f.write(np.asarray(records, dtype=dtype).tobytes())
+
+
+def read_binary_dataset(fn):
+    """
+    Returns the records in `fn` as a read-only memory-mapped record array.
+    A partly-written record at the end (from a write in progress) is left
+    out.
+    """
+    dt, offset = read_binary_header(fn)
+    nrecords = (os.path.getsize(fn) - offset) // dt.itemsize
+    if nrecords == 0:
+        # mmap can't do zero-length maps
+        return np.empty(0, dtype=dt)
+    return np.memmap(fn, dtype=dt, mode='r', offset=offset, shape=(nrecords,))
+
+
+def convert_csv_dataset(csvfn, binfn):
+    """
+    Converts the CSV dataset `csvfn` to the binary format, writing it to
+    `binfn`.  Datasets ending in "_raw" get integer fields, others get floats.
+    """
+    from .utils import read_dataset, csv_times_to_epoch
+
+    dset = read_dataset(csvfn)
+    valuedt = '<i4' if csvfn.endswith('_raw') else '<f8'
+    fields = []
+    for nm in dset.dtype.names:
+        if nm == 'time':
+            fields.append((nm, '<i8'))
+        elif nm == TIME_FRAC_FIELD[0]:
+            fields.append(TIME_FRAC_FIELD)
+        else:
+            fields.append((nm, valuedt))
+
+    out = np.empty(len(dset), dtype=fields)
+    for nm in dset.dtype.names:
+        if nm == 'time':
+            out[nm] = csv_times_to_epoch(dset[nm])
+        else:
+            out[nm] = dset[nm]
+
+    create_binary_dataset(binfn, fields)
+    append_binary_records(binfn, out, out.dtype)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python -m envwatcher.binary_dataset <csv in> <binary out>')
+        sys.exit(1)
+    convert_csv_dataset(sys.argv[1], sys.argv[2])
@@ -1,9 +1,10 @@
 import os
+import json
 import time
 import warnings
+import collections
 
 import numpy as np
-import smbus
 
 
 # register addresses
@@ -15,6 +16,10 @@ CTRL_MEAS_REGISTER = 0xF4
 CONFIG_REGISTER = 0xF5
 DATA_START = 0xF7
 
+# registers that are only changed by us, so we can keep an in-memory copy of
+# them and skip the read in read-modify-write cycles
+SHADOWED_REGISTERS = (CTRL_HUM_REGISTER, CTRL_MEAS_REGISTER, CONFIG_REGISTER)
+
 BME280_ID = 0x60
 RESET_CODE = 0xB6
 
@@ -37,12 +42,308 @@ CALIB_REGISTERS = { 'dig_T1': ('ushort', 0x88, 0x89),
                     'dig_H5': ('12lm', 0xe5, 0xe6),
                     'dig_H6': ('int8', 0xe7),
                     }
+# the calibration registers above live in two contiguous blocks, given as
+# (start register, number of bytes)
+CALIB_BLOCKS = ((0x88, 26), (0xe1, 7))
+
+# how many forced measurement times to remember for each oversampling setting
+CONVERSION_HISTORY = 256
+# a forced measurement still going after this many times the datasheet max
+# conversion time is taken to have stalled
+STALLED_MEASUREMENT_FACTOR = 10
+
+CALIB_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.envwatcher',
+                                'bme280_calibs.json')
+
+def calibrate_raw_arrays(calib_vals, pres_raw, temp_raw, hum_raw):
+    """
+    Applies the datasheet compensation formulae for the calibration values
+    `calib_vals` (as returned by `BME280Recorder.get_calibs`) to arrays of raw
+    ADC values.
+
+    Returns arrays of the pressure (kPa), temperature (deg C), and humidity
+    (RH %).
+    """
+    adc_T = _as_adc_array(temp_raw, 'int32')
+    adc_P = _as_adc_array(pres_raw, 'int64')
+    adc_H = _as_adc_array(hum_raw, 'int32')
+
+    t_fine = _compensate_t_fine(calib_vals, adc_T)
+    temp = _compensate_temp(t_fine)
+    pres = _compensate_pressure(calib_vals, adc_P, t_fine)
+    hum = _compensate_humidity(calib_vals, adc_H, t_fine)
+    return pres, temp, hum
+
+
+def _as_adc_array(val, dtype):
+    # always work on (at least) 1d arrays so that numpy's integer promotion
+    # (and hence overflow behavior) is the same for one sample as for many
+    return np.atleast_1d(np.asarray(val)).astype(dtype)
+
+
+def _match_input_shape(result, inval):
+    if np.ndim(inval) == 0:
+        return result[0]
+    else:
+        return result
+
+
+def _compensate_t_fine(calib_vals, adc_T):
+    dig_T1 = calib_vals['dig_T1'].astype('int32')
+    dig_T2 = calib_vals['dig_T2'].astype('int32')
+    dig_T3 = calib_vals['dig_T3'].astype('int32')
+
+    # from the BME280 datasheet
+    var1 = (((adc_T>>3) - (dig_T1<<1)) * dig_T2) >> 11
+    var2 = (((((adc_T>>4) - dig_T1) * ((adc_T>>4) - dig_T1)) >> 12) * dig_T3) >> 14
+    return var1 + var2
+
+
+def _compensate_temp(t_fine):
+    return ((t_fine * 5 + 128) >> 8)/100.
+
+
+def _compensate_pressure(calib_vals, adc_P, t_fine):
+    dig_P1 = calib_vals['dig_P1'].astype('int64')
+    dig_P2 = calib_vals['dig_P2'].astype('int64')
+    dig_P3 = calib_vals['dig_P3'].astype('int64')
+    dig_P4 = calib_vals['dig_P4'].astype('int64')
+    dig_P5 = calib_vals['dig_P5'].astype('int64')
+    dig_P6 = calib_vals['dig_P6'].astype('int64')
+    dig_P7 = calib_vals['dig_P7'].astype('int64')
+    dig_P8 = calib_vals['dig_P8'].astype('int64')
+    dig_P9 = calib_vals['dig_P9'].astype('int64')
+
+    var1 = t_fine.astype('int64') - 128000
+    var2 = var1 * var1 * dig_P6
+    var2 += ((var1*dig_P5)<<17)
+    var2 += ((dig_P4)<<35)
+    var1 = ((var1 * var1 * dig_P3)>>8) + ((var1 * dig_P2)<<12)
+    var1 = ((((1)<<47)+var1))*(dig_P1)>>33
+    # the datasheet gives 0 for these rather than dividing by zero
+    zerodiv = var1 == 0
+    var1[zerodiv] = 1
+
+    p = 1048576-adc_P
+    numer = (((p<<31)-var2)*3125)
+    p = numer//var1
+    # C division truncates toward zero rather than rounding down
+    p += (p < 0) & (p*var1 != numer)
+    var1 = (dig_P9 * (p>>13) * (p>>13)) >> 25
+    var2 = (dig_P8 * p) >> 19
+    p = ((p + var1 + var2) >> 8) + (dig_P7<<4)
+    # and the result is an unsigned 32-bit integer
+    p &= 0xffffffff
+    p[zerodiv] = 0
+    return p/256000.
+
+
+def _compensate_humidity(calib_vals, adc_H, t_fine):
+    dig_H1 = calib_vals['dig_H1'].astype('int32')
+    dig_H2 = calib_vals['dig_H2'].astype('int32')
+    dig_H3 = calib_vals['dig_H3'].astype('int32')
+    dig_H4 = calib_vals['dig_H4'].astype('int32')
+    dig_H5 = calib_vals['dig_H5'].astype('int32')
+    dig_H6 = calib_vals['dig_H6'].astype('int32')
+
+    var = t_fine - 76800
+    var = ((((adc_H << 14) - (dig_H4 << 20) - (dig_H5 * var)) + 16384) >> 15) * (((((((var * dig_H6) >> 10) * (((var *(dig_H3) >> 11) + 32768)) >> 10) + 2097152) * (dig_H2) + 8192) >> 14))
+    var -= (((((var >> 15) * (var >> 15)) >> 7) * dig_H1) >> 4)
+    var = np.clip(var, 0, 419430400)
+    return (var>>12)/1024.
+
+
+def _wrap32(x):
+    return ((x + 0x80000000) & 0xffffffff) - 0x80000000
+
+
+def _wrap64(x):
+    return ((x + 0x8000000000000000) & 0xffffffffffffffff) - 0x8000000000000000
+
+
+class CalibrationKernel:
+    """
+    The compensation formulae for one sample at a time, with the calibration
+    values `calib_vals` converted to plain ints once up front.  This gives the
+    same results as `calibrate_raw_arrays` (including its int32/int64
+    overflow, which is emulated), but without making numpy arrays for each
+    sample, which dominates the time that takes for a single sample.
+    """
+    __slots__ = ('T1', 'T2', 'T3', 'P1', 'P2', 'P3', 'P4', 'P5', 'P6', 'P7',
+                 'P8', 'P9', 'H1', 'H2', 'H3', 'H4', 'H5', 'H6', 'P4_35',
+                 'P7_4', 'H4_20')
+
+    def __init__(self, calib_vals):
+        for nm in CALIB_REGISTERS:
+            setattr(self, nm[4:], int(calib_vals[nm]))
+        # terms that only depend on the calibration values
+        self.P4_35 = _wrap64(self.P4 << 35)
+        self.P7_4 = _wrap64(self.P7 << 4)
+        self.H4_20 = _wrap32(self.H4 << 20)
+
+    def t_fine(self, adc_T):
+        T1 = self.T1
+        var1 = _wrap32(_wrap32(((adc_T >> 3) - (T1 << 1)) * self.T2) >> 11)
+        var2 = _wrap32((adc_T >> 4) - T1)
+        var2 = _wrap32(_wrap32(var2 * var2) >> 12)
+        var2 = _wrap32(var2 * self.T3) >> 14
+        return _wrap32(var1 + var2)
+
+    def temperature(self, t_fine):
+        return (_wrap32(t_fine * 5 + 128) >> 8)/100.
+
+    def pressure(self, adc_P, t_fine):
+        var1 = t_fine - 128000
+        var2 = _wrap64(_wrap64(var1 * var1) * self.P6)
+        var2 = _wrap64(var2 + (_wrap64(var1 * self.P5) << 17))
+        var2 = _wrap64(var2 + self.P4_35)
+        var1 = _wrap64((_wrap64(_wrap64(var1 * var1) * self.P3) >> 8) +
+                       _wrap64(_wrap64(var1 * self.P2) << 12))
+        var1 = _wrap64(_wrap64((1 << 47) + var1) * self.P1) >> 33
+
+        if var1 == 0:
+            return 0.
+
+        p = 1048576 - adc_P
+        numer = _wrap64((_wrap64(p << 31) - var2) * 3125)
+        # truncated toward zero, as in C
+        p = abs(numer) // abs(var1)
+        if (numer < 0) != (var1 < 0):
+            p = -p
+        p = _wrap64(p)
+        var1 = _wrap64(_wrap64(self.P9 * (p >> 13)) * (p >> 13)) >> 25
+        var2 = _wrap64(self.P8 * p) >> 19
+        p = ((_wrap64(p + var1 + var2) >> 8) + self.P7_4) & 0xffffffff
+        return p/256000.
+
+    def humidity(self, adc_H, t_fine):
+        var = _wrap32(t_fine - 76800)
+        x1 = _wrap32(_wrap32(_wrap32(adc_H << 14) - self.H4_20) -
+                     _wrap32(self.H5 * var))
+        x1 = _wrap32(x1 + 16384) >> 15
+        x2 = _wrap32(_wrap32(var * self.H6) >> 10)
+        x3 = _wrap32((_wrap32(var * self.H3) >> 11) + 32768)
+        x2 = _wrap32((_wrap32(x2 * x3) >> 10) + 2097152)
+        x2 = _wrap32(_wrap32(x2 * self.H2) + 8192) >> 14
+        var = _wrap32(x1 * x2)
+        x1 = var >> 15
+        var = _wrap32(var - (_wrap32(_wrap32(_wrap32(x1 * x1) >> 7) *
+                                     self.H1) >> 4))
+        var = min(max(var, 0), 419430400)
+        return (var >> 12)/1024.
+
+    def calibrate(self, pres_raw, temp_raw, hum_raw):
+        """
+        Returns the pressure (kPa), temperature (deg C), and humidity (RH %)
+        for one sample of raw ADC values.
+        """
+        t_fine = self.t_fine(_wrap32(int(temp_raw)))
+        return (self.pressure(_wrap64(int(pres_raw)), t_fine),
+                self.temperature(t_fine),
+                self.humidity(_wrap32(int(hum_raw)), t_fine))
+
+
+def _signed8(val):
+    return val - 0x100 if val & 0x80 else val
+
+
+def decode_calibs(regvals):
+    """
+    Converts a dictionary mapping calibration register address to register
+    value into the calibration values (as numpy scalars).
+    """
+    calib_vals = {}
+    for nm, typeandregs in CALIB_REGISTERS.items():
+        dt = typeandregs[0]
+        vals = [regvals[reg] for reg in typeandregs[1:]]
+
+        # these are signed 12-bit, with the sign in the whole-byte register
+        if dt == '12ml':
+            regval = _signed8(vals[0]) << 4  # 11:4
+            regval |= vals[1] & 0xf  # 3:0 -> 3:0
+            calib_vals[nm] = np.array(regval, dtype='short')
+        elif dt == '12lm':
+            regval = vals[0] >> 4  # 7:4 -> 3:0
+            regval |= _signed8(vals[1]) << 4  # 11:4
+            calib_vals[nm] = np.array(regval, dtype='short')
+        else:
+            vals = [val << (8*i) for i, val in enumerate(vals)]
+            calib_vals[nm] = np.sum(vals, dtype=dt)
+    return calib_vals
+
+
+def load_cached_calibs(cachefn, key):
+    """
+    Returns the calibration values stored under `key` in the cache file
+    `cachefn`, or None if there are none.
+    """
+    try:
+        with open(cachefn) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if key not in cache:
+        return None
+
+    return calibs_from_ints(cache[key])
+
+
+def calibs_from_ints(values):
+    """
+    Converts a dictionary of calibration value name to int into calibration
+    values with the same types as `decode_calibs` gives.
+    """
+    calib_vals = {}
+    for nm, val in values.items():
+        dt = CALIB_REGISTERS[nm][0]
+        if dt in ('12ml', '12lm'):
+            calib_vals[nm] = np.array(val, dtype='short')
+        else:
+            calib_vals[nm] = np.array(val, dtype=dt)[()]
+    return calib_vals
+
+
+def save_cached_calibs(cachefn, key, calib_vals):
+    """
+    Stores `calib_vals` under `key` in the cache file `cachefn`, keeping any
+    other devices' entries.
+    """
+    try:
+        with open(cachefn) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[key] = {nm: int(val) for nm, val in calib_vals.items()}
+
+    cachedir = os.path.dirname(cachefn)
+    if cachedir and not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    # write-then-rename so other processes never see a partial file
+    tmpfn = '{}.{}.tmp'.format(cachefn, os.getpid())
+    with open(tmpfn, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmpfn, cachefn)
+
 
 class BME280Recorder:
-    def __init__(self, address=0x77, i2cbusnum=1, mode='forced'):
+    # the names of what `read_raw` and `read` return
+    fields = ('pressure', 'temperature', 'humidity')
+
+    def __init__(self, address=0x77, i2cbusnum=1, mode='forced',
+                       calib_cache=CALIB_CACHE_PATH, refresh_calibs=False,
+                       bus=None):
         self.i2cbusnum = i2cbusnum
-        self.bus = smbus.SMBus(self.i2cbusnum)
+        # `bus` can be anything with the smbus.SMBus read_byte_data,
+        # write_byte_data, and read_i2c_block_data methods (e.g.
+        # envwatcher.emulator.EmulatedSMBus).  Default is the real I2C bus.
+        if bus is None:
+            import smbus
+            bus = smbus.SMBus(self.i2cbusnum)
+        self.bus = bus
         self.address = address
+        # set to None to always read the calibration values from the device
+        self.calib_cache = calib_cache
 
         self.check_device_present()
 
@@ -59,46 +360,89 @@ class BME280Recorder:
 
         self.mode = mode
 
-        self.calib_vals = self.get_calibs()
+        self.calib_vals = self.get_calibs(refresh=refresh_calibs)
 
-        self.sleep_factor = 5  # set to 0 to mimize read latency
+        # sets how often the status is polled while waiting for a measurement
+        # to finish: the datasheet typical-to-max spread divided by this. Set
+        # to 0 to poll continuously, which minimizes read latency.
+        self.sleep_factor = 5
+        # (temperature, pressure, humidity) oversampling -> recent forced
+        # measurement times in ms
+        self.conversion_times = {}
+        # when the measurement `collect` should wait for was started
+        self._triggered_at = None
 
     def check_device_present(self):
         devid = self.read_register(ID_REGISTER)
         if devid != BME280_ID:
             raise ValueError('Device is not a BME280 (id != 60).')
+        self.chip_id = devid
 
     def reset_device(self):
         self.bus.write_byte_data(self.address, RESET_REGISTER, RESET_CODE)
         time.sleep(0.5)  # make sure it finishes resetting
         self.check_device_present()
+        self.sync_shadow_registers()
 
-    def get_calibs(self):
+    def sync_shadow_registers(self):
+        """
+        Reads the control and config registers into the in-memory copy that
+        `set_register` uses instead of reading them before every write.
+        """
+        # these are contiguous (with the status register in the middle) so
+        # one block read gets all of them
+        startreg = min(SHADOWED_REGISTERS)
+        nregs = max(SHADOWED_REGISTERS) - startreg + 1
+        block = self.bus.read_i2c_block_data(self.address, startreg, nregs)
+        self._shadow_regs = {reg: block[reg - startreg]
+                             for reg in SHADOWED_REGISTERS}
+
+        # a forced measurement might be in progress, but the device goes
+        # back to sleep mode when it's done, so that's what we keep
+        measval = self._shadow_regs[CTRL_MEAS_REGISTER]
+        if measval & 0b11 != 0b11:
+            self._shadow_regs[CTRL_MEAS_REGISTER] = measval & ~0b11
+
+    def get_calibs(self, refresh=False):
+        """
+        Returns the calibration values.  These come from the calibration cache
+        file if one is set and it has an entry for this device, unless
+        `refresh` is True.  Otherwise they are read from the device (and
+        stored in the cache).
+        """
+        cache_key = 'bus{}_{:#04x}_{:#04x}'.format(self.i2cbusnum, self.address,
+                                                  self.chip_id)
+        if self.calib_cache and not refresh:
+            calib_vals = load_cached_calibs(self.calib_cache, cache_key)
+            if calib_vals is not None:
+                return calib_vals
+
+        calib_vals = self.read_calibs()
+
+        if self.calib_cache:
+            try:
+                save_cached_calibs(self.calib_cache, cache_key, calib_vals)
+            except OSError as e:
+                warnings.warn('Could not write calibration cache "{}": '
+                              '{}'.format(self.calib_cache, e))
+        return calib_vals
+
+    def read_calibs(self):
+        """
+        Reads the calibration values from the device, one block read per
+        block of calibration registers.
+        """
         # need to wait for the calibration parameters to finish copying if
         # this is tried right after a reset.
         while self.is_im_updating():
             time.sleep(.001)
-        calib_vals = {}
-        for nm, typeandregs in CALIB_REGISTERS.items():
-            dt = typeandregs[0]
-            regs = typeandregs[1:]
-
-            regvals = []
-            for i, reg in enumerate(regs):
-                    regvals.append(self.read_register(reg))
-
-            if dt == '12ml':
-                regval = regvals[0] << 4  # 11:4
-                regval += regvals[1] & 0b111  # 3:0 -> 3:0
-                calib_vals[nm] = np.array(regval, dtype='short')
-            elif dt == '12lm':
-                regval = regvals[0] & 0b11110000  # 7:4 -> 3:0
-                regval += regvals[1]  # 11:4
-                calib_vals[nm] = np.array(regval, dtype='short')
-            else:
-                regvals = [val << (8*i) for i, val in enumerate(regvals)]
-                calib_vals[nm] = np.sum(regvals, dtype=dt)
-        return calib_vals
+
+        regvals = {}
+        for startreg, nbytes in CALIB_BLOCKS:
+            block = self.bus.read_i2c_block_data(self.address, startreg, nbytes)
+            for i, val in enumerate(block):
+                regvals[startreg + i] = val
+        return decode_calibs(regvals)
 
     def read_register(self, regaddr):
         return self.bus.read_byte_data(self.address, regaddr)
@@ -112,13 +456,28 @@ class BME280Recorder:
         if nbits == 8:
             new_regval = val
         else:
-            regval = self.read_register(regaddr)
+            if regaddr in self._shadow_regs:
+                regval = self._shadow_regs[regaddr]
+            else:
+                regval = self.read_register(regaddr)
             # first clear out the old value
             new_regval = regval & ~((2**nbits-1) << startbit)
             # now apply the new one
             new_regval |= val << startbit
 
         self.bus.write_byte_data(self.address, regaddr, new_regval)
+        if regaddr in SHADOWED_REGISTERS:
+            self._shadow_regs[regaddr] = new_regval
+
+    def _trigger_measurement(self):
+        """
+        Starts a forced-mode measurement with a single write.  The shadow copy
+        of ctrl_meas is left in sleep mode since that's where the device goes
+        once the measurement is done.
+        """
+        measval = self._shadow_regs[CTRL_MEAS_REGISTER]
+        self.bus.write_byte_data(self.address, CTRL_MEAS_REGISTER,
+                                 (measval & ~0b11) | 0b01)
 
     def read_raw(self, doforce=True):
         """
@@ -128,22 +487,30 @@ class BME280Recorder:
         Note that if `doforce` is False and the device is in forced mode, a new
         measurement will *not* be made.
         """
-        if doforce and self._mode == 'forced':
-            self.set_register(CTRL_MEAS_REGISTER, 0b01, 0, 2)
+        if doforce:
+            self.trigger()
+        return self.collect()
 
-            # need to wait for the measurement to be done. For the default mode
-            # this seems to be ~10 ms, but it could be down to ~1 ms or as high
-            # as a few hundred.  So we check the status register at a rate
-            # based on the estimate from datasheet section 9.1
-            if self.sleep_factor == 0:
-                while self.is_measuring():
-                    continue
-            else:
-                sleep_time = self.t_measure_estimate[0] / self.sleep_factor / 1000.
-                while self.is_measuring():
-                    time.sleep(sleep_time)
+    def trigger(self):
+        """
+        Starts a measurement (if in forced mode) for `collect` to pick up,
+        without waiting for it.  Other work (like triggering other sensors)
+        can be done while it's converting.
+        """
+        if self._mode == 'forced':
+            self._trigger_measurement()
+            self._triggered_at = time.perf_counter()
 
-        data_regs = self.bus.read_i2c_block_data(0x77, DATA_START, 8)
+    def collect(self):
+        """
+        Waits for the measurement started by `trigger` (if any) to finish and
+        returns the raw values, as `read_raw` does.
+        """
+        if self._triggered_at is not None:
+            self._wait_for_measurement(self._triggered_at)
+            self._triggered_at = None
+
+        data_regs = self.bus.read_i2c_block_data(self.address, DATA_START, 8)
 
         pres_val = data_regs[2] >> 4
         pres_val +=  data_regs[1] << 4
@@ -157,6 +524,86 @@ class BME280Recorder:
 
         return pres_val, temp_val, hum_val
 
+    def _wait_for_measurement(self, sttime=None):
+        """
+        Waits for a forced measurement triggered at `sttime` (a
+        `time.perf_counter` time, default now) to be done.  Sleeps straight
+        to when it should finish and only then starts polling the status
+        register.
+        """
+        if sttime is None:
+            sttime = time.perf_counter()
+
+        # For the default mode this is ~10 ms, but it could be down to ~1 ms
+        # or as high as a few hundred.  So the expected time is learned from
+        # the measurements so far (or from the datasheet section 9.1 estimate
+        # until there are enough), but never taken to be more than the
+        # datasheet max.
+        typ, mx = self.t_measure_estimate
+        if self.sleep_factor == 0:
+            poll_time = 0
+        else:
+            poll_time = (mx - typ) / self.sleep_factor / 1000.
+        times = self.conversion_times.get(self._oversampling_key)
+        if times is None or len(times) < 5:
+            expected = typ / 1000.
+        else:
+            expected = min(np.percentile(times, 10), mx) / 1000.
+        # aim early (by half the typical-to-max spread) so that the
+        # measurement is usually seen finishing, which is when its time is
+        # known best
+        expected -= (mx - typ) / 2000.
+
+        # some of it may have gone by already
+        expected -= time.perf_counter() - sttime
+        if expected > 0:
+            time.sleep(expected)
+        seen_measuring = False
+        stalled_at = sttime + STALLED_MEASUREMENT_FACTOR * mx / 1000.
+        while self.is_measuring():
+            seen_measuring = True
+            if time.perf_counter() > stalled_at:
+                # the old values get read, and the recorder resets the
+                # device when it sees the same values twice
+                warnings.warn('BME280 measurement did not finish in {:.0f} '
+                              'ms'.format((stalled_at - sttime) * 1000))
+                return
+            if poll_time:
+                time.sleep(poll_time)
+
+        if not seen_measuring and expected <= 0:
+            # it finished before the caller even got here (e.g. while another
+            # sensor in a group was being waited for), which says nothing
+            # about how long it took
+            return
+        # If the finish wasn't seen after the sleep above, all that's known is
+        # that it took less time than this.  That's still recorded: the sleep
+        # is aimed early, so it's shorter than the times the aim came from,
+        # and the aim moves earlier (by about half the datasheet spread each
+        # time) until finishes are seen again.
+        meas_ms = (time.perf_counter() - sttime) * 1000
+        if times is None:
+            times = collections.deque(maxlen=CONVERSION_HISTORY)
+            self.conversion_times[self._oversampling_key] = times
+        times.append(meas_ms)
+
+    @property
+    def _oversampling_key(self):
+        return (self.temperature_oversampling, self.pressure_oversampling,
+                self.humidity_oversampling)
+
+    def conversion_time_histogram(self, bins=20, oversampling=None):
+        """
+        Returns a histogram of the forced measurement times seen so far, as
+        the (counts, bin edges in ms) from `numpy.histogram`.  `oversampling`
+        is the (temperature, pressure, humidity) oversampling to get them for,
+        defaulting to the current settings.
+        """
+        if oversampling is None:
+            oversampling = self._oversampling_key
+        times = self.conversion_times.get(tuple(oversampling), [])
+        return np.histogram(list(times), bins=bins)
+
     def read(self, read_raw=None):
         """
         Reads the current pressure, temperature, humidity values and returns
@@ -165,42 +612,50 @@ class BME280Recorder:
         If `read_raw` is given, it's an already-read set of raw values.
         """
         if read_raw is None:
-            pres_raw, temp_raw, hum_raw = self.read_raw()
-        else:
-            pres_raw, temp_raw, hum_raw = read_raw
+            read_raw = self.read_raw()
+        return self._kernel.calibrate(*read_raw)
 
-        t_fine_in = -self._raw_to_t_fine(temp_raw)
-        temp = self.raw_to_calibrated_temp(t_fine_in)
-        pres = self.raw_to_calibrated_pressure(pres_raw, t_fine_in)
-        hum = self.raw_to_calibrated_humidity(hum_raw, t_fine_in)
-        return pres, temp, hum
+    @property
+    def calib_vals(self):
+        return self._calib_vals
+    @calib_vals.setter
+    def calib_vals(self, val):
+        self._calib_vals = val
+        self._kernel = CalibrationKernel(val)
+
+    def calibrations(self):
+        """
+        Returns a list of (names of the values, calibration values) for each
+        sensor - just this one here.
+        """
+        return [(self.fields, self.calib_vals)]
 
+    def calibrate_raw_arrays(self, pres_raw, temp_raw, hum_raw):
+        """
+        Vectorized form of `read` for already-read raw values.  Takes
+        same-length arrays of raw pressure, temperature, and humidity ADC
+        values (e.g. the columns of a "_raw" dataset) and returns arrays of
+        the calibrated pressure, temperature, and humidity.
+
+        This uses the same integer formulae as the single-sample methods, so
+        the results are identical to calling `read` on each sample.
+        """
+        return calibrate_raw_arrays(self.calib_vals, pres_raw, temp_raw, hum_raw)
 
     def _raw_to_t_fine(self, rawtemp):
         """
         Used in all the other calibration formulae
         """
-        if rawtemp < 0:
-            return -rawtemp
-        else:
-            T_adc = np.array(rawtemp, dtype='int32')
-            dig_T1 = self.calib_vals['dig_T1'].astype('int32')
-            dig_T2 = self.calib_vals['dig_T2'].astype('int32')
-            dig_T3 = self.calib_vals['dig_T3'].astype('int32')
-
-            # from the BME280 datasheet
-            var1 = (((T_adc>>3) - (dig_T1<<1)) * dig_T2) >> 11
-            var2 = (((((T_adc>>4) - dig_T1) * ((T_adc>>4) - dig_T1)) >> 12) * dig_T3) >> 14
-            return var1 + var2
-
+        rawtemp = _as_adc_array(rawtemp, 'int32')
+        t_fine = _compensate_t_fine(self.calib_vals, rawtemp)
+        return np.where(rawtemp < 0, -rawtemp, t_fine)
 
     def raw_to_calibrated_temp(self, rawtemp):
         """
         If rawtemp is negative, it's interpreted as -t_fine
         """
         t_fine = self._raw_to_t_fine(rawtemp)
-        deg_C = ((t_fine * 5 + 128) >> 8)/100.
-        return deg_C
+        return _match_input_shape(_compensate_temp(t_fine), rawtemp)
 
     def raw_to_calibrated_pressure(self, rawpressure, rawtemp):
         """
@@ -209,52 +664,18 @@ class BME280Recorder:
         Returns pressure in kPa
         """
         t_fine = self._raw_to_t_fine(rawtemp)
-
-        adc_P = np.array(rawpressure, dtype='int64')
-        dig_P1 = self.calib_vals['dig_P1'].astype('int64')
-        dig_P2 = self.calib_vals['dig_P2'].astype('int64')
-        dig_P3 = self.calib_vals['dig_P3'].astype('int64')
-        dig_P4 = self.calib_vals['dig_P4'].astype('int64')
-        dig_P5 = self.calib_vals['dig_P5'].astype('int64')
-        dig_P6 = self.calib_vals['dig_P6'].astype('int64')
-        dig_P7 = self.calib_vals['dig_P7'].astype('int64')
-        dig_P8 = self.calib_vals['dig_P8'].astype('int64')
-        dig_P9 = self.calib_vals['dig_P9'].astype('int64')
-
-        var1 = t_fine - 128000
-        var2 = var1 * var1 * dig_P6
-        var2 += ((var1*dig_P5)<<17)
-        var2 += ((dig_P4)<<35)
-        var1 = ((var1 * var1 * dig_P3)>>8) + ((var1 * dig_P2)<<12)
-        var1 = ((((1)<<47)+var1))*(dig_P1)>>33
-
-        p = 1048576-adc_P
-        p = (((p<<31)-var2)*3125)//var1
-        var1 = (dig_P9 * (p>>13) * (p>>13)) >> 25
-        var2 = (dig_P8 * p) >> 19
-        p = ((p + var1 + var2) >> 8) + (dig_P7<<4)
-        return p/256000.
+        adc_P = _as_adc_array(rawpressure, 'int64')
+        p = _compensate_pressure(self.calib_vals, adc_P, t_fine)
+        return _match_input_shape(p, rawpressure)
 
     def raw_to_calibrated_humidity(self, rawhumidity, rawtemp):
         """
         If rawtemp is negative, it's interpreted as -t_fine
         """
         t_fine = self._raw_to_t_fine(rawtemp)
-
-        adc_H = np.array(rawhumidity, dtype='int32')
-        dig_H1 = self.calib_vals['dig_H1'].astype('int32')
-        dig_H2 = self.calib_vals['dig_H2'].astype('int32')
-        dig_H3 = self.calib_vals['dig_H3'].astype('int32')
-        dig_H4 = self.calib_vals['dig_H4'].astype('int32')
-        dig_H5 = self.calib_vals['dig_H5'].astype('int32')
-        dig_H6 = self.calib_vals['dig_H6'].astype('int32')
-
-        var = t_fine - 76800
-        var = ((((adc_H << 14) - (dig_H4 << 20) - (dig_H5 * var)) + 16384) >> 15) * (((((((var * dig_H6) >> 10) * (((var *(dig_H3) >> 11) + 32768)) >> 10) + 2097152) * (dig_H2) + 8192) >> 14))
-        var -= (((((var >> 15) * (var >> 15)) >> 7) * dig_H1) >> 4)
-        var.ravel()[var.ravel()<0] = 0
-        var.ravel()[var.ravel()>419430400] = 419430400
-        return (var>>12)/1024.
+        adc_H = _as_adc_array(rawhumidity, 'int32')
+        h = _compensate_humidity(self.calib_vals, adc_H, t_fine)
+        return _match_input_shape(h, rawhumidity)
 
     @property
     def mode(self):
@@ -330,7 +751,7 @@ class BME280Recorder:
 
         # Datasheet 5.4.5 says you need to write to the ctrl_meas to get the
         # humidity settings to change
-        measval = self.read_register(CTRL_MEAS_REGISTER)
+        measval = self._shadow_regs[CTRL_MEAS_REGISTER]
         self.set_register(CTRL_MEAS_REGISTER, measval)
 
         self._humidity_oversampling = val
@@ -457,7 +878,7 @@ class BME280Recorder:
                 continue  # clear out any existing measurement in progress
 
             i = 0
-            self.set_register(CTRL_MEAS_REGISTER, 0b01, 0, 2)
+            self._trigger_measurement()
             t1 = time.time()
             while self.is_measuring():
                 i += 1
@@ -0,0 +1,242 @@
+"""
+Checks the Python calibration against the C reference in testcal.c (the
+datasheet's compensation code), and times both:
+
+    python -m envwatcher.calibration_harness
+
+testcal.c is compiled (with a C compiler on the path, or $CC) into a shared
+library that's called through ctypes.  Raw ADC values are swept through it,
+`CalibrationKernel` (the per-sample path), and `calibrate_raw_arrays` (the
+vectorized path), and the results have to be exactly the same.
+"""
+import os
+import sys
+import time
+import ctypes
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+import numpy as np
+
+from .bme280 import (CALIB_REGISTERS, CalibrationKernel, calibrate_raw_arrays,
+                     calibs_from_ints)
+from .benchmarks import print_results
+
+TESTCAL_PATH = os.path.join(os.path.dirname(os.path.dirname(
+                            os.path.abspath(__file__))), 'testcal.c')
+
+# calls the testcal.c functions for arrays of samples
+_BATCH_SOURCE = """
+#define TESTCAL_LIBRARY
+#include "{testcal}"
+
+void compensate_batch(const BME280_S32_t *adc_P, const BME280_S32_t *adc_T,
+                      const BME280_S32_t *adc_H, long n, BME280_S32_t *temp,
+                      BME280_U32_t *pres, BME280_U32_t *hum)
+{{
+    long i;
+    for (i = 0; i < n; i++) {{
+        temp[i] = BME280_compensate_T_int32(adc_T[i]);
+        pres[i] = BME280_compensate_P_int64(adc_P[i]);
+        hum[i] = bme280_compensate_H_int32(adc_H[i]);
+    }}
+}}
+"""
+
+# the ranges of the raw values (pressure and temperature are 20 bits,
+# humidity 16) and of the calibration values of each type
+ADC_BITS = (20, 20, 16)
+CALIB_RANGES = {'ushort': (0, 0xffff), 'short': (-0x8000, 0x7fff),
+                'uint8': (0, 0xff), 'int8': (-0x80, 0x7f),
+                '12ml': (-0x800, 0x7ff), '12lm': (-0x800, 0x7ff)}
+
+
+class ReferenceCalibration:
+    """
+    testcal.c built as a library in `builddir` (a temporary directory if not
+    given).  Its hard-coded calibration values are used unless changed with
+    `set_calibs`.
+    """
+    def __init__(self, source=TESTCAL_PATH, builddir=None, cc=None):
+        if cc is None:
+            cc = os.environ.get('CC', 'cc')
+        self._tmpdir = None
+        if builddir is None:
+            builddir = self._tmpdir = tempfile.mkdtemp()
+
+        batchfn = os.path.join(builddir, 'testcal_batch.c')
+        libfn = os.path.join(builddir, 'testcal_batch.so')
+        with open(batchfn, 'w') as f:
+            f.write(_BATCH_SOURCE.format(testcal=os.path.abspath(source)))
+        # -fwrapv so signed overflow wraps (as the datasheet code expects)
+        # rather than being undefined
+        subprocess.check_call([cc, '-O2', '-fwrapv', '-shared', '-fPIC',
+                               '-o', libfn, batchfn])
+
+        self.lib = ctypes.CDLL(libfn)
+        s32p = np.ctypeslib.ndpointer(np.int32, flags='C_CONTIGUOUS')
+        u32p = np.ctypeslib.ndpointer(np.uint32, flags='C_CONTIGUOUS')
+        self.lib.compensate_batch.argtypes = [s32p, s32p, s32p, ctypes.c_long,
+                                              s32p, u32p, u32p]
+        self.lib.compensate_batch.restype = None
+
+    @property
+    def calib_vals(self):
+        """
+        The calibration values the library is using.
+        """
+        return calibs_from_ints({nm: ctypes.c_int.in_dll(self.lib, nm).value
+                                 for nm in CALIB_REGISTERS})
+
+    def set_calibs(self, calib_vals):
+        for nm in CALIB_REGISTERS:
+            ctypes.c_int.in_dll(self.lib, nm).value = int(calib_vals[nm])
+
+    def calibrate(self, pres_raw, temp_raw, hum_raw):
+        """
+        Returns arrays of the pressure (kPa), temperature (deg C), and
+        humidity (RH %) for arrays of raw values, like `calibrate_raw_arrays`.
+        """
+        adc_P = np.ascontiguousarray(pres_raw, dtype=np.int32)
+        adc_T = np.ascontiguousarray(temp_raw, dtype=np.int32)
+        adc_H = np.ascontiguousarray(hum_raw, dtype=np.int32)
+        n = len(adc_P)
+        temp = np.empty(n, dtype=np.int32)
+        pres = np.empty(n, dtype=np.uint32)
+        hum = np.empty(n, dtype=np.uint32)
+        self.lib.compensate_batch(adc_P, adc_T, adc_H, n, temp, pres, hum)
+        return pres/256000., temp/100., hum/1024.
+
+    def close(self):
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir)
+            self._tmpdir = None
+
+
+def random_raw(rng, n):
+    """
+    `n` random (pressure, temperature, humidity) raw values covering the
+    whole ADC ranges.
+    """
+    return tuple(rng.integers(0, 2**nbits, n) for nbits in ADC_BITS)
+
+
+def random_calibs(rng):
+    return calibs_from_ints({nm: int(rng.integers(lo, hi, endpoint=True))
+                             for nm, (lo, hi) in
+                             [(nm, CALIB_RANGES[regs[0]])
+                              for nm, regs in CALIB_REGISTERS.items()]})
+
+
+def _mismatches(results, expected):
+    bad = np.zeros(len(expected[0]), dtype=bool)
+    for res, exp in zip(results, expected):
+        bad |= np.asarray(res) != exp
+    return np.flatnonzero(bad)
+
+
+def compare(reference, calib_vals, raw, scalar_samples=None):
+    """
+    Calibrates the raw (pressure, temperature, humidity) arrays `raw` with
+    `calib_vals` in C (`reference`), with `calibrate_raw_arrays`, and with a
+    `CalibrationKernel` (for only the first `scalar_samples` if given).
+
+    Returns a dictionary with the time each took (sec), and the indices of
+    the samples where each of the Python versions differ from C.
+    """
+    reference.set_calibs(calib_vals)
+    nscalar = len(raw[0]) if scalar_samples is None else scalar_samples
+
+    st = time.perf_counter()
+    expected = reference.calibrate(*raw)
+    ctime = time.perf_counter() - st
+
+    st = time.perf_counter()
+    vectorized = calibrate_raw_arrays(calib_vals, *raw)
+    vtime = time.perf_counter() - st
+
+    kernel = CalibrationKernel(calib_vals)
+    rawlists = [arr[:nscalar].tolist() for arr in raw]
+    scalar = ([], [], [])
+    st = time.perf_counter()
+    for sample in zip(*rawlists):
+        for res, val in zip(scalar, kernel.calibrate(*sample)):
+            res.append(val)
+    stime = time.perf_counter() - st
+
+    return {'C time': ctime, 'vectorized time': vtime, 'scalar time': stime,
+            'vectorized mismatches': _mismatches(vectorized, expected),
+            'scalar mismatches': _mismatches(scalar, [exp[:nscalar]
+                                                      for exp in expected])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, default=2000000,
+                        help='raw triples to sweep per calibration set')
+    parser.add_argument('--scalar-samples', type=int, default=200000,
+                        help='how many of those to also run through the '
+                             '(much slower) per-sample path')
+    parser.add_argument('--random-calibs', type=int, default=0,
+                        help='number of random calibration sets to check, in '
+                             'addition to the testcal.c ones')
+    parser.add_argument('--chunk', type=int, default=1000000,
+                        help='raw triples generated at a time')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--source', default=TESTCAL_PATH,
+                        help='path of testcal.c')
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    reference = ReferenceCalibration(args.source)
+    try:
+        calibsets = [('testcal.c', reference.calib_vals)]
+        calibsets += [('random set {}'.format(i + 1), random_calibs(rng))
+                      for i in range(args.random_calibs)]
+
+        nbad = 0
+        for name, calib_vals in calibsets:
+            times = {'C': 0., 'vectorized': 0., 'scalar': 0.}
+            nvectorized = nscalar = 0
+            mismatched = {'vectorized': 0, 'scalar': 0}
+            while nvectorized < args.samples:
+                n = min(args.chunk, args.samples - nvectorized)
+                m = min(n, args.scalar_samples - nscalar)
+                raw = random_raw(rng, n)
+                results = compare(reference, calib_vals, raw, m)
+                for nm in times:
+                    times[nm] += results[nm + ' time']
+                for nm in mismatched:
+                    bad = results[nm + ' mismatches']
+                    mismatched[nm] += len(bad)
+                    if len(bad):
+                        i = bad[0]
+                        print('{} {} mismatch for raw (pressure, temperature, '
+                              'humidity) = {}'.format(name, nm,
+                                                      tuple(int(arr[i])
+                                                            for arr in raw)))
+                nvectorized += n
+                nscalar += m
+
+            summary = {'samples': nvectorized, 'scalar samples': nscalar}
+            for nm, secs in times.items():
+                count = nscalar if nm == 'scalar' else nvectorized
+                if count:
+                    summary[nm + ' samples/sec'] = count / secs
+            for nm, count in mismatched.items():
+                summary[nm + ' mismatches'] = count
+                nbad += count
+            print_results(name, summary)
+    finally:
+        reference.close()
+
+    if nbad:
+        print('FAILED: the Python calibration differs from testcal.c')
+        sys.exit(1)
+    print('OK: the Python calibration matches testcal.c exactly')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+A long-running recorder that keeps the sensor open and records series on
+request, controlled over a Unix socket:
+
+    python -m envwatcher.daemon <datasets dir> --socket <socket path>
+
+The protocol is a JSON object per line in each direction.  Requests have a
+"command" of "start" (with "series" and any of `SESSION_PARAMS`), "stop",
+"reconfigure" (with any of `SESSION_PARAMS` - the series carries on with
+those changed), or "status".  Responses have "ok", and "error" if it's
+false.
+"""
+import os
+import json
+import signal
+import inspect
+import socket
+import argparse
+import threading
+import socketserver
+
+from .file_recorder import output_session_file, _raise_system_exit
+
+# the output_session_file arguments that can be set by commands
+SESSION_PARAMS = ('waitsec', 'writecal', 'writeraw', 'writeplots', 'setled',
+                  'binary', 'flush_rows', 'flush_interval', 'fsync',
+                  'subsecond', 'rollups', 'plot_interval')
+DEFAULT_PROGRESS_NAME = 'recorder_progress'
+
+
+class RecorderDaemon:
+    """
+    Records series from `bme280` into `datasets_dir` (one at a time) in a
+    background thread, writing progress to `progressfn` (default:
+    "recorder_progress" in `datasets_dir`).
+    """
+    def __init__(self, bme280, datasets_dir, progressfn=None):
+        self.bme280 = bme280
+        self.datasets_dir = datasets_dir
+        if progressfn is None:
+            progressfn = os.path.join(datasets_dir, DEFAULT_PROGRESS_NAME)
+        self.progressfn = progressfn
+
+        self.series = None
+        self.params = {}
+        self.last_error = None
+        self._thread = None
+        self._stop_event = None
+        self._lock = threading.RLock()
+
+    @property
+    def recording(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def check_params(self, series, params):
+        """
+        Raises a ValueError if `series` and `params` can't be used to start
+        recording.
+        """
+        for nm in params:
+            if nm not in SESSION_PARAMS:
+                raise ValueError('Unknown session parameter "{}"'.format(nm))
+        if not series or os.path.basename(series) != series or series[0] == '.':
+            raise ValueError('Invalid series name "{}"'.format(series))
+        try:
+            inspect.signature(output_session_file).bind(
+                self.bme280, os.path.join(self.datasets_dir, series),
+                progressfn=self.progressfn, **params)
+        except TypeError as e:
+            raise ValueError(str(e))
+
+    def start(self, series, **params):
+        """
+        Starts recording `series`, returning once the recorder has set up its
+        files.  If that fails, raises a RuntimeError with the reason (and
+        the recorder removes any files it had created).
+        """
+        self.check_params(series, params)
+
+        with self._lock:
+            if self.recording:
+                raise RuntimeError('Already recording series '
+                                   '"{}"'.format(self.series))
+            self.last_error = None
+            self._stop_event = threading.Event()
+            started = threading.Event()
+            self._thread = threading.Thread(target=self._record,
+                                            args=(series, params,
+                                                  self._stop_event, started))
+            self._thread.start()
+            started.wait()
+            if self.last_error is not None:
+                self._thread.join()
+                self._thread = None
+                raise RuntimeError('Could not record series "{}": '
+                                   '{}'.format(series, self.last_error))
+            self.series = series
+            self.params = params
+
+    def _record(self, series, params, stop_event, started):
+        fn = os.path.join(self.datasets_dir, series)
+        try:
+            output_session_file(self.bme280, fn, progressfn=self.progressfn,
+                                stop_event=stop_event, started=started,
+                                **params)
+        except Exception as e:
+            self.last_error = repr(e)
+        finally:
+            # if it failed before it started
+            started.set()
+
+    def stop(self):
+        """
+        Stops recording, returning once everything is written out.
+        """
+        with self._lock:
+            if self._thread is not None:
+                self._stop_event.set()
+                self._thread.join()
+                self._thread = None
+
+    def reconfigure(self, **params):
+        """
+        Restarts the series being recorded with the given parameters changed.
+        If it can't be restarted with them, it carries on with the old ones.
+        """
+        with self._lock:
+            if not self.recording:
+                raise RuntimeError('Not recording')
+            oldparams = self.params
+            newparams = dict(oldparams)
+            newparams.update(params)
+            self.check_params(self.series, newparams)
+
+            self.stop()
+            try:
+                self.start(self.series, **newparams)
+            except RuntimeError as e:
+                self.start(self.series, **oldparams)
+                # so the error's still reported
+                self.last_error = str(e)
+                raise
+
+    def status(self):
+        return {'recording': self.recording,
+                'series': self.series,
+                'params': self.params,
+                'last_error': self.last_error}
+
+    def handle(self, request):
+        """
+        Carries out the command in the `request` dictionary, returning the
+        response dictionary.
+        """
+        args = dict(request)
+        command = args.pop('command', None)
+        try:
+            if command == 'start':
+                self.start(args.pop('series', None), **args)
+            elif command == 'stop':
+                self.stop()
+            elif command == 'reconfigure':
+                self.reconfigure(**args)
+            elif command != 'status':
+                raise ValueError('Unknown command "{}"'.format(command))
+        except (ValueError, TypeError, RuntimeError) as e:
+            return {'ok': False, 'error': str(e)}
+
+        response = self.status()
+        response['ok'] = True
+        return response
+
+    def serve(self, socketpath):
+        """
+        Takes commands on the Unix socket `socketpath` until interrupted.
+        """
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line.decode())
+                    except ValueError:
+                        response = {'ok': False, 'error': 'Invalid JSON'}
+                    else:
+                        response = daemon.handle(request)
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+
+        if os.path.exists(socketpath):
+            os.unlink(socketpath)
+        server = socketserver.ThreadingUnixStreamServer(socketpath, Handler)
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(socketpath)
+
+
+def send_command(socketpath, command, timeout=10, **args):
+    """
+    Sends `command` (with `args`) to the daemon listening on `socketpath`,
+    and returns its response.
+    """
+    request = dict(args)
+    request['command'] = command
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socketpath)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline().decode())
+
+
+def _parse_sensor(val):
+    busnum, address = val.split(':')
+    return int(busnum), int(address, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('datasets_dir', help='where to write the series')
+    parser.add_argument('--socket', required=True,
+                        help='path of the Unix socket to take commands on')
+    parser.add_argument('--progress', default=None,
+                        help='progress file (default: "{}" in the datasets '
+                             'dir)'.format(DEFAULT_PROGRESS_NAME))
+    parser.add_argument('--sensor', action='append', type=_parse_sensor,
+                        dest='sensors',
+                        help='<I2C bus number>:<address> of a BME280 to '
+                             'record (default: 1:0x77).  Give more than once '
+                             'to sample several together.')
+    args = parser.parse_args(argv)
+
+    from .sensor_group import make_recorder
+
+    bme280 = make_recorder(args.sensors or [(1, 0x77)])
+    bme280.read()
+    daemon = RecorderDaemon(bme280, os.path.abspath(args.datasets_dir),
+                            args.progress)
+
+    # SIGTERM should also finish writing the series
+    signal.signal(signal.SIGTERM, _raise_system_exit)
+    try:
+        daemon.serve(args.socket)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
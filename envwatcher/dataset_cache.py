@@ -0,0 +1,185 @@
+"""
+An in-memory cache of parsed datasets that only parses what has been
+appended since the last look.
+"""
+import io
+import os
+import threading
+import collections
+
+import numpy as np
+
+from .utils import dataset_dtype
+from .binary_dataset import is_binary_dataset, read_binary_header
+from .derived import DerivedColumns
+from .raw_calibration import (raw_only_series, read_calib_snapshot,
+                              calibrated_dtype, calibrate_raw_records)
+
+
+class _CachedDataset:
+    def __init__(self, fn):
+        self.fn = fn
+        st = os.stat(fn)
+        self.fileid = (st.st_dev, st.st_ino)
+
+        self.binary = is_binary_dataset(fn)
+        if self.binary:
+            self.dtype, self.offset = read_binary_header(fn)
+        else:
+            with open(fn, 'rb') as f:
+                firstline = f.readline()
+            self.dtype = dataset_dtype(firstline.decode().strip().split(','))
+            self.offset = len(firstline)
+
+        self.data = np.empty(0, dtype=self.dtype)
+        self.nrows = 0
+        self.derived = DerivedColumns()
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.derived.nbytes
+
+    def is_stale(self, st):
+        """
+        True if the file has been replaced or truncated since it was parsed.
+        """
+        return (st.st_dev, st.st_ino) != self.fileid or st.st_size < self.offset
+
+    def update(self, size):
+        """
+        Parses anything added to the file since the last update.
+        """
+        if size == self.offset:
+            return
+
+        with open(self.fn, 'rb') as f:
+            f.seek(self.offset)
+            newbytes = f.read(size - self.offset)
+
+        # only take complete rows - the rest may still be being written
+        if self.binary:
+            nnew = len(newbytes) // self.dtype.itemsize
+            nbytes = nnew * self.dtype.itemsize
+            newrows = np.frombuffer(newbytes[:nbytes], dtype=self.dtype)
+        else:
+            nbytes = newbytes.rfind(b'\n') + 1
+            if nbytes == 0:
+                return
+            text = io.StringIO(newbytes[:nbytes].decode())
+            newrows = np.loadtxt(text, self.dtype, delimiter=',', ndmin=1)
+
+        self._append(newrows)
+        self.offset += nbytes
+
+    def _append(self, newrows):
+        nrows = self.nrows + len(newrows)
+        if nrows > len(self.data):
+            # grow geometrically so appending stays O(new rows) on average.
+            # Views of the old array handed out before stay valid.
+            newdata = np.empty(max(nrows, 2*len(self.data)), dtype=self.dtype)
+            newdata[:self.nrows] = self.data[:self.nrows]
+            self.data = newdata
+        self.data[self.nrows:nrows] = newrows
+        self.nrows = nrows
+
+    def rows(self):
+        view = self.data[:self.nrows]
+        view.flags.writeable = False
+        return view
+
+
+class _CalibratedDataset(_CachedDataset):
+    """
+    The "_cal" dataset `fn` of raw-only series `series`, calibrated from its
+    "_raw" dataset as rows are added to that.
+    """
+    def __init__(self, fn, series):
+        self.fn = fn
+        self.raw = _CachedDataset(series + '_raw')
+        self.calibrations = read_calib_snapshot(series)
+        self.fileid = self.raw.fileid
+        self.dtype = calibrated_dtype(self.raw.dtype)
+
+        self.data = np.empty(0, dtype=self.dtype)
+        self.nrows = 0
+        self.derived = DerivedColumns()
+
+    @property
+    def offset(self):
+        return self.raw.offset
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.derived.nbytes + self.raw.nbytes
+
+    def update(self, size):
+        """
+        Parses and calibrates anything added to the "_raw" file since the
+        last update.
+        """
+        nold = self.raw.nrows
+        self.raw.update(size)
+        if self.raw.nrows > nold:
+            self._append(calibrate_raw_records(self.raw.rows()[nold:],
+                                               self.calibrations))
+
+
+class DatasetCache:
+    """
+    Caches parsed datasets (CSV or binary), keeping track of how far into
+    each file it has parsed so that `get` only has to parse the rows added
+    since the last call.  Datasets are dropped least-recently-used first
+    once they take up more than `max_bytes`, and re-read from scratch if the
+    file is truncated or replaced.
+
+    The derived columns (see `derived`) of each dataset are cached along
+    with it, and likewise only worked out for new rows.
+    """
+    def __init__(self, max_bytes=64*2**20):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fn):
+        """
+        Returns the dataset in `fn`, as `utils.read_dataset` would (but
+        read-only).  The "_cal" dataset of a raw-only series (see
+        `raw_calibration`) is calibrated from its "_raw" dataset.
+        """
+        return self._get(fn)[0]
+
+    def get_derived(self, fn, names=None):
+        """
+        Returns the dataset in `fn` (as `get` does) and a dictionary of its
+        derived columns in `names` (see `derived.compute_derived`).
+        """
+        return self._get(fn, True, names)
+
+    def _get(self, fn, derived=False, names=None):
+        fn = os.path.abspath(fn)
+        series = raw_only_series(fn)
+        st = os.stat(fn if series is None else series + '_raw')
+        with self._lock:
+            entry = self._entries.pop(fn, None)
+            if entry is None or entry.is_stale(st):
+                if series is None:
+                    entry = _CachedDataset(fn)
+                else:
+                    entry = _CalibratedDataset(fn, series)
+            entry.update(st.st_size)
+            self._entries[fn] = entry
+
+            rows = entry.rows()
+            columns = entry.derived.get(rows, names) if derived else None
+            self._evict()
+            return rows, columns
+
+    def _evict(self):
+        # the most recently used is the last, and is always kept
+        while (len(self._entries) > 1 and
+               sum([e.nbytes for e in self._entries.values()]) > self.max_bytes):
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
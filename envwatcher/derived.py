@@ -0,0 +1,263 @@
+"""
+Quantities worked out from the recorded ones: dewpoint, absolute humidity,
+pressure altitude, heat index, and deg F versions of the temperatures.
+
+Each is a vectorized function of named inputs (recorded variables or
+derived quantities registered before it), registered with
+`register_derived`.  Sensor groups record each variable with a suffix (e.g.
+"temperature_1_77"), and derived quantities are available for each suffix
+that has all their inputs (e.g. "dewpoint_1_77").
+
+`DerivedColumns` keeps the derived columns of a dataset that's being added
+to, working each sample out only once.  `dataset_cache.DatasetCache` keeps
+one for each cached dataset (see its `get_derived`), so the plots and APIs
+all use the same ones.
+"""
+import collections
+
+import numpy as np
+
+from .utils import (temphum_to_dewpoint, deg_c_to_f, deg_f_to_c, data_fields,
+                    MAGNUS_A, MAGNUS_B, MAGNUS_C)
+
+# the units of the recorded variables
+RECORDED_UNITS = {'pressure': 'kPa', 'temperature': 'deg C',
+                  'humidity': 'RH %'}
+# derived quantities that are deg F versions of a deg C one are named this
+FAHRENHEIT_SUFFIX = '_f'
+
+
+class DerivedQuantity:
+    """
+    `name` is `func` of the `inputs` (names of recorded variables or other
+    derived quantities), in `unit`.
+    """
+    def __init__(self, name, inputs, func, unit=''):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.func = func
+        self.unit = unit
+
+
+# name -> DerivedQuantity, with the inputs of each before it
+DERIVED_QUANTITIES = collections.OrderedDict()
+
+
+def register_derived(name, inputs, unit=''):
+    """
+    Decorator that registers a function of the arrays of `inputs` as the
+    derived quantity `name`.  The inputs have to be recorded variables or
+    already registered.
+    """
+    for inp in inputs:
+        if inp not in RECORDED_UNITS and inp not in DERIVED_QUANTITIES:
+            raise ValueError('Unknown input "{}" for derived quantity '
+                             '"{}"'.format(inp, name))
+
+    def decorator(func):
+        DERIVED_QUANTITIES[name] = DerivedQuantity(name, inputs, func, unit)
+        return func
+    return decorator
+
+
+@register_derived('dewpoint', ('temperature', 'humidity'), 'deg C')
+def dewpoint(temp, rh):
+    return temphum_to_dewpoint(temp, rh)
+
+
+@register_derived('absolute_humidity', ('temperature', 'humidity'), 'g/m^3')
+def absolute_humidity(temp, rh):
+    # the water vapor pressure (hPa) from the Magnus formula (as for the
+    # dewpoint), and then the ideal gas law
+    vapor_pressure = rh/100. * MAGNUS_A * np.exp(MAGNUS_B*temp/(MAGNUS_C + temp))
+    return 216.7 * vapor_pressure / (temp + 273.15)
+
+
+@register_derived('pressure_altitude', ('pressure',), 'm')
+def pressure_altitude(pres):
+    # the altitude with this pressure in the standard atmosphere
+    return 44307.694 * (1 - (pres/101.325)**0.190284)
+
+
+@register_derived('heat_index', ('temperature', 'humidity'), 'deg C')
+def heat_index(temp, rh):
+    # the US National Weather Service's version of the Rothfusz regression,
+    # which is in deg F
+    t = deg_c_to_f(np.asarray(temp, dtype=float))
+    rh = np.asarray(rh, dtype=float)
+
+    simple = 0.5*(t + 61 + (t - 68)*1.2 + rh*0.094)
+    full = (-42.379 + 2.04901523*t + 10.14333127*rh - 0.22475541*t*rh -
+            0.00683783*t*t - 0.05481717*rh*rh + 0.00122874*t*t*rh +
+            0.00085282*t*rh*rh - 0.00000199*t*t*rh*rh)
+    dry = (rh < 13) & (t >= 80) & (t <= 112)
+    dryfactor = np.sqrt(np.clip((17 - np.abs(t - 95))/17, 0, None))
+    full = np.where(dry, full - (13 - rh)/4*dryfactor, full)
+    humid = (rh > 85) & (t >= 80) & (t <= 87)
+    full = np.where(humid, full + (rh - 85)/10*(87 - t)/5, full)
+    return deg_f_to_c(np.where((simple + t)/2 >= 80, full, simple))
+
+
+for _name in ('temperature', 'dewpoint', 'heat_index'):
+    register_derived(_name + FAHRENHEIT_SUFFIX, (_name,), 'deg F')(deg_c_to_f)
+
+
+def split_name(name):
+    """
+    Returns the (recorded variable or derived quantity, suffix) that the
+    column `name` is, or (None, None) if it's neither.
+    """
+    best = None
+    for base in list(RECORDED_UNITS) + list(DERIVED_QUANTITIES):
+        if name == base or name.startswith(base + '_'):
+            if best is None or len(base) > len(best):
+                best = base
+    if best is None:
+        return None, None
+    return best, name[len(best):]
+
+
+def unit_of(name):
+    """
+    The unit of the column `name` ('' if not known)
+    """
+    base, suffix = split_name(name)
+    if base in RECORDED_UNITS:
+        return RECORDED_UNITS[base]
+    elif base in DERIVED_QUANTITIES:
+        return DERIVED_QUANTITIES[base].unit
+    return ''
+
+
+def fahrenheit_name(name):
+    """
+    The name of the deg F version of the deg C column `name`, or None if
+    it's not a temperature (or doesn't have one).
+    """
+    base, suffix = split_name(name)
+    if base is None or unit_of(base) != 'deg C':
+        return None
+    if base + FAHRENHEIT_SUFFIX not in DERIVED_QUANTITIES:
+        return None
+    return base + FAHRENHEIT_SUFFIX + suffix
+
+
+def derived_columns(fields):
+    """
+    Returns a list of (column name, `DerivedQuantity`, input column names)
+    for each derived quantity that can be worked out from the data fields
+    `fields`, with the inputs of each before it.
+    """
+    fields = list(fields)
+    suffixes = []
+    for nm in fields:
+        base, suffix = split_name(nm)
+        if base in RECORDED_UNITS and suffix not in suffixes:
+            suffixes.append(suffix)
+
+    available = set(fields)
+    columns = []
+    for quantity in DERIVED_QUANTITIES.values():
+        for suffix in suffixes:
+            colname = quantity.name + suffix
+            inputs = [inp + suffix for inp in quantity.inputs]
+            if colname not in available and all([inp in available
+                                                 for inp in inputs]):
+                columns.append((colname, quantity, inputs))
+                available.add(colname)
+    return columns
+
+
+def _column_fields(columns):
+    if hasattr(columns, 'dtype'):
+        return data_fields(columns)
+    return list(columns)
+
+
+def _plan(fields, names):
+    # the derived columns needed for `names` (column or quantity names, or
+    # None for all of them), in the order to work them out
+    columns = derived_columns(fields)
+    if names is None:
+        return columns
+    names = set(names)
+    needed = set([colname for colname, quantity, inputs in columns
+                  if colname in names or quantity.name in names])
+    for colname, quantity, inputs in reversed(columns):
+        if colname in needed:
+            needed.update(inputs)
+    return [column for column in columns if column[0] in needed]
+
+
+def compute_derived(columns, names=None):
+    """
+    Works out derived columns from `columns` (a dataset, or a dictionary of
+    recorded variable name to values).  `names` are the column names or
+    quantity names (for all the suffixes) to work out, default all that can
+    be.  Returns a dictionary of column name to values, with those and
+    anything they needed.
+    """
+    derived = {}
+    for colname, quantity, inputs in _plan(_column_fields(columns), names):
+        derived[colname] = quantity.func(*[derived[inp] if inp in derived
+                                           else columns[inp]
+                                           for inp in inputs])
+    return derived
+
+
+class DerivedColumns:
+    """
+    The derived columns of a dataset that only ever has samples added to it
+    (like those from `dataset_cache.DatasetCache`).  Each column is worked
+    out when first asked for, and after that only for the samples added
+    since.
+    """
+    def __init__(self):
+        self._columns = {}
+        # how many samples of each column have been worked out
+        self._nrows = {}
+
+    @property
+    def nbytes(self):
+        return sum([col.nbytes for col in self._columns.values()])
+
+    def get(self, dset, names=None):
+        """
+        Returns a dictionary of column name to values for the derived
+        columns of `dset` in `names` (see `compute_derived`).
+        """
+        n = len(dset)
+        plan = _plan(data_fields(dset), names)
+        for colname, quantity, inputs in plan:
+            done = self._nrows.get(colname, 0)
+            if done > n:
+                # the dataset got shorter, so it's not the same one
+                self._columns.clear()
+                self._nrows.clear()
+                return self.get(dset, names)
+            if done == n:
+                continue
+
+            vals = quantity.func(*[self._columns[inp][done:n]
+                                   if inp in self._columns
+                                   else dset[inp][done:n] for inp in inputs])
+            self._append(colname, done, np.asarray(vals, dtype=float))
+            self._nrows[colname] = n
+
+        result = {}
+        for colname, quantity, inputs in plan:
+            view = self._columns[colname][:n]
+            view.flags.writeable = False
+            result[colname] = view
+        return result
+
+    def _append(self, colname, done, vals):
+        col = self._columns.get(colname)
+        n = done + len(vals)
+        if col is None or n > len(col):
+            # grow geometrically so adding samples stays O(new samples)
+            newcol = np.empty(max(n, 0 if col is None else 2*len(col)))
+            if col is not None:
+                newcol[:done] = col[:done]
+            col = self._columns[colname] = newcol
+        col[done:n] = vals
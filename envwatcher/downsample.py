@@ -0,0 +1,84 @@
+"""
+Reduces series to about as many points as can actually be displayed, while
+keeping their visual shape.
+"""
+import numpy as np
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+
+def downsample_indices(x, y, npoints, method='lttb'):
+    """
+    Returns the indices of the (at most about `npoints`) points to keep from
+    `y` (with x-values `x`, which can be datetime64), using `method`: one of
+    `DOWNSAMPLE_METHODS`, or None to keep everything.
+    """
+    if method is None or len(y) <= npoints:
+        return np.arange(len(y))
+    elif method == 'lttb':
+        return lttb_indices(x, y, npoints)
+    elif method == 'minmax':
+        return minmax_indices(y, npoints)
+    else:
+        raise ValueError('Invalid downsampling method {}'.format(method))
+
+
+def lttb_indices(x, y, npoints):
+    """
+    Picks `npoints` points with the Largest-Triangle-Three-Buckets algorithm
+    (Steinarsson 2013): the first and last points, and from each of
+    `npoints` - 2 equal buckets in between, the point making the largest
+    triangle with the previously picked point and the average of the next
+    bucket.
+    """
+    n = len(y)
+    if npoints >= n or npoints < 3:
+        return np.arange(n)
+
+    x = np.asarray(x)
+    if x.dtype.kind == 'M':
+        x = x.astype('datetime64[us]').astype('int64')
+    # relative to the start so the products below don't lose precision
+    x = (x - x[0]).astype(float)
+    y = np.asarray(y, dtype=float)
+
+    edges = np.linspace(1, n - 1, npoints - 1).astype(int)
+    idxs = np.empty(npoints, dtype=int)
+    idxs[0] = a = 0
+    idxs[-1] = n - 1
+    for i in range(npoints - 2):
+        st, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nextx = x[end:edges[i + 2]].mean()
+            nexty = y[end:edges[i + 2]].mean()
+        else:
+            nextx, nexty = x[-1], y[-1]
+
+        # (twice) the triangle areas - the factor doesn't matter here
+        areas = np.abs((x[a] - nextx) * (y[st:end] - y[a]) -
+                       (x[a] - x[st:end]) * (nexty - y[a]))
+        a = st + np.argmax(areas)
+        idxs[i + 1] = a
+    return idxs
+
+
+def minmax_indices(y, npoints):
+    """
+    Splits `y` into `npoints`/2 equal buckets and picks the minimum and
+    maximum of each (along with the first and last points).
+    """
+    n = len(y)
+    if npoints >= n:
+        return np.arange(n)
+
+    bucketsize = -(-n // max(npoints // 2, 1))
+    nbuckets = -(-n // bucketsize)
+    # pad the end with the last value so the buckets can be a 2d array
+    buckets = np.pad(np.asarray(y), (0, nbuckets*bucketsize - n), mode='edge')
+    buckets = buckets.reshape(nbuckets, bucketsize)
+
+    offsets = np.arange(nbuckets) * bucketsize
+    mins = offsets + np.argmin(buckets, axis=1)
+    maxs = offsets + np.argmax(buckets, axis=1)
+    idxs = np.concatenate([[0, n - 1], mins, maxs])
+    return np.unique(np.clip(idxs, 0, n - 1))
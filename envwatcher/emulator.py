@@ -0,0 +1,259 @@
+"""
+A software model of a BME280 on an I2C bus, for exercising (and
+benchmarking) the acquisition code on machines without the hardware.
+
+Use it by giving an `EmulatedSMBus` to `BME280Recorder`::
+
+    bus = EmulatedSMBus()
+    b = BME280Recorder(bus=bus, calib_cache=None)
+"""
+import time
+import random
+import collections
+
+from .bme280 import (ID_REGISTER, STATUS_REGISTER, RESET_REGISTER,
+                     CTRL_HUM_REGISTER, CTRL_MEAS_REGISTER, CONFIG_REGISTER,
+                     DATA_START, BME280_ID, RESET_CODE, CALIB_REGISTERS)
+
+# these are the values hard-coded in testcal.c
+DEFAULT_CALIBS = {'dig_T1': 28224, 'dig_T2': 26110, 'dig_T3': 50,
+                  'dig_P1': 37298, 'dig_P2': -10829, 'dig_P3': 3024,
+                  'dig_P4': 11341, 'dig_P5': -10, 'dig_P6': -7,
+                  'dig_P7': 9900, 'dig_P8': -10230, 'dig_P9': 4285,
+                  'dig_H1': 75, 'dig_H2': 357, 'dig_H3': 0,
+                  'dig_H4': 322, 'dig_H5': 0, 'dig_H6': 30}
+# raw (pressure, temperature, humidity) that the emulated readings wander
+# around by default (also from testcal.c)
+DEFAULT_RAW = (265035, 522496, 28299)
+
+# what the device reports for a skipped measurement (datasheet 4)
+SKIPPED_RAW = (0x80000, 0x80000, 0x8000)
+
+OVERSAMPLING_REGVALS = (0, 1, 2, 4, 8, 16, 16, 16)
+T_STANDBY_REGVALS = (0.5, 62.5, 125, 250, 500, 1000, 10, 20)
+
+
+def encode_calibs(calibs):
+    """
+    Converts calibration values into a dictionary mapping register address to
+    register value, following the layout in datasheet section 4.2.2.  This
+    is the inverse of `bme280.decode_calibs`.
+    """
+    regvals = {}
+    for nm, typeandregs in CALIB_REGISTERS.items():
+        dt = typeandregs[0]
+        regs = typeandregs[1:]
+        val = calibs[nm]
+        if dt == '12ml':
+            regvals[regs[0]] = (val >> 4) & 0xff
+            regvals[regs[1]] = regvals.get(regs[1], 0) | (val & 0xf)
+        elif dt == '12lm':
+            regvals[regs[0]] = regvals.get(regs[0], 0) | ((val & 0xf) << 4)
+            regvals[regs[1]] = (val >> 4) & 0xff
+        else:
+            for i, reg in enumerate(regs):
+                regvals[reg] = (val >> (8*i)) & 0xff
+    return regvals
+
+
+class EmulatedBME280:
+    """
+    Models the register map of a BME280: the chip ID, calibration block,
+    control/config registers, status bits and data registers, with forced and
+    normal mode measurements that take a configurable time to complete.
+
+    `raw_values` is either a (pressure, temperature, humidity) tuple of raw
+    ADC values to report, or a callable returning one for each conversion. If
+    None, values that wander around `DEFAULT_RAW` are used.  `measure_time_ms`
+    is the conversion time, or None to use the typical time from datasheet
+    section 9.1 for the current oversampling settings, and
+    `measure_jitter_ms` is the width of uniform random jitter added to it.
+    """
+    def __init__(self, calibs=DEFAULT_CALIBS, raw_values=None,
+                       measure_time_ms=None, measure_jitter_ms=0,
+                       im_update_ms=2, seed=None, clock=time.perf_counter):
+        self.calibs = calibs
+        self.raw_values = raw_values
+        self.measure_time_ms = measure_time_ms
+        self.measure_jitter_ms = measure_jitter_ms
+        self.im_update_ms = im_update_ms
+        self.clock = clock
+        self._rng = random.Random(seed)
+
+        self.nconversions = 0
+        self.power_on()
+
+    def power_on(self):
+        self.registers = bytearray(256)
+        self.registers[ID_REGISTER] = BME280_ID
+        for reg, val in encode_calibs(self.calibs).items():
+            self.registers[reg] = val
+        self._reset_state()
+
+    def _reset_state(self):
+        for reg in (CTRL_HUM_REGISTER, CTRL_MEAS_REGISTER, CONFIG_REGISTER):
+            self.registers[reg] = 0
+        self._latched_ctrl_hum = 0
+        self._measurement_end = None
+        self._normal_start = None
+        self._normal_nlatched = 0
+        self._im_update_end = self.clock() + self.im_update_ms/1000.
+        self._latch_data(SKIPPED_RAW)
+
+    def conversion_time(self):
+        """
+        The time a conversion takes with the current settings, in sec.
+        """
+        if self.measure_time_ms is None:
+            meas = self.registers[CTRL_MEAS_REGISTER]
+            to = OVERSAMPLING_REGVALS[meas >> 5]
+            po = OVERSAMPLING_REGVALS[(meas >> 2) & 0b111]
+            ho = OVERSAMPLING_REGVALS[self._latched_ctrl_hum & 0b111]
+            ms = 1. + 2.*to + (2.*po + 0.5)*bool(po) + (2.*ho + 0.5)*bool(ho)
+        else:
+            ms = self.measure_time_ms
+        if self.measure_jitter_ms:
+            ms += self._rng.uniform(0, self.measure_jitter_ms)
+        return ms / 1000.
+
+    def _next_raw(self):
+        if self.raw_values is None:
+            raw = tuple(val + self._rng.randint(-64, 64) for val in DEFAULT_RAW)
+        elif callable(self.raw_values):
+            raw = tuple(self.raw_values())
+        else:
+            raw = tuple(self.raw_values)
+
+        # skipped measurements give the reset values
+        meas = self.registers[CTRL_MEAS_REGISTER]
+        enabled = ((meas >> 2) & 0b111, meas >> 5, self._latched_ctrl_hum & 0b111)
+        return tuple(val if on else skipped
+                     for val, on, skipped in zip(raw, enabled, SKIPPED_RAW))
+
+    def _latch_data(self, raw):
+        pres, temp, hum = raw
+        regs = self.registers
+        regs[DATA_START] = (pres >> 12) & 0xff
+        regs[DATA_START + 1] = (pres >> 4) & 0xff
+        regs[DATA_START + 2] = (pres & 0xf) << 4
+        regs[DATA_START + 3] = (temp >> 12) & 0xff
+        regs[DATA_START + 4] = (temp >> 4) & 0xff
+        regs[DATA_START + 5] = (temp & 0xf) << 4
+        regs[DATA_START + 6] = (hum >> 8) & 0xff
+        regs[DATA_START + 7] = hum & 0xff
+
+    def _update(self):
+        """
+        Brings the state up to the current time, and returns whether a
+        measurement is in progress.
+        """
+        now = self.clock()
+
+        if self._measurement_end is not None:
+            if now < self._measurement_end:
+                return True
+            self._measurement_end = None
+            self._latch_data(self._next_raw())
+            self.nconversions += 1
+            # back to sleep mode after a forced measurement
+            self.registers[CTRL_MEAS_REGISTER] &= ~0b11
+            return False
+
+        if self._normal_start is not None:
+            meastime = self._normal_meastime
+            standby = T_STANDBY_REGVALS[self.registers[CONFIG_REGISTER] >> 5]/1000.
+            elapsed = now - self._normal_start
+            ncompleted = int((elapsed - meastime) // (meastime + standby)) + 1
+            if ncompleted > self._normal_nlatched:
+                self._latch_data(self._next_raw())
+                self.nconversions += ncompleted - self._normal_nlatched
+                self._normal_nlatched = ncompleted
+            return (elapsed % (meastime + standby)) < meastime
+
+        return False
+
+    def read(self, reg):
+        measuring = self._update()
+        if reg == STATUS_REGISTER:
+            return (0b1000 if measuring else 0) | (self.clock() < self._im_update_end)
+        else:
+            return self.registers[reg]
+
+    def read_block(self, reg, nbytes):
+        # burst reads see a consistent snapshot of the data registers, as
+        # with the real device
+        measuring = self._update()
+        block = list(self.registers[reg:reg + nbytes])
+        if reg <= STATUS_REGISTER < reg + nbytes:
+            block[STATUS_REGISTER - reg] = ((0b1000 if measuring else 0) |
+                                            (self.clock() < self._im_update_end))
+        return block
+
+    def write(self, reg, val):
+        self._update()
+        if reg == RESET_REGISTER:
+            if val == RESET_CODE:
+                self._reset_state()
+        elif reg == CTRL_MEAS_REGISTER:
+            self.registers[reg] = val
+            # datasheet 5.4.3: ctrl_hum changes only apply after this write
+            self._latched_ctrl_hum = self.registers[CTRL_HUM_REGISTER]
+            mode = val & 0b11
+            if mode == 0b11:
+                if self._normal_start is None:
+                    self._normal_start = self.clock()
+                    self._normal_nlatched = 0
+                    self._normal_meastime = self.conversion_time()
+            else:
+                self._normal_start = None
+                if mode != 0 and self._measurement_end is None:
+                    self._measurement_end = self.clock() + self.conversion_time()
+        elif reg in (CTRL_HUM_REGISTER, CONFIG_REGISTER):
+            self.registers[reg] = val
+        # everything else is read-only
+
+
+class EmulatedSMBus:
+    """
+    Stands in for `smbus.SMBus` with emulated devices attached, and counts
+    the bus transactions made.
+
+    `devices` maps address to `EmulatedBME280`, and defaults to a single one
+    at 0x77.
+    """
+    def __init__(self, devices=None):
+        if devices is None:
+            devices = {0x77: EmulatedBME280()}
+        self.devices = devices
+        self.transactions = collections.Counter()
+
+    def _device(self, addr):
+        if addr not in self.devices:
+            # what smbus raises when nothing acknowledges
+            raise OSError(121, 'Remote I/O error')
+        return self.devices[addr]
+
+    @property
+    def ntransactions(self):
+        return sum(self.transactions.values())
+
+    def reset_counts(self):
+        self.transactions.clear()
+
+    def read_byte_data(self, addr, reg):
+        self.transactions['read_byte_data'] += 1
+        return self._device(addr).read(reg)
+
+    def write_byte_data(self, addr, reg, val):
+        self.transactions['write_byte_data'] += 1
+        self._device(addr).write(reg, val)
+
+    def read_i2c_block_data(self, addr, reg, nbytes=32):
+        self.transactions['read_i2c_block_data'] += 1
+        return self._device(addr).read_block(reg, nbytes)
+
+    def write_i2c_block_data(self, addr, reg, vals):
+        self.transactions['write_i2c_block_data'] += 1
+        dev = self._device(addr)
+        for i, val in enumerate(vals):
+            dev.write(reg + i, val)
@@ -1,36 +1,67 @@
 import os
 import time
+import signal
+import threading
+
+import numpy as np
 
 from .utils import check_for_recorder
+from .binary_dataset import (raw_fields, cal_fields, TIME_FRAC_FIELD,
+                             is_binary_dataset, create_binary_dataset)
+from .rollups import Rollups, rollup_variables, rollup_fn, ROLLUP_TIERS
+from .status import StatusWriter
+from .raw_calibration import write_calib_snapshot, calib_snapshot_fn
 
-from RPi import GPIO
-GPIO.setmode(GPIO.BCM)
+GPIO = None  # RPi.GPIO, imported when first needed so this works off a Pi
 
 # These are for the ACT LED on the RPi 2 B (40 pins)
 LED_PATH = '/sys/class/leds/led0/'
 LED_GPIO_NUM = 47
 
 def output_session_file(bme280, fn, waitsec=30, writecal=True, writeraw=True,
-                                progressfn=None, writeplots=False, setled=True):
-    if writeplots:
-        import matplotlib
-        matplotlib.use('agg')
-        from .plots import write_series_plots
+                                progressfn=None, writeplots=False, setled=True,
+                                binary=False, flush_rows=1, flush_interval=None,
+                                fsync=False, subsecond=False, rollups=False,
+                                plot_interval=60, stop_event=None,
+                                started=None):
+    """
+    Records samples from `bme280` every `waitsec` into `fn` + "_raw" and/or
+    `fn` + "_cal", with the recorder's status in `progressfn` (a
+    `status.StatusWriter` file), until the `progressfn` + "_stop" file appears (or
+    `stop_event`, a `threading.Event`, is set, which stops it right away).  If
+    `binary` is True the files are in the `binary_dataset` format instead of
+    CSV.
+
+    Samples are buffered and written out every `flush_rows` samples or
+    `flush_interval` sec (see `DatasetWriter`).  If `subsecond` is True, the fraction of a second
+    of each sample's time is also recorded.
+
+    With the "_raw" dataset goes a snapshot of the calibration values (see
+    `raw_calibration`), so if `writecal` is False the calibrated values can
+    still be worked out later.  Samples are then only calibrated if
+    something needs them now (the rollups or the status).
+
+    If `rollups` is True, the `rollups` tiers of the series are kept up to
+    date as well.  The bucket in progress is written out every
+    `flush_interval` sec, or if that's None, as often as the finest tier's
+    buckets end (and when recording stops).
+
+    `bme280` can also be a `sensor_group.BME280Group` (or anything else with
+    the same interface), in which case the datasets have a column for each of
+    its `fields`.  The status then has the values of its first sensor.
+
+    `writeplots` is the directory to write plots of the series in, or a
+    (directory, plot in deg F?) pair.  They are redrawn in the background
+    (see `PlotWorker`) at most every `plot_interval` sec.
+
+    `started` (a `threading.Event`) is set once the files are all set up and
+    recording has started.  If setting up fails, any files it created are
+    removed again.
+    """
 
     fnraw = fn + '_raw'
     fncal = fn + '_cal'
 
-    if writeraw:
-        if not os.path.exists(fnraw):
-            with open(fnraw, 'w') as f:
-                f.write('time,pressure,temperature,humidity')
-                f.write('\n')
-    if writecal:
-        if not os.path.exists(fncal):
-            with open(fncal, 'w') as f:
-                f.write('time,pressure,temperature,humidity')
-                f.write('\n')
-
     if progressfn:
         if check_for_recorder(progressfn):
             raise IOError('Progress file for recorder "{}" present.  Cannot'
@@ -40,15 +71,77 @@ def output_session_file(bme280, fn, waitsec=30, writecal=True, writeraw=True,
     else:
         stopfn = ''
 
+    # the files this creates, so they can be removed if setting up fails
+    newfns = [nm for nm in [fnraw, fncal, calib_snapshot_fn(fn)] +
+                           [rollup_fn(fn, tiername)
+                            for tiername, width in ROLLUP_TIERS]
+              if not os.path.exists(nm)]
+    set_up = False
+
+    writers = []
+    series_rollups = None
+    plot_worker = None
+    status = None
+    oldsigterm = None
     try:
-        time.sleep(waitsec)
+        if progressfn:
+            status = StatusWriter(progressfn)
+            outputs = []
+            if writecal:
+                outputs.append(fncal)
+            if writeraw:
+                outputs.append(fnraw)
+            status.update(series_name=os.path.split(fn)[1], pid=os.getpid(),
+                          waitsec=waitsec, outputs=outputs,
+                          expires=time.time() + waitsec*3)
+
+        writer_kwargs = dict(binary=binary, flush_rows=flush_rows,
+                             flush_interval=flush_interval, fsync=fsync)
+        rawwriter = calwriter = None
+        if writeraw:
+            write_calib_snapshot(fn, bme280)
+            fields = _time_fields(raw_fields(bme280.fields), subsecond)
+            rawwriter = DatasetWriter(fnraw, fields, **writer_kwargs)
+            writers.append(rawwriter)
+        if writecal:
+            fields = _time_fields(cal_fields(bme280.fields), subsecond)
+            calwriter = DatasetWriter(fncal, fields, **writer_kwargs)
+            writers.append(calwriter)
+        if rollups:
+            series_rollups = Rollups(fn, rollup_variables(bme280.fields))
+            if flush_interval is None:
+                rollup_flush_interval = ROLLUP_TIERS[0][1]
+            else:
+                rollup_flush_interval = flush_interval
+            last_rollup_flush = time.monotonic()
+        if writeplots:
+            if isinstance(writeplots, str):
+                plot_worker = PlotWorker(fncal, writeplots, False, plot_interval)
+            else:
+                plot_worker = PlotWorker(fncal, writeplots[0], writeplots[1],
+                                         plot_interval)
+
+        # SIGTERM (e.g. from kill) should also write out what's buffered
+        try:
+            oldsigterm = signal.signal(signal.SIGTERM, _raise_system_exit)
+        except ValueError:
+            pass  # can only set signal handlers in the main thread
+
+        set_up = True
+        if started is not None:
+            started.set()
+
+        _sleep(waitsec, stop_event)
         oldraw = raw_match = None
+        nsamples = reset_count = 0
+        old_plot_names = None
         while True:
             if os.path.exists(stopfn):
                 break
+            if stop_event is not None and stop_event.is_set():
+                break
 
             sttime = time.time()
-            timestr = time.strftime('%Y-%m-%d_%H:%M:%S', time.localtime(sttime))
 
             progress_info = {}
 
@@ -61,7 +154,7 @@ def output_session_file(bme280, fn, waitsec=30, writecal=True, writeraw=True,
                 # have gotten stuck.  If it happens again, reset
                 if raw_match:
                     # guess we've got to reset...
-                    progress_info['Reset-occurred'] = True
+                    reset_count += 1
                     bme280.reset_device()
                 else:
                     raw_match = True
@@ -69,75 +162,278 @@ def output_session_file(bme280, fn, waitsec=30, writecal=True, writeraw=True,
                 raw_match = False
             oldraw = raw
 
+            flushed = False
             if writeraw:
-                with open(fnraw, 'a') as f:
-                    towrite = [timestr]
-                    towrite.extend([str(r) for r in raw])
-                    f.write(','.join(towrite))
-                    f.write('\n')
+                flushed |= rawwriter.add_row((sttime,) + tuple(raw))
 
+            if writecal or rollups or status is not None:
+                calvals = tuple(bme280.read(raw))
+            nsamples += 1
             if writecal:
-                pres, temp, hum = bme280.read(raw)
-                with open(fncal, 'a') as f:
-                    f.write(','.join([timestr, str(pres), str(temp), str(hum)]))
-                    f.write('\n')
+                flushed |= calwriter.add_row((sttime,) + calvals)
+            if rollups:
+                series_rollups.add(sttime, dict(zip(bme280.fields, calvals)))
+                # rewriting the buckets in progress for every sample would
+                # undo the batching of the writes
+                if time.monotonic() - last_rollup_flush >= rollup_flush_interval:
+                    series_rollups.flush()
+                    last_rollup_flush = time.monotonic()
 
-            if writeplots:
-                if isinstance(writeplots, str):
-                    plotsdir = writeplots
-                    degf = False
-                else:
-                    plotsdir, degf = writeplots
-                plot_names = write_series_plots(fncal, plotsdir, degf)
+            if plot_worker is not None:
+                # the plots only show what's on disk, so only new data there
+                # needs new plots
+                if flushed:
+                    plot_worker.request()
+                plot_names = plot_worker.plot_names
             else:
                 plot_names = None
 
             proc_time = time.time() - sttime
-            progress_info.update({
-                            'Expires-on': str(time.time() + (proc_time + waitsec)*2),
-                            'PID': str(os.getpid()),
-                            'Output(s)': [],
-                            'Sample-time(s)': str(waitsec),
-                            'Series name': os.path.split(fn)[1]
-                            })
-            if writecal:
-                progress_info['Output(s)'].append(fncal)
-            if writeraw:
-                progress_info['Output(s)'].append(fnraw)
-            if len(progress_info['Output(s)']) == 0:
-                del progress_info['Output(s)']
-
-            if plot_names is not None:
-                progress_info['Plot names'] = plotnames = []
-                for i, (name, path) in enumerate(plot_names):
-                    plotnames.append(name + '|' + path)
-
-            if progressfn:
-                with open(progressfn, 'w') as fw:
-                    for nm, val in progress_info.items():
-                        fw.write(nm)
-                        fw.write(': ')
-                        if isinstance(val, str):
-                            fw.write(val)
-                        else:
-                            #assume an iterable
-                            fw.write(', '.join(val))
-                        fw.write('\n')
+            if status is not None:
+                status.update(expires=time.time() + (proc_time + waitsec)*2,
+                              last_sample_time=sttime, pressure=calvals[0],
+                              temperature=calvals[1], humidity=calvals[2],
+                              proc_time=proc_time, nsamples=nsamples,
+                              reset_count=reset_count,
+                              led_setting=progress_info.get('LED setting', ''),
+                              plot_state=('' if plot_worker is None
+                                          else plot_worker.state))
+                if plot_names != old_plot_names:
+                    status.update(plot_names=[name + '|' + path
+                                              for name, path in plot_names])
+            old_plot_names = plot_names
 
             if setled:
                 led_off(progress_info)
 
             timeleft = sttime - time.time() + waitsec
             if timeleft > 0:
-                time.sleep(timeleft)
+                _sleep(timeleft, stop_event)
     finally:
+        for writer in writers:
+            writer.close()
+        if series_rollups is not None:
+            series_rollups.close()
+        if plot_worker is not None:
+            plot_worker.stop()
+        if oldsigterm is not None:
+            signal.signal(signal.SIGTERM, oldsigterm)
+        if status is not None:
+            status.close()
+        if not set_up:
+            for nm in newfns:
+                if os.path.exists(nm):
+                    os.unlink(nm)
+
         # remove the stop and progress files
         if os.path.exists(stopfn):
             os.unlink(stopfn)
-        if os.path.exists(progressfn):
+        if progressfn and os.path.exists(progressfn):
             os.unlink(progressfn)
 
 
+def _time_fields(fields, subsecond):
+    if subsecond:
+        return fields[:1] + [TIME_FRAC_FIELD] + fields[1:]
+    else:
+        return fields
+
+
+def _sleep(secs, stop_event=None):
+    if stop_event is None:
+        time.sleep(secs)
+    else:
+        stop_event.wait(secs)
+
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit('Recorder got signal {}'.format(signum))
+
+
+class PlotWorker:
+    """
+    Redraws the plots of the dataset `fncal` in `plotsdir` (in deg F if
+    `degf`) in a background thread, so the sampling loop never waits for
+    them.  Calls to `request` while a redraw is running or within
+    `min_interval` sec of the last one are coalesced into one redraw.
+
+    The plots are downsampled with `downsample` to about `npoints` (see
+    `plots.write_series_plots`).
+
+    `plot_names` is what `plots.write_series_plots` returned for the last
+    finished redraw (None until there is one).
+    """
+    def __init__(self, fncal, plotsdir, degf=False, min_interval=60,
+                       downsample='minmax', npoints=2000):
+        self.fncal = fncal
+        self.plotsdir = plotsdir
+        self.degf = degf
+        self.min_interval = min_interval
+        self.downsample = downsample
+        self.npoints = npoints
+
+        self.plot_names = None
+        self.last_error = None
+        self._pending = False
+        self._rendering = False
+        self._stopping = False
+        self._last_render = None
+        self._cond = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def state(self):
+        """
+        "rendering", "pending" (requested but waiting for the interval), or
+        "idle"
+        """
+        if self._rendering:
+            return 'rendering'
+        elif self._pending:
+            return 'pending'
+        else:
+            return 'idle'
+
+    def request(self):
+        with self._cond:
+            self._pending = True
+            self._cond.notify()
+
+    def stop(self, timeout=None):
+        """
+        Stops the worker, waiting up to `timeout` sec for a redraw in progress
+        to finish.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        # imported here so the sampling loop's thread doesn't pay for it
+        from .plots import write_series_plots, plot_derived_names
+        from .dataset_cache import DatasetCache
+        # so the plots only need to read (and work out the derived columns
+        # of) the new samples
+        dset_cache = DatasetCache()
+
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._last_render is not None:
+                    nextrender = self._last_render + self.min_interval
+                    while (not self._stopping and
+                           time.monotonic() < nextrender):
+                        self._cond.wait(nextrender - time.monotonic())
+                if self._stopping:
+                    return
+                self._pending = False
+                self._rendering = True
+
+            self._last_render = time.monotonic()
+            try:
+                dset, derived = dset_cache.get_derived(
+                    self.fncal, plot_derived_names(self.degf))
+                self.plot_names = write_series_plots(self.fncal, self.plotsdir,
+                                                     self.degf, dset=dset,
+                                                     derived=derived,
+                                                     downsample=self.downsample,
+                                                     npoints=self.npoints)
+                self.last_error = None
+            except Exception as e:
+                # a failed plot shouldn't stop the recording
+                self.last_error = e
+            finally:
+                self._rendering = False
+
+
+class DatasetWriter:
+    """
+    Appends samples to the dataset file `fn` (creating it with the given
+    fields if needed), keeping the file open and batching the samples in
+    memory.  They are written out when `flush_rows` are waiting or
+    `flush_interval` sec have passed since the last write (if it's not None),
+    and fsync'd if `fsync` is True.
+
+    If the second field is "time_frac", it gets the fraction of a second of
+    the samples' times.
+    """
+    def __init__(self, fn, fields, binary=False, flush_rows=1,
+                       flush_interval=None, fsync=False):
+        self.fn = fn
+        self.fields = fields
+        self.binary = binary
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.subsecond = len(fields) > 1 and fields[1][0] == TIME_FRAC_FIELD[0]
+
+        if not os.path.exists(fn):
+            if binary:
+                create_binary_dataset(fn, fields)
+            else:
+                with open(fn, 'w') as f:
+                    f.write(','.join([nm for nm, dt in fields]))
+                    f.write('\n')
+        elif is_binary_dataset(fn) != binary:
+            raise ValueError('Existing dataset "{}" is not in the requested '
+                             'format'.format(fn))
+
+        self._file = open(fn, 'ab')
+        self._rows = []
+        self._last_flush = time.monotonic()
+
+    def add_row(self, row):
+        """
+        Adds a sample, given as (time in sec since the epoch, values...).
+        Returns True if this caused the buffer to be written out.
+        """
+        self._rows.append(row)
+        if (len(self._rows) >= self.flush_rows or
+            (self.flush_interval is not None and
+             time.monotonic() - self._last_flush >= self.flush_interval)):
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        # taken out of the buffer first, so that a flush from a signal
+        # handler in the middle of this one doesn't write them again
+        toflush, self._rows = self._rows, []
+        if toflush:
+            if self.binary:
+                rows = []
+                for row in toflush:
+                    timevals = (int(row[0]),)
+                    if self.subsecond:
+                        timevals += (row[0] % 1,)
+                    rows.append(timevals + tuple(row[1:]))
+                data = np.array(rows, dtype=self.fields).tobytes()
+            else:
+                lines = []
+                for row in toflush:
+                    towrite = [time.strftime('%Y-%m-%d_%H:%M:%S',
+                                             time.localtime(row[0]))]
+                    if self.subsecond:
+                        towrite.append('{:.6f}'.format(row[0] % 1))
+                    towrite.extend([str(val) for val in row[1:]])
+                    lines.append(','.join(towrite) + '\n')
+                data = ''.join(lines).encode()
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
 def led_on(progress_info={}):
     with open(LED_PATH + 'trigger', 'r') as f:
         triggerinfo = f.read()
@@ -151,6 +447,7 @@ def led_on(progress_info={}):
                                             ' Need to do "sudo chmod o+w '
                                             '{}shot"').format(LED_PATH)
     elif '[gpio]' in triggerinfo:
+        _import_gpio()
         GPIO.setup(LED_GPIO_NUM, GPIO.OUT)
         GPIO.output(LED_GPIO_NUM, 1)
         progress_info['LED setting'] = 'GPIO on Pin {}'.format(LED_GPIO_NUM)
@@ -165,5 +462,13 @@ def led_off(progress_info={}):
     with open(LED_PATH + 'trigger', 'r') as f:
         triggerinfo = f.read()
     if '[gpio]' in triggerinfo:
+        _import_gpio()
         GPIO.output(LED_GPIO_NUM, 0)
     # otherwise do nothing because we can't do anything
+
+
+def _import_gpio():
+    global GPIO
+    if GPIO is None:
+        from RPi import GPIO
+        GPIO.setmode(GPIO.BCM)
@@ -1,14 +1,116 @@
 import os
-from datetime import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.dates import date2num, num2date, DateFormatter
-
-from .utils import read_dataset, temphum_to_dewpoint, deg_c_to_f
-
-
-def write_series_plots(dsetfn, outdir, ctof=False):
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.dates import DateFormatter
+
+from .utils import read_dataset, dataset_datetimes, data_fields
+from .derived import (derived_columns, compute_derived, fahrenheit_name,
+                      unit_of, RECORDED_UNITS)
+from .downsample import downsample_indices
+
+# processes to render plots in (None for one per core)
+RENDER_PROCESSES = None
+# the derived quantities (see `derived`) that get plotted along with the
+# recorded ones
+PLOT_DERIVED = ('dewpoint',)
+
+_render_pool = None
+
+
+def get_render_pool():
+    """
+    The (shared) pool of processes plots are rendered in, started when first
+    needed.  The processes are spawned rather than forked, since forking a
+    process with threads running (like the web app) isn't safe.
+    """
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(RENDER_PROCESSES,
+                                           multiprocessing.get_context('spawn'))
+    return _render_pool
+
+
+def _drop_render_pool(pool):
+    # so the next `get_render_pool` starts new processes
+    global _render_pool
+    if _render_pool is pool:
+        _render_pool = None
+    pool.shutdown(wait=False)
+
+
+def series_plot_data(dset, ctof=False, derived=None):
+    """
+    Returns a dictionary of variable name to the data to plot for it, for
+    each data field in `dset` as well as the `PLOT_DERIVED` quantities.
+    Temperatures are in deg F if `ctof` is True.  `derived` is a dictionary
+    of the derived columns of `dset` if they've already been worked out
+    (e.g. by `dataset_cache.DatasetCache.get_derived`).
+    """
+    fields = data_fields(dset)
+    names = fields + [colname for colname, quantity, inputs
+                      in derived_columns(fields)
+                      if quantity.name in PLOT_DERIVED]
+
+    # the column to plot for each
+    columns = {}
+    for name in names:
+        columns[name] = (ctof and fahrenheit_name(name)) or name
+
+    needed = [col for col in columns.values() if col not in fields]
+    if derived is None or not all([col in derived for col in needed]):
+        derived = compute_derived(dset, needed)
+
+    return {name: dset[col] if col in fields else derived[col]
+            for name, col in columns.items()}
+
+
+def plot_derived_names(ctof=False):
+    """
+    The derived quantities `series_plot_data` uses, i.e. the names to ask
+    `dataset_cache.DatasetCache.get_derived` for so only those are worked
+    out.
+    """
+    names = list(PLOT_DERIVED)
+    if ctof:
+        for name in list(RECORDED_UNITS) + list(PLOT_DERIVED):
+            if fahrenheit_name(name) is not None:
+                names.append(fahrenheit_name(name))
+    return names
+
+
+def plot_unit(name, ctof=False):
+    """
+    The unit of the `series_plot_data` variable `name`
+    """
+    if ctof and fahrenheit_name(name):
+        return unit_of(fahrenheit_name(name))
+    return unit_of(name)
+
+
+def write_series_plots(dsetfn, outdir, ctof=False, dset=None, downsample=None,
+                       npoints=2000, prefix='', parallel=True, derived=None):
+    """
+    Writes a plot for each variable in the dataset `dsetfn` into `outdir`.
+    `dset` is the already-read dataset, and `derived` its derived columns,
+    if available (see `series_plot_data`).  If `downsample` is
+    given, it's the `downsample.DOWNSAMPLE_METHODS` method used to reduce each
+    series to about `npoints` points.  The image file names start with
+    `prefix`.
+
+    The plots are rendered at the same time in the `get_render_pool`
+    processes if `parallel` is True, otherwise one after the other here.
+    The data is downsampled before it's sent to the processes, so with
+    `downsample` None all of it is sent.  If the processes die (e.g. they
+    can't start), the plots are rendered here and the pool is restarted the
+    next time.
+
+    Returns a list of (variable name, image file name)
+    """
 
     dset_name = os.path.split(dsetfn)[-1]
 
@@ -17,63 +119,69 @@ def write_series_plots(dsetfn, outdir, ctof=False):
     else:
         raise ValueError('dsets have to end in _cal')
 
-    dset = read_dataset(dsetfn)
-    dts = [datetime.strptime(t.decode(), '%Y-%m-%d_%H:%M:%S') for i, t in enumerate(dset['time'])]
-    plotdates = date2num(dts)
+    if dset is None:
+        dset = read_dataset(dsetfn)
+    plotdates = dataset_datetimes(dset)
 
-    firstdatestr = num2date(plotdates[0]).strftime('%Y-%m-%d')
-    lastdatestr = num2date(plotdates[-1]).strftime('%Y-%m-%d')
+    firstdatestr, lastdatestr = np.datetime_as_string(plotdates[[0, -1]],
+                                                      unit='D')
     if firstdatestr == lastdatestr:
         titlestr = firstdatestr
     else:
         titlestr = firstdatestr + ' to ' + lastdatestr
 
-    data_to_plot = {nm: dset[nm] for nm in dset.dtype.names[1:]}
-
-    if 'dewpoint' not in data_to_plot and ('temperature' in data_to_plot and
-                                           'humidity' in data_to_plot):
-        data_to_plot['dewpoint'] = temphum_to_dewpoint(data_to_plot['temperature'], data_to_plot['humidity'])
+    data_to_plot = series_plot_data(dset, ctof, derived)
 
     plot_names = []
 
-    figs = {}
+    toplot = []
     for name, data in data_to_plot.items():
-        fig = plt.figure()
+        ylabel = plot_unit(name, ctof) or name
+
+        idxs = downsample_indices(plotdates, data, npoints, downsample)
+        img_name = '{}{}_{}.png'.format(prefix, dset_name, name)
+        toplot.append((os.path.join(outdir, img_name), plotdates[idxs],
+                       data[idxs], ylabel, titlestr))
 
-        if ctof and (name=='temperature' or name=='dewpoint'):
-            data = deg_c_to_f(data)
+        plot_names.append((name, img_name))
 
-        plt.plot_date(plotdates, data, '-')
+    if parallel:
+        pool = get_render_pool()
+        try:
+            for future in [pool.submit(render_series_plot, *args)
+                           for args in toplot]:
+                future.result()
+        except BrokenProcessPool:
+            _drop_render_pool(pool)
+            parallel = False
+    if not parallel:
+        for args in toplot:
+            render_series_plot(*args)
 
-        plt.xlabel('Time')
-        if name == 'pressure':
-            plt.ylabel('kPa')
-        elif name == 'temperature' or name == 'dewpoint':
-            if ctof:
-                plt.ylabel('deg F')
-            else:
-                plt.ylabel('deg C')
-        elif name == 'humidity':
-            plt.ylabel('RH %')
-        else:
-            plt.ylabel(name)
+    return plot_names
 
-        plt.gca().xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        plt.gcf().autofmt_xdate()
-        plt.title(titlestr)
 
-        img_name = '{}_{}.png'.format(dset_name, name)
-        figs[os.path.join(outdir, img_name)] = fig
+def render_series_plot(path, plotdates, data, ylabel, titlestr):
+    """
+    Draws `data` vs. `plotdates` and saves it to `path`.  This doesn't touch
+    pyplot (or any other global state), so it can run in any thread.
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
 
-        plot_names.append((name, img_name))
-    for path, fig in figs.items():
-        fig.savefig(path)
+    ax.plot(plotdates, data, '-')
 
-    plt.close('all')
+    ax.set_xlabel('Time')
+    ax.set_ylabel(ylabel)
+    ax.xaxis.set_major_formatter(DateFormatter('%H:%M'))
+    fig.autofmt_xdate()
+    ax.set_title(titlestr)
 
-    return plot_names
+    fig.savefig(path)
 
 def triple_plots(fntab):
+    from matplotlib import pyplot as plt
     from astropy.table import Table
     from astropy.time import Time
 
@@ -96,8 +204,17 @@ def triple_plots(fntab):
     plt.tight_layout()
     plt.subplots_adjust(hspace=0)
 
-def make_bokeh_plots(dsetfn, outdir, ctof=False):
+def make_bokeh_plots(dsetfn, outdir, ctof=False, dset=None, downsample=None,
+                     npoints=2000, derived=None):
+    """
+    Makes a bokeh figure for each variable in the dataset `dsetfn`, returned
+    as a dictionary of variable name to figure (`dset` and `derived` are as
+    for `write_series_plots`).  The data for each are in a
+    ColumnDataSource named <variable name>_source, with "time" and
+    <variable name> columns.
+    """
     from bokeh.plotting import figure
+    from bokeh.models import ColumnDataSource
 
     dset_name = os.path.split(dsetfn)[-1]
 
@@ -106,39 +223,26 @@ def make_bokeh_plots(dsetfn, outdir, ctof=False):
     else:
         raise ValueError('dsets have to end in _cal')
 
-    dset = read_dataset(dsetfn)
-    dts = [datetime.strptime(t.decode(), '%Y-%m-%d_%H:%M:%S') for i, t in enumerate(dset['time'])]
-    plotarrs = np.array(dts, dtype='datetime64[ms]')
-
-    data_to_plot = {nm: dset[nm] for nm in dset.dtype.names[1:]}
+    if dset is None:
+        dset = read_dataset(dsetfn)
+    plotarrs = dataset_datetimes(dset)
 
-    if 'dewpoint' not in data_to_plot and ('temperature' in data_to_plot and
-                                           'humidity' in data_to_plot):
-        data_to_plot['dewpoint'] = temphum_to_dewpoint(data_to_plot['temperature'], data_to_plot['humidity'])
+    data_to_plot = series_plot_data(dset, ctof, derived)
 
     plot_names = []
 
     figs = {}
     for name, data in data_to_plot.items():
-        yunit = ''
-        if name == 'pressure':
-            yunit = 'kPa'
-        elif name == 'temperature' or name == 'dewpoint':
-            if ctof:
-                yunit = 'deg F'
-            else:
-                yunit = 'deg C'
-        elif name == 'humidity':
-            yunit = 'RH %'
+        yunit = plot_unit(name, ctof)
 
         figs[name] = p = figure(title="",
                                 x_axis_label='Time',
                                 x_axis_type="datetime",
                                 y_axis_label='{} ({})'.format(name, yunit))
 
-        if ctof and (name=='temperature' or name=='dewpoint'):
-            data = deg_c_to_f(data)
-
-        p.line(plotarrs, data)
+        idxs = downsample_indices(plotarrs, data, npoints, downsample)
+        source = ColumnDataSource({'time': plotarrs[idxs], name: data[idxs]},
+                                  name=name + '_source')
+        p.line('time', name, source=source)
 
     return figs
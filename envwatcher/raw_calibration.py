@@ -0,0 +1,152 @@
+"""
+Calibrating series that were recorded with only their raw ADC values.
+
+Along with the "_raw" dataset, the recorder writes a snapshot of the
+sensors' calibration values to <series>_calib (JSON).  The series' "_cal"
+dataset can then be worked out whenever it's wanted (`read_dataset` and
+`dataset_cache.DatasetCache` do this when the "_cal" file doesn't exist),
+and worked out again if the calibration formulae change.
+"""
+import os
+import json
+import threading
+import collections
+
+import numpy as np
+
+from .utils import TIME_FIELDS, read_dataset
+from .bme280 import calibrate_raw_arrays, calibs_from_ints
+
+# how many calibrated datasets `read_calibrated` keeps around
+CALIBRATED_CACHE_ENTRIES = 4
+
+_calibrated_cache = collections.OrderedDict()
+_calibrated_cache_lock = threading.Lock()
+
+
+def calib_snapshot_fn(fn):
+    return fn + '_calib'
+
+
+def write_calib_snapshot(fn, bme280):
+    """
+    Writes the calibration values of `bme280` (a `bme280.BME280Recorder` or
+    `sensor_group.BME280Group`) as the snapshot for series `fn`.  If the
+    series already has one (it's being added to), it has to be the same.
+    """
+    snapshot = {'sensors': [{'fields': list(fields),
+                             'calib_vals': {nm: int(val) for nm, val in
+                                            calib_vals.items()}}
+                            for fields, calib_vals in bme280.calibrations()]}
+
+    snapshotfn = calib_snapshot_fn(fn)
+    if os.path.exists(snapshotfn):
+        with open(snapshotfn) as f:
+            if json.load(f) != snapshot:
+                raise ValueError('Series "{}" was recorded with different '
+                                 'sensors or calibration values'.format(fn))
+        return
+
+    # write-then-rename so readers never see a partial file
+    with open(snapshotfn + '.tmp', 'w') as f:
+        json.dump(snapshot, f, indent=1, sort_keys=True)
+    os.replace(snapshotfn + '.tmp', snapshotfn)
+
+
+def read_calib_snapshot(fn):
+    """
+    Returns the calibration snapshot of series `fn` as a list of (names of
+    the values, calibration values) for each sensor, like
+    `bme280.BME280Recorder.calibrations`.
+    """
+    with open(calib_snapshot_fn(fn)) as f:
+        snapshot = json.load(f)
+    return [(tuple(sensor['fields']), calibs_from_ints(sensor['calib_vals']))
+            for sensor in snapshot['sensors']]
+
+
+def raw_only_series(calfn):
+    """
+    If `calfn` is a "_cal" dataset that doesn't exist but can be worked out
+    from the series' "_raw" dataset and calibration snapshot, returns the
+    series (`calfn` without "_cal"), otherwise None.
+    """
+    if not calfn.endswith('_cal') or os.path.exists(calfn):
+        return None
+    fn = calfn[:-4]
+    if os.path.exists(fn + '_raw') and os.path.exists(calib_snapshot_fn(fn)):
+        return fn
+    return None
+
+
+def dataset_source_fn(dsetfn):
+    """
+    The file the dataset `dsetfn` comes from: the "_raw" dataset for
+    the "_cal" dataset of a raw-only series, otherwise `dsetfn` itself.
+    """
+    fn = raw_only_series(dsetfn)
+    return dsetfn if fn is None else fn + '_raw'
+
+
+def calibrated_dtype(rawdtype):
+    """
+    The dtype of the calibrated version of raw samples with `rawdtype`: the
+    same times, with floats for everything else.
+    """
+    return np.dtype([(nm, rawdtype[nm] if nm in TIME_FIELDS else '<f8')
+                     for nm in rawdtype.names])
+
+
+def calibrate_raw_records(raw, calibrations):
+    """
+    Returns the calibrated version of the raw samples `raw` (a structured
+    array, like a "_raw" dataset), with `calibrations` as returned by
+    `read_calib_snapshot`.
+    """
+    cal = np.empty(len(raw), dtype=calibrated_dtype(raw.dtype))
+    todo = set(cal.dtype.names)
+    for nm in TIME_FIELDS:
+        if nm in todo:
+            cal[nm] = raw[nm]
+            todo.remove(nm)
+    for fields, calib_vals in calibrations:
+        calvals = calibrate_raw_arrays(calib_vals, *[raw[nm] for nm in fields])
+        for nm, vals in zip(fields, calvals):
+            cal[nm] = vals
+            todo.discard(nm)
+    if todo:
+        raise ValueError('No calibration values for raw field(s) '
+                         '{}'.format(', '.join(sorted(todo))))
+    return cal
+
+
+def read_calibrated(calfn):
+    """
+    Returns the "_cal" dataset `calfn` of a raw-only series, working it out
+    from the "_raw" dataset unless that hasn't changed since the last time.
+    """
+    fn = raw_only_series(calfn)
+    if fn is None:
+        raise FileNotFoundError('No dataset or raw-only series for '
+                                '"{}"'.format(calfn))
+    rawfn = fn + '_raw'
+    rawst = os.stat(rawfn)
+    snapshotst = os.stat(calib_snapshot_fn(fn))
+    cachekey = (rawst.st_ino, rawst.st_size, rawst.st_mtime_ns,
+                snapshotst.st_mtime_ns)
+
+    calfn = os.path.abspath(calfn)
+    with _calibrated_cache_lock:
+        entry = _calibrated_cache.get(calfn)
+        if entry is not None and entry[0] == cachekey:
+            _calibrated_cache.move_to_end(calfn)
+            return entry[1]
+
+    cal = calibrate_raw_records(read_dataset(rawfn), read_calib_snapshot(fn))
+    cal.flags.writeable = False
+    with _calibrated_cache_lock:
+        _calibrated_cache[calfn] = (cachekey, cal)
+        _calibrated_cache.move_to_end(calfn)
+        while len(_calibrated_cache) > CALIBRATED_CACHE_ENTRIES:
+            _calibrated_cache.popitem(last=False)
+    return cal
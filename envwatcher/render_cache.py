@@ -0,0 +1,137 @@
+"""
+Keeps rendered plot images around so they are only redrawn when the
+dataset (or how it's plotted) changes.
+"""
+import os
+import json
+import glob
+import hashlib
+import threading
+import contextlib
+
+from .raw_calibration import dataset_source_fn
+
+MANIFEST_SUFFIX = '_manifest.json'
+
+
+class PlotCache:
+    """
+    A cache of plot images in `outdir`.  Each entry is a set of images plus a
+    manifest file listing them (written last, so an entry with a manifest is
+    complete).  Once the entries take up more than `max_bytes`, the least
+    recently used are deleted.
+    """
+    def __init__(self, outdir, max_bytes=50*2**20):
+        self.outdir = outdir
+        self.max_bytes = max_bytes
+        # guards the manifests (while they're written and evicted) and
+        # `_key_locks`
+        self._lock = threading.Lock()
+        # key -> (lock held while rendering it, number of threads using it)
+        self._key_locks = {}
+
+    def key(self, dsetfn, **params):
+        """
+        The key for plots of the dataset `dsetfn` in its current state, made
+        with `params` (anything that changes how they look).
+        """
+        st = os.stat(dataset_source_fn(dsetfn))
+        keyinfo = [os.path.abspath(dsetfn), st.st_ino, st.st_size,
+                   st.st_mtime_ns, sorted(params.items())]
+        return hashlib.sha1(repr(keyinfo).encode()).hexdigest()[:20]
+
+    def _manifest_fn(self, key):
+        return os.path.join(self.outdir, key + MANIFEST_SUFFIX)
+
+    def get(self, key):
+        """
+        Returns what was stored for `key` (see `put`), or None if it's not
+        (or no longer) cached.
+        """
+        manifestfn = self._manifest_fn(key)
+        try:
+            with open(manifestfn) as f:
+                plot_names = json.load(f)
+        except FileNotFoundError:
+            return None
+        for name, img_name in plot_names:
+            if not os.path.exists(os.path.join(self.outdir, img_name)):
+                return None
+        # the mtime of the manifest is the last use
+        os.utime(manifestfn)
+        return [tuple(pair) for pair in plot_names]
+
+    def put(self, key, plot_names):
+        """
+        Stores `plot_names` (a list of (name, image file name in `outdir`))
+        for `key`.
+        """
+        manifestfn = self._manifest_fn(key)
+        with self._lock:
+            with open(manifestfn + '.tmp', 'w') as f:
+                json.dump(plot_names, f)
+            os.replace(manifestfn + '.tmp', manifestfn)
+            self._evict()
+
+    def get_or_render(self, key, renderfn):
+        """
+        Returns what's stored for `key`, or if there isn't anything, calls
+        `renderfn(key)` to render the plots (it should return what `put`
+        takes), and stores that.  Simultaneous requests for the same key
+        render it only once, while different keys render at the same time.
+        """
+        plot_names = self.get(key)
+        if plot_names is None:
+            with self._key_lock(key):
+                plot_names = self.get(key)
+                if plot_names is None:
+                    plot_names = renderfn(key)
+                    self.put(key, plot_names)
+        return plot_names
+
+    @contextlib.contextmanager
+    def _key_lock(self, key):
+        with self._lock:
+            lock, nusers = self._key_locks.get(key, (threading.Lock(), 0))
+            self._key_locks[key] = (lock, nusers + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, nusers = self._key_locks.pop(key)
+                if nusers > 1:
+                    self._key_locks[key] = (lock, nusers - 1)
+
+    def _entry_files(self, manifestfn):
+        fns = [manifestfn]
+        try:
+            with open(manifestfn) as f:
+                plot_names = json.load(f)
+        except (OSError, ValueError):
+            return fns
+        fns.extend([os.path.join(self.outdir, img_name)
+                    for name, img_name in plot_names])
+        return fns
+
+    def _evict(self):
+        entries = []
+        for manifestfn in glob.glob(self._manifest_fn('*')):
+            fns = [fn for fn in self._entry_files(manifestfn)
+                   if os.path.exists(fn)]
+            entries.append((os.path.getmtime(manifestfn), manifestfn,
+                            sum([os.path.getsize(fn) for fn in fns]), fns))
+        entries.sort()
+
+        total = sum([entry[2] for entry in entries])
+        # the newest is always kept
+        for mtime, manifestfn, nbytes, fns in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            # manifest first, so nothing uses the entry while it goes away
+            for fn in fns:
+                try:
+                    os.unlink(fn)
+                except FileNotFoundError:
+                    pass
+            total -= nbytes
@@ -0,0 +1,259 @@
+"""
+Multi-resolution summaries ("rollups") of a series: the count, min, max, and
+mean of each variable in fixed time buckets, kept up to date as samples
+arrive so long time spans can be shown without reading every sample.
+
+Each tier is a `binary_dataset` file named <series>_rollup_<tier name>,
+with "time" being the (UTC-aligned) start of each bucket.
+"""
+import os
+import sys
+
+import numpy as np
+
+from .utils import csv_times_to_epoch, read_dataset, data_fields
+from .derived import derived_columns, compute_derived
+from .binary_dataset import (create_binary_dataset, read_binary_dataset,
+                             read_binary_header, append_binary_records)
+
+# (name, bucket width in sec), finest first
+ROLLUP_TIERS = (('1min', 60), ('1hour', 3600), ('1day', 86400))
+ROLLUP_VARIABLES = ('pressure', 'temperature', 'humidity', 'dewpoint')
+ROLLUP_STATS = ('min', 'max', 'mean')
+# the derived quantities (see `derived`) kept along with the recorded ones
+ROLLUP_DERIVED = ('dewpoint',)
+
+
+def rollup_fn(fn, tiername):
+    return '{}_rollup_{}'.format(fn, tiername)
+
+
+def rollup_fields(variables=ROLLUP_VARIABLES):
+    fields = [('time', '<i8'), ('count', '<i8')]
+    for var in variables:
+        fields.extend([(var + '_' + stat, '<f8') for stat in ROLLUP_STATS])
+    return fields
+
+
+def rollup_variables(fields):
+    """
+    The variables to keep rollups of for samples with `fields`: those and
+    the `ROLLUP_DERIVED` quantities.
+    """
+    fields = list(fields)
+    return tuple(fields + [colname for colname, quantity, inputs
+                           in derived_columns(fields)
+                           if quantity.name in ROLLUP_DERIVED])
+
+
+def _with_derived(values):
+    newvalues = dict(values)
+    newvalues.update(compute_derived(values, ROLLUP_DERIVED))
+    return newvalues
+
+
+class RollupTier:
+    """
+    Maintains the rollup file for one tier of series `fn`, with buckets
+    `width` sec wide.  The bucket in progress is written at the end of the
+    file on `flush` (and rewritten in place as it fills up), and for the
+    last time when a sample for a later bucket arrives or on `close`.
+    """
+    def __init__(self, fn, tiername, width, variables=ROLLUP_VARIABLES):
+        self.fn = rollup_fn(fn, tiername)
+        self.width = width
+        self.variables = variables
+        self.dtype = np.dtype(rollup_fields(variables))
+
+        self._reset_bucket(None)
+        if not os.path.exists(self.fn):
+            create_binary_dataset(self.fn, rollup_fields(variables))
+        else:
+            self._resume()
+
+    def _reset_bucket(self, start):
+        nvars = len(self.variables)
+        self.bucket_start = start
+        self.count = 0
+        self.mins = np.full(nvars, np.inf)
+        self.maxs = np.full(nvars, -np.inf)
+        self.sums = np.zeros(nvars)
+        # whether the file already ends with this bucket
+        self._in_file = False
+
+    def _resume(self):
+        """
+        Picks up the last bucket written (which may have been closed or
+        flushed partway through) as the one in progress.
+        """
+        dt, offset = read_binary_header(self.fn)
+        if dt != self.dtype:
+            raise ValueError('Rollup file "{}" has different fields than '
+                             'requested'.format(self.fn))
+        records = read_binary_dataset(self.fn)
+        nrecords = len(records)
+        if nrecords == 0:
+            return
+        last = np.array(records[-1])
+        del records
+        # anything after the last whole record is from an interrupted write
+        os.truncate(self.fn, offset + nrecords*self.dtype.itemsize)
+
+        self._reset_bucket(int(last['time']))
+        self.count = int(last['count'])
+        for i, var in enumerate(self.variables):
+            self.mins[i] = last[var + '_min']
+            self.maxs[i] = last[var + '_max']
+            self.sums[i] = last[var + '_mean'] * self.count
+        # it gets rewritten, with whatever else lands in it, later
+        self._in_file = True
+
+    def add(self, t, values):
+        """
+        Adds a sample at time `t` (sec since the epoch) with `values` a
+        dictionary of variable name to value.
+        """
+        start = int(t // self.width) * self.width
+        if start != self.bucket_start:
+            self.write_bucket()
+            self._reset_bucket(start)
+
+        vals = np.array([values[var] for var in self.variables], dtype=float)
+        self.count += 1
+        np.minimum(self.mins, vals, out=self.mins)
+        np.maximum(self.maxs, vals, out=self.maxs)
+        self.sums += vals
+
+    def write_bucket(self):
+        if self.count == 0:
+            return
+        record = np.zeros(1, dtype=self.dtype)
+        record['time'] = self.bucket_start
+        record['count'] = self.count
+        for i, var in enumerate(self.variables):
+            record[var + '_min'] = self.mins[i]
+            record[var + '_max'] = self.maxs[i]
+            record[var + '_mean'] = self.sums[i] / self.count
+        if self._in_file:
+            with open(self.fn, 'r+b') as f:
+                f.seek(-self.dtype.itemsize, os.SEEK_END)
+                f.write(record.tobytes())
+        else:
+            append_binary_records(self.fn, record, self.dtype)
+            self._in_file = True
+
+    def flush(self):
+        """
+        Writes out the bucket in progress, so a recorder that's killed only
+        loses the samples since.
+        """
+        self.write_bucket()
+
+    def close(self):
+        self.write_bucket()
+        self._reset_bucket(None)
+
+
+class Rollups:
+    """
+    Maintains all the rollup tiers of series `fn` (the name without "_cal").
+    """
+    def __init__(self, fn, variables=ROLLUP_VARIABLES, tiers=ROLLUP_TIERS):
+        self.tiers = [RollupTier(fn, nm, width, variables)
+                      for nm, width in tiers]
+
+    def add(self, t, values):
+        """
+        Adds a sample at time `t` (sec since the epoch).  `values` is a
+        dictionary of variable name to value - the `ROLLUP_DERIVED`
+        quantities are worked out from them.
+        """
+        values = _with_derived(values)
+        for tier in self.tiers:
+            tier.add(t, values)
+
+    def flush(self):
+        for tier in self.tiers:
+            tier.flush()
+
+    def close(self):
+        for tier in self.tiers:
+            tier.close()
+
+
+def aggregate_buckets(times, values, variables, width):
+    """
+    Returns rollup records (like those in a rollup file) for samples at
+    `times` (sec since the epoch, in order) with `values` a dictionary of
+    variable name to array of values, in buckets `width` sec wide.
+    """
+    buckets = np.asarray(times) // width
+    if len(buckets) == 0:
+        return np.zeros(0, dtype=rollup_fields(variables))
+    # the samples are in time order, so each bucket is a contiguous run
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[:1] - 1))
+    counts = np.diff(np.append(starts, len(buckets)))
+
+    records = np.zeros(len(starts), dtype=rollup_fields(variables))
+    records['time'] = buckets[starts] * width
+    records['count'] = counts
+    for var in variables:
+        vals = np.asarray(values[var], dtype=float)
+        records[var + '_min'] = np.minimum.reduceat(vals, starts)
+        records[var + '_max'] = np.maximum.reduceat(vals, starts)
+        records[var + '_mean'] = np.add.reduceat(vals, starts) / counts
+    return records
+
+
+def build_rollups(fn, variables=None, tiers=ROLLUP_TIERS):
+    """
+    (Re)builds all the rollup tiers of series `fn` from its "_cal" dataset in
+    one pass, replacing any existing rollup files.  `variables` defaults to
+    everything in the dataset plus the `ROLLUP_DERIVED` quantities.
+    """
+    dset = read_dataset(fn + '_cal')
+    if variables is None:
+        variables = rollup_variables(data_fields(dset))
+    if dset['time'].dtype.kind == 'i':
+        times = np.asarray(dset['time'])
+    else:
+        times = csv_times_to_epoch(dset['time'])
+    values = _with_derived({nm: dset[nm] for nm in data_fields(dset)})
+
+    for tiername, width in tiers:
+        records = aggregate_buckets(times, values, variables, width)
+        tierfn = rollup_fn(fn, tiername)
+        create_binary_dataset(tierfn, rollup_fields(variables))
+        append_binary_records(tierfn, records, records.dtype)
+
+
+def available_tiers(fn, tiers=ROLLUP_TIERS):
+    """
+    The (name, width) of the tiers of series `fn` that have rollup files
+    """
+    return [(nm, width) for nm, width in tiers
+            if os.path.exists(rollup_fn(fn, nm))]
+
+
+def choose_tier(fn, span, npoints, tiers=ROLLUP_TIERS):
+    """
+    Returns the (name, width) of the coarsest rollup tier of series `fn` that
+    still gives at least `npoints` buckets over `span` sec, or None if there
+    isn't one (i.e., the raw samples are needed).
+    """
+    best = None
+    for nm, width in available_tiers(fn, tiers):
+        if width * npoints <= span:
+            best = (nm, width)
+    return best
+
+
+def read_rollup(fn, tiername):
+    return read_binary_dataset(rollup_fn(fn, tiername))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Usage: python -m envwatcher.rollups <series path without _cal>')
+        sys.exit(1)
+    build_rollups(sys.argv[1])
@@ -0,0 +1,81 @@
+"""
+Sampling several BME280s together, so they can be recorded as one series.
+"""
+from .bme280 import BME280Recorder
+
+
+class BME280Group:
+    """
+    Several `BME280Recorder`s read as one: `read_raw` triggers a forced
+    measurement on all of them before collecting any, so the conversions
+    (most of the time a sample takes) overlap rather than run one after the
+    other.
+
+    This has the parts of the `BME280Recorder` interface that
+    `file_recorder.output_session_file` uses, with the values of all the
+    sensors one after the other.  Their names (`fields`) have "_<label>" on
+    the end, with `labels` defaulting to "<bus number>_<address in hex>".
+    """
+    def __init__(self, recorders, labels=None):
+        self.recorders = list(recorders)
+        if labels is None:
+            labels = ['{}_{:02x}'.format(rec.i2cbusnum, rec.address)
+                      for rec in self.recorders]
+        if len(labels) != len(self.recorders):
+            raise ValueError('Need a label for each recorder')
+        self.labels = list(labels)
+
+        self.fields = tuple([nm + '_' + label
+                             for rec, label in zip(self.recorders, self.labels)
+                             for nm in rec.fields])
+
+    def read_raw(self, doforce=True):
+        """
+        Returns the raw values of all the sensors, from measurements made at
+        (nearly) the same time.
+        """
+        if doforce:
+            for rec in self.recorders:
+                rec.trigger()
+        raw = ()
+        for rec in self.recorders:
+            raw += tuple(rec.collect())
+        return raw
+
+    def read(self, read_raw=None):
+        """
+        Returns the calibrated values of all the sensors, from `read_raw` if
+        given or else from new measurements.
+        """
+        if read_raw is None:
+            read_raw = self.read_raw()
+
+        values = ()
+        i = 0
+        for rec in self.recorders:
+            n = len(rec.fields)
+            values += tuple(rec.read(tuple(read_raw[i:i + n])))
+            i += n
+        return values
+
+    def calibrations(self):
+        return [(tuple([nm + '_' + label for nm in fields]), calib_vals)
+                for rec, label in zip(self.recorders, self.labels)
+                for fields, calib_vals in rec.calibrations()]
+
+    def reset_device(self):
+        for rec in self.recorders:
+            rec.reset_device()
+
+
+def make_recorder(sensors, **kwargs):
+    """
+    Returns a `BME280Recorder` for the sensor at (I2C bus number, address)
+    if `sensors` has one of them, or else a `BME280Group` of them all.
+    `kwargs` go to `BME280Recorder`.
+    """
+    recorders = [BME280Recorder(address, busnum, **kwargs)
+                 for busnum, address in sensors]
+    if len(recorders) == 1:
+        return recorders[0]
+    return BME280Group(recorders)
@@ -0,0 +1,151 @@
+"""
+Picks out a time range of a series (for the web app's series API) without
+having to look at the samples outside of it.
+"""
+import time
+import datetime
+
+import numpy as np
+
+from .utils import data_fields, csv_times_to_epoch
+from .derived import compute_derived
+from .downsample import minmax_indices
+from .rollups import choose_tier, read_rollup, aggregate_buckets
+
+CSV_TIME_FORMAT = '%Y-%m-%d_%H:%M:%S'
+
+
+def parse_time(val, now=None):
+    """
+    Interprets the string `val` as a time in sec since the epoch.  Numbers are
+    taken to be sec since the epoch, or if negative, sec relative to `now`
+    (default: the current time).  Anything else should be an ISO 8601 date
+    and time, in local time unless it has a UTC offset.  None or '' gives None.
+    """
+    if not val:
+        return None
+    try:
+        t = float(val)
+    except ValueError:
+        return datetime.datetime.fromisoformat(val.replace('_', 'T')).timestamp()
+    if t < 0:
+        return (time.time() if now is None else now) + t
+    return t
+
+
+def time_range_slice(dset, start=None, end=None):
+    """
+    Returns the slice of `dset` with times from `start` to `end` (in sec since
+    the epoch, None for no limit), found by a binary search on the time column.
+    """
+    times = dset['time']
+    if times.dtype.kind == 'i':
+        keys = [None if start is None else np.floor(start),
+                None if end is None else end]
+    else:
+        # the CSV times sort the same as the times themselves (except in the
+        # repeated hour when DST ends)
+        keys = [None if t is None else
+                time.strftime(CSV_TIME_FORMAT, time.localtime(t)).encode()
+                for t in (start, end)]
+
+    first = 0 if keys[0] is None else np.searchsorted(times, keys[0], 'left')
+    last = len(times) if keys[1] is None else np.searchsorted(times, keys[1], 'right')
+    return slice(first, last)
+
+
+def _epoch_times(dset):
+    if dset['time'].dtype.kind == 'i':
+        times = dset['time'].astype(float)
+    else:
+        times = csv_times_to_epoch(dset['time']).astype(float)
+    if 'time_frac' in dset.dtype.names:
+        times += dset['time_frac']
+    return times
+
+
+def query_series(dset, start=None, end=None, fields=None, max_points=None,
+                 rollups_of=None, derived=None):
+    """
+    Returns the samples in `dset` from `start` to `end` (see
+    `time_range_slice`) as a record array with "time" (in sec since the
+    epoch) and the `fields` requested (default: all the data fields).  The
+    fields can also be derived columns (see `derived`), taken from `derived`
+    (the already worked out derived columns of all of `dset`) if given, or
+    else worked out for just the samples in the range.
+
+    If there are more than `max_points`, they are reduced to about that many,
+    keeping the minimum and maximum of each field in each stretch.  If
+    `rollups_of` is the series' name (its path without "_cal") and one of its
+    rollup tiers still has at least `max_points` buckets over the range, the
+    bucket means are returned instead (with the times at bucket centers).
+    The last bucket in the rollup file may still be filling up, so it and any
+    after it are worked out from the samples.
+
+    Returns the records and the resolution used: "raw" or the tier name.
+    """
+    if fields is None:
+        fields = data_fields(dset)
+    extra = [field for field in fields if field not in data_fields(dset)]
+    outdt = [('time', '<f8')] + [(field, '<f8') for field in fields]
+
+    sl = time_range_slice(dset, start, end)
+    window = dset[sl]
+    if extra:
+        if derived is None or not all([field in derived for field in extra]):
+            derived = compute_derived(window, extra)
+        else:
+            derived = {field: derived[field][sl] for field in extra}
+        for field in extra:
+            if field not in derived:
+                raise ValueError('Field "{}" is not in the dataset'.format(field))
+    columns = {field: derived[field] if field in extra else window[field]
+               for field in fields}
+    if len(window) == 0:
+        return np.empty(0, dtype=outdt), 'raw'
+
+    if max_points is not None and rollups_of is not None:
+        times = _epoch_times(window[[0, -1]])
+        tier = choose_tier(rollups_of, times[-1] - times[0], max_points)
+        if tier is not None:
+            tiername, width = tier
+            rollup = read_rollup(rollups_of, tiername)
+            if all([field + '_mean' in rollup.dtype.names for field in fields]):
+                # the buckets the first and last samples are in, with those
+                # from the last one in the file on from the samples
+                first = times[0] - times[0] % width
+                last_end = times[-1] - times[-1] % width + width
+                tailstart = first
+                if len(rollup):
+                    tailstart = max(first, int(rollup['time'][-1]))
+                buckets = rollup[time_range_slice(rollup, first,
+                                                  min(tailstart, last_end) - 1)]
+                if tailstart <= times[-1]:
+                    tailsl = time_range_slice(window, tailstart)
+                else:
+                    tailsl = slice(0, 0)
+                tail = aggregate_buckets(_epoch_times(window[tailsl]),
+                                         {field: columns[field][tailsl]
+                                          for field in fields},
+                                         fields, width)
+
+                out = np.empty(len(buckets) + len(tail), dtype=outdt)
+                out['time'] = np.concatenate([buckets['time'],
+                                              tail['time']]) + width/2
+                for field in fields:
+                    out[field] = np.concatenate([buckets[field + '_mean'],
+                                                 tail[field + '_mean']])
+                return out, tiername
+
+    if max_points is not None and len(window) > max_points:
+        perfield = max(max_points // len(fields), 2)
+        idxs = np.unique(np.concatenate([minmax_indices(columns[field], perfield)
+                                         for field in fields]))
+        window = window[idxs]
+        columns = {field: col[idxs] for field, col in columns.items()}
+
+    out = np.empty(len(window), dtype=outdt)
+    out['time'] = _epoch_times(window)
+    for field in fields:
+        out[field] = columns[field]
+    return out, 'raw'
@@ -0,0 +1,136 @@
+"""
+The recorder's status, kept in a small fixed-layout file that the recorder
+memory-maps and updates in place, and that readers can read at any time
+without locking.
+
+Torn reads are avoided with a sequence counter ("seqlock"): the writer makes
+it odd while it's changing the record and even again after, so a reader
+knows to try again if the counter was odd or changed while it was reading.
+"""
+import os
+import json
+import mmap
+import time
+import struct
+
+STATUS_MAGIC = b'ENVWSTA2'
+STATUS_SIZE = 4096
+
+# the fixed part of the record, after the magic and sequence counter
+_FIELDS = struct.Struct('<dqddddddqqI')
+_FIELD_NAMES = ('expires', 'pid', 'waitsec', 'last_sample_time', 'pressure',
+                'temperature', 'humidity', 'proc_time', 'nsamples',
+                'reset_count', 'textlen')
+_SEQ = struct.Struct('<Q')
+_SEQ_OFFSET = len(STATUS_MAGIC)
+_FIELDS_OFFSET = _SEQ_OFFSET + _SEQ.size
+_TEXT_OFFSET = _FIELDS_OFFSET + _FIELDS.size
+# fields that are strings (or lists of them), kept as JSON after the fixed
+# part, with their defaults
+_TEXT_FIELDS = {'series_name': '', 'plot_state': '', 'led_setting': '',
+                'outputs': [], 'plot_names': []}
+
+
+class StatusWriter:
+    """
+    Creates the status file `fn` and keeps it updated.  The fields are those
+    in `_FIELD_NAMES` (other than "textlen") and `_TEXT_FIELDS`.  The text
+    fields all have to fit in the rest of the file as JSON (a ValueError is
+    raised if they don't).
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        with open(fn + '.tmp', 'wb') as f:
+            f.write(STATUS_MAGIC + bytes(STATUS_SIZE - len(STATUS_MAGIC)))
+        os.replace(fn + '.tmp', fn)
+
+        self._file = open(fn, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), STATUS_SIZE)
+        self._seq = 0
+        self._values = {nm: 0 for nm in _FIELD_NAMES}
+        self._text_values = dict(_TEXT_FIELDS)
+        self._text = json.dumps(self._text_values).encode()
+
+    def update(self, **values):
+        """
+        Sets the given fields (leaving the rest as they were) in one atomic
+        (to readers) update.
+        """
+        text_values = {nm: values.pop(nm) for nm in _TEXT_FIELDS
+                       if nm in values}
+        for nm in values:
+            if nm not in self._values or nm == 'textlen':
+                raise ValueError('Unknown status field "{}"'.format(nm))
+        if any([self._text_values[nm] != val
+                for nm, val in text_values.items()]):
+            new_text_values = dict(self._text_values)
+            new_text_values.update(text_values)
+            text = json.dumps(new_text_values).encode()
+            if len(text) > STATUS_SIZE - _TEXT_OFFSET:
+                raise ValueError('Status text fields are too long ({} bytes '
+                                 'of JSON, with room for {})'.format(
+                                     len(text), STATUS_SIZE - _TEXT_OFFSET))
+            self._text_values = new_text_values
+            self._text = text
+        self._values.update(values)
+        self._values['textlen'] = len(self._text)
+
+        packed = _FIELDS.pack(*[self._values[nm] for nm in _FIELD_NAMES])
+
+        self._seq += 1
+        self._map[_SEQ_OFFSET:_FIELDS_OFFSET] = _SEQ.pack(self._seq)
+        self._map[_FIELDS_OFFSET:_TEXT_OFFSET] = packed
+        self._map[_TEXT_OFFSET:_TEXT_OFFSET + len(self._text)] = self._text
+        self._seq += 1
+        self._map[_SEQ_OFFSET:_FIELDS_OFFSET] = _SEQ.pack(self._seq)
+
+    def close(self):
+        if not self._file.closed:
+            self._map.close()
+            self._file.close()
+
+
+def is_status_file(fn):
+    with open(fn, 'rb') as f:
+        return f.read(len(STATUS_MAGIC)) == STATUS_MAGIC
+
+
+def read_status(fn, retries=10000):
+    """
+    Returns the status in the file `fn` as a dictionary, or None if the file
+    doesn't exist.
+    """
+    try:
+        with open(fn, 'rb') as f:
+            if f.read(len(STATUS_MAGIC)) != STATUS_MAGIC:
+                raise ValueError('"{}" is not a status file'.format(fn))
+            m = mmap.mmap(f.fileno(), STATUS_SIZE, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+    with m:
+        for i in range(retries):
+            seq1 = _SEQ.unpack(m[_SEQ_OFFSET:_FIELDS_OFFSET])[0]
+            if seq1 % 2 == 0:
+                # one copy of the whole (small) record, checked afterwards
+                record = m[_FIELDS_OFFSET:]
+                seq2 = _SEQ.unpack(m[_SEQ_OFFSET:_FIELDS_OFFSET])[0]
+                if seq1 == seq2:
+                    break
+            # give the writer a chance to finish
+            time.sleep(0.0001)
+        else:
+            raise IOError('Could not get a consistent read of status '
+                          'file "{}"'.format(fn))
+
+    status = dict(zip(_FIELD_NAMES, _FIELDS.unpack(record[:_FIELDS.size])))
+    textlen = status.pop('textlen')
+    text = record[_FIELDS.size:_FIELDS.size + textlen]
+    status.update(_TEXT_FIELDS)
+    status.update(json.loads(text.decode()) if text else {})
+    return status
+
+
+def status_is_live(status, now=None):
+    return (status is not None and
+            status['expires'] > (time.time() if now is None else now))
@@ -0,0 +1,184 @@
+"""
+Continuous acquisition with the BME280 in normal mode, where the device
+measures on its own schedule and we just pick up each new sample.
+"""
+import time
+
+import numpy as np
+
+
+RAW_DTYPE = np.dtype([('time', float), ('pressure', 'int32'),
+                      ('temperature', 'int32'), ('humidity', 'int32')])
+
+
+class RingBuffer:
+    """
+    A fixed-size buffer of the most recent `size` entries, backed by a
+    preallocated numpy array of type `dtype`.
+    """
+    def __init__(self, size, dtype):
+        self.data = np.zeros(size, dtype=dtype)
+        self.nwritten = 0
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def __len__(self):
+        return min(self.nwritten, self.size)
+
+    def append(self, row):
+        self.data[self.nwritten % self.size] = row
+        self.nwritten += 1
+
+    def latest(self, n=None):
+        """
+        Returns (a copy of) the last `n` entries in the order they were added,
+        or all of them if `n` is None.
+        """
+        if n is None or n > len(self):
+            n = len(self)
+        end = self.nwritten % self.size
+        idxs = np.arange(end - n, end) % self.size
+        return self.data[idxs]
+
+
+class StreamingReader:
+    """
+    Puts `bme280` (a `BME280Recorder`) in normal mode with the given standby
+    time and IIR filter, and reads each sample as the device produces it
+    into a `RingBuffer` of `buffer_size` samples.
+
+    Iterating over this yields (time, pressure, temperature, humidity) for
+    each new sample as it arrives.
+    """
+    def __init__(self, bme280, t_standby_ms=62.5, iir_filter=0,
+                       buffer_size=4096):
+        self.bme280 = bme280
+        self.t_standby_ms = t_standby_ms
+        self.iir_filter = iir_filter
+        self.buffer = RingBuffer(buffer_size, RAW_DTYPE)
+
+        self.running = False
+        self._old_mode = None
+        self._period = None
+        self._last_end = None
+        self._last_raw = None
+        self._next_due = None
+
+    @property
+    def period(self):
+        """
+        Time between samples in sec.  This starts from the datasheet estimate
+        and then follows the device's actual timing.
+        """
+        if self._period is None:
+            return (self.bme280.t_measure_estimate[0] + self.t_standby_ms) / 1000.
+        return self._period
+
+    def start(self):
+        self._old_mode = self.bme280.mode
+        # the config register may not take writes in normal mode (datasheet
+        # 5.4.6), so set it up while asleep
+        self.bme280.mode = 'sleep'
+        self.bme280.t_standby_ms = self.t_standby_ms
+        self.bme280.iir_filter = self.iir_filter
+        self.bme280.mode = 'normal'
+        self.running = True
+
+        # the first conversion starts right away
+        self._period = None
+        self._last_end = (time.perf_counter() - self.period +
+                          self.bme280.t_measure_estimate[0]/1000.)
+        self._last_raw = self._next_due = None
+
+    def stop(self):
+        if self.running:
+            self.bme280.mode = self._old_mode
+            self.running = False
+
+    def _wait_for_conversion(self):
+        """
+        Sleeps until just before the next conversion is expected to finish,
+        and then polls the status register until it does.
+        """
+        meastime = self.bme280.t_measure_estimate[0]/1000.
+        # this needs to be short enough that the polling below can't miss the
+        # standby time between conversions
+        guard = min(meastime, self.t_standby_ms/1000.)/2
+        expected_end = self._last_end + self.period
+
+        timeleft = expected_end - guard - time.perf_counter()
+        if timeleft > 0:
+            time.sleep(timeleft)
+
+        deadline = expected_end + self.period/2
+        seen_measuring = False
+        while self.bme280.is_measuring():
+            seen_measuring = True
+            if time.perf_counter() > deadline:
+                break
+            time.sleep(guard/2)
+
+        now = time.perf_counter()
+        if seen_measuring:
+            # follow the device's clock, which can be off from the datasheet
+            # estimate by several percent
+            if now - self._last_end < 1.5*self.period:
+                self._period = 0.9*self.period + 0.1*(now - self._last_end)
+            self._last_end = now
+        elif now > expected_end + guard:
+            # we're late (whatever's reading stalled), so the schedule's no
+            # use any more - the conversion finished some time in the last
+            # period, and the next one will by a period from now
+            self._last_end = now
+        else:
+            # the conversion had already finished, so aim earlier next time
+            self._last_end = expected_end - guard
+
+    def read_next(self):
+        """
+        Waits for the next sample, stores it in the buffer, and returns it as
+        (time, raw pressure, raw temperature, raw humidity).
+        """
+        if not self.running:
+            self.start()
+        while True:
+            self._wait_for_conversion()
+            raw = tuple(self.bme280.read_raw(doforce=False))
+            # the same values before another conversion can have finished
+            # are the last sample still latched in the data registers
+            if (raw != self._last_raw or self._next_due is None or
+                time.perf_counter() >= self._next_due):
+                break
+        self._last_raw = raw
+        self._next_due = self._last_end + self.period
+
+        row = (time.time(),) + raw
+        self.buffer.append(row)
+        return row
+
+    def __iter__(self):
+        try:
+            while True:
+                row = self.read_next()
+                yield (row[0],) + tuple(self.bme280.read(row[1:]))
+        finally:
+            self.stop()
+
+    def latest(self, n=None):
+        """
+        Returns the last `n` buffered samples (or all of them if `n` is None)
+        as a record array with time, pressure, temperature, and humidity
+        fields, calibrated.
+        """
+        raw = self.buffer.latest(n)
+        pres, temp, hum = self.bme280.calibrate_raw_arrays(raw['pressure'],
+                                                           raw['temperature'],
+                                                           raw['humidity'])
+        result = np.empty(len(raw), dtype=[(nm, float) for nm in RAW_DTYPE.names])
+        result['time'] = raw['time']
+        result['pressure'] = pres
+        result['temperature'] = temp
+        result['humidity'] = hum
+        return result
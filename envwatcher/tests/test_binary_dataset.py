@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+
+from ..binary_dataset import (MAGIC, HEADER_ALIGN, RAW_FIELDS, CAL_FIELDS,
+                              create_binary_dataset, append_binary_records,
+                              read_binary_header, read_binary_dataset,
+                              binary_dataset_bytes, convert_csv_dataset,
+                              is_binary_dataset)
+from ..series_query import CSV_TIME_FORMAT
+from ..utils import read_dataset
+
+
+def test_header(tmp_path):
+    fn = str(tmp_path / 'series_cal')
+    create_binary_dataset(fn, CAL_FIELDS)
+    assert is_binary_dataset(fn)
+    with open(fn, 'rb') as f:
+        assert f.read(len(MAGIC)) == MAGIC
+
+    dt, offset = read_binary_header(fn)
+    assert dt == np.dtype(CAL_FIELDS)
+    assert offset % HEADER_ALIGN == 0
+    assert len(read_binary_dataset(fn)) == 0
+
+
+def test_append_and_read(tmp_path):
+    fn = str(tmp_path / 'series_raw')
+    create_binary_dataset(fn, RAW_FIELDS)
+    dt = np.dtype(RAW_FIELDS)
+    records = np.zeros(10, dtype=dt)
+    records['time'] = 1600000000 + np.arange(10)
+    records['pressure'] = np.arange(10) + 250000
+    records['temperature'] = 520000
+    records['humidity'] = -np.arange(10)
+
+    append_binary_records(fn, records[:4], dt)
+    append_binary_records(fn, [tuple(rec) for rec in records[4:]], dt)
+    dset = read_binary_dataset(fn)
+    assert isinstance(dset, np.memmap)
+    assert np.array_equal(dset, records)
+    with open(fn, 'rb') as f:
+        assert f.read() == binary_dataset_bytes(records)
+
+    # a record that's still being written is left out
+    with open(fn, 'ab') as f:
+        f.write(records[:1].tobytes()[:dt.itemsize // 2])
+    assert np.array_equal(read_binary_dataset(fn), records)
+    # and the usual reader gives the same
+    assert np.array_equal(read_dataset(fn), records)
+
+
+def test_convert_csv(tmp_path):
+    t0 = time.mktime((2021, 6, 1, 12, 0, 0, 0, 0, -1))
+    times = t0 + 30*np.arange(5)
+    values = [(101.3 + i/10, 20.5 - i, 45.25 + i) for i in range(5)]
+
+    for suffix, rows, dtype in [('_cal', values, '<f8'),
+                                ('_raw', [(250000 + i, 520000 - i, 28000)
+                                          for i in range(5)], '<i4')]:
+        csvfn = str(tmp_path / ('series' + suffix))
+        with open(csvfn, 'w') as f:
+            f.write('time,pressure,temperature,humidity\n')
+            for t, row in zip(times, rows):
+                f.write(','.join([time.strftime(CSV_TIME_FORMAT,
+                                                 time.localtime(t))] +
+                                 [str(val) for val in row]) + '\n')
+        binfn = csvfn + '.bin'
+        convert_csv_dataset(csvfn, binfn)
+
+        dset = read_binary_dataset(binfn)
+        assert dset.dtype == np.dtype([('time', '<i8')] +
+                                      [(nm, dtype) for nm in
+                                       ('pressure', 'temperature', 'humidity')])
+        assert np.array_equal(dset['time'], times)
+        for i, nm in enumerate(('pressure', 'temperature', 'humidity')):
+            assert dset[nm].tolist() == [row[i] for row in rows]
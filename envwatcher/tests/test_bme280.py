@@ -0,0 +1,156 @@
+import time
+import collections
+
+import numpy as np
+import pytest
+
+from ..bme280 import (BME280Recorder, CALIB_BLOCKS, SHADOWED_REGISTERS,
+                      CTRL_MEAS_REGISTER)
+from ..emulator import EmulatedBME280, EmulatedSMBus, DEFAULT_CALIBS
+from ..benchmarks import make_emulated_recorder
+
+
+def _fast_recorder(**emulator_kwargs):
+    b, bus = make_emulated_recorder(**emulator_kwargs)
+    # 8 ms typical, 9.3 ms max
+    b.temperature_oversampling = b.pressure_oversampling = 1
+    b.humidity_oversampling = 1
+    return b, bus
+
+
+def test_wait_learns_conversion_time():
+    b, bus = _fast_recorder(measure_time_ms=5, measure_jitter_ms=0.2)
+    typ, mx = b.t_measure_estimate
+    for i in range(40):
+        b.read_raw()
+    times = b.conversion_times[b._oversampling_key]
+    # it starts out aiming for the datasheet time, which is too late to see
+    # the finish, and works its way down to the actual time
+    assert 5 <= np.percentile(times, 10) < 6.5 < typ
+
+    bus.reset_counts()
+    st = time.perf_counter()
+    for i in range(10):
+        b.read_raw()
+    assert (time.perf_counter() - st) / 10 < typ / 1000.
+    # mostly one status poll after the sleep, then one more after the finish
+    assert bus.transactions['read_byte_data'] <= 50
+
+
+def test_wait_for_slower_device():
+    b, bus = _fast_recorder(measure_time_ms=9)
+    for i in range(20):
+        b.read_raw()
+    times = b.conversion_times[b._oversampling_key]
+    assert 9 <= np.percentile(times, 10) < 10.5
+
+
+def test_wait_capped_at_datasheet_max():
+    b, bus = _fast_recorder(measure_time_ms=5)
+    typ, mx = b.t_measure_estimate
+    # times far longer than the datasheet max, e.g. from a stalled bus
+    b.conversion_times[b._oversampling_key] = collections.deque([1000.]*10)
+
+    st = time.perf_counter()
+    b.read_raw()
+    assert time.perf_counter() - st < 3 * mx / 1000.
+
+
+def test_stalled_measurement():
+    b, bus = _fast_recorder(raw_values=(250000, 520000, 28000))
+    first = b.read_raw()
+    ntimes = len(b.conversion_times[b._oversampling_key])
+
+    # the next conversion never finishes
+    bus.devices[0x77].measure_time_ms = 1e6
+    typ, mx = b.t_measure_estimate
+    st = time.perf_counter()
+    with pytest.warns(UserWarning, match='did not finish'):
+        raw = b.read_raw()
+    elapsed = time.perf_counter() - st
+    assert 10 * mx / 1000. <= elapsed < 20 * mx / 1000.
+    # the old values, which the recorder takes as a sign to reset, and the
+    # stall isn't learned as a conversion time
+    assert raw == first
+    assert len(b.conversion_times[b._oversampling_key]) == ntimes
+
+    bus.devices[0x77].measure_time_ms = None
+    b.reset_device()
+    assert bus.devices[0x77].nconversions == 1
+    b.read_raw()
+    assert bus.devices[0x77].nconversions == 2
+
+
+def test_calibs_block_read():
+    calibs = dict(DEFAULT_CALIBS, dig_P2=-12000, dig_H4=-700, dig_H5=900)
+    b, bus = make_emulated_recorder(calibs=calibs)
+    bus.reset_counts()
+    calib_vals = b.read_calibs()
+    assert {nm: int(val) for nm, val in calib_vals.items()} == calibs
+    # one read per block (and one status read, for the NVM copy)
+    assert bus.transactions['read_i2c_block_data'] == len(CALIB_BLOCKS)
+    assert bus.transactions['read_byte_data'] == 1
+
+
+def test_calibs_cache(tmp_path):
+    cachefn = str(tmp_path / 'calibs' / 'bme280_calibs.json')
+    calibs = dict(DEFAULT_CALIBS, dig_T2=26000)
+    other = dict(DEFAULT_CALIBS, dig_T2=27000)
+
+    bus = EmulatedSMBus({0x76: EmulatedBME280(other),
+                         0x77: EmulatedBME280(calibs)})
+    b = BME280Recorder(0x77, bus=bus, calib_cache=cachefn)
+    assert int(b.calib_vals['dig_T2']) == 26000
+    b76 = BME280Recorder(0x76, bus=bus, calib_cache=cachefn)
+    assert int(b76.calib_vals['dig_T2']) == 27000
+
+    # a new recorder gets them from the cache (even if the device changed)
+    bus.devices[0x77] = EmulatedBME280(dict(calibs, dig_T2=25000))
+    bus.reset_counts()
+    b = BME280Recorder(0x77, bus=bus, calib_cache=cachefn)
+    assert int(b.calib_vals['dig_T2']) == 26000
+    # just the block read of the control registers, none of calibrations
+    assert bus.transactions['read_i2c_block_data'] == 1
+
+    # unless asked to read them again, which updates the cache
+    b = BME280Recorder(0x77, bus=bus, calib_cache=cachefn, refresh_calibs=True)
+    assert int(b.calib_vals['dig_T2']) == 25000
+    assert int(b.get_calibs()['dig_T2']) == 25000
+    assert int(b.get_calibs(refresh=True)['dig_T2']) == 25000
+    b76 = BME280Recorder(0x76, bus=bus, calib_cache=cachefn)
+    assert int(b76.calib_vals['dig_T2']) == 27000
+
+
+def test_shadow_registers():
+    b, bus = make_emulated_recorder()
+    dev = bus.devices[0x77]
+
+    def device_regs():
+        return {reg: dev.registers[reg] for reg in SHADOWED_REGISTERS}
+
+    bus.reset_counts()
+    b.pressure_oversampling = 4
+    b.iir_filter = 4
+    b.t_standby_ms = 500
+    # read-modify-write cycles without the reads
+    assert bus.transactions['read_byte_data'] == 0
+    assert bus.transactions['write_byte_data'] == 3
+    assert b._shadow_regs == device_regs()
+
+    # ctrl_meas is written again to apply a humidity oversampling change
+    bus.reset_counts()
+    b.humidity_oversampling = 2
+    assert bus.transactions['read_byte_data'] == 0
+    assert bus.transactions['write_byte_data'] == 2
+    assert b._shadow_regs == device_regs()
+
+    # the device goes back to sleep after a forced measurement, which is
+    # what the shadow copy says
+    b.read_raw()
+    assert dev.registers[CTRL_MEAS_REGISTER] & 0b11 == 0
+    assert b._shadow_regs == device_regs()
+
+    # and after a reset it matches the device's defaults
+    b.reset_device()
+    assert b._shadow_regs == device_regs() == {reg: 0 for reg in
+                                               SHADOWED_REGISTERS}
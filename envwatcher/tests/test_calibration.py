@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from ..bme280 import CalibrationKernel, calibrate_raw_arrays, calibs_from_ints
+from ..emulator import DEFAULT_CALIBS
+from ..calibration_harness import random_raw, random_calibs
+from ..benchmarks import make_emulated_recorder
+
+# the calibration values hard-coded in testcal.c (the same as the emulator's)
+TESTCAL_CALIBS = dict(DEFAULT_CALIBS)
+# a device with negative and nonzero humidity terms
+OTHER_CALIBS = dict(dig_T1=27504, dig_T2=26435, dig_T3=-1000, dig_P1=36477,
+                    dig_P2=-10685, dig_P3=3024, dig_P4=2855, dig_P5=140,
+                    dig_P6=-7, dig_P7=15500, dig_P8=-14600, dig_P9=6000,
+                    dig_H1=75, dig_H2=370, dig_H3=5, dig_H4=300, dig_H5=-50,
+                    dig_H6=30)
+
+# raw (pressure, temperature, humidity) -> what testcal.c (built with
+# -fwrapv) gives in its fixed point units: pressure in Pa/256, temperature
+# in deg C/100, and humidity in %RH/1024
+TESTCAL_EXPECTED = {
+    (265035, 522496, 28299): (25684614, 2207, 43336),
+    (0, 0, 0): (28080825, -14044, 0),
+    (1048575, 1048575, 65535): (4285740762, 18602, 102400),
+    (415148, 519888, 27000): (19234604, 2126, 35983),
+    (300000, 450000, 20000): (23302223, -49, 0),
+    (500000, 600000, 40000): (16264414, 4621, 102400),
+    (200000, 380000, 10000): (26453429, -2228, 0),
+    (350000, 560000, 32000): (22464659, 3375, 65659),
+    (524288, 524288, 32768): (14627368, 2263, 68349),
+}
+OTHER_EXPECTED = {
+    (265035, 522496, 28299): (32471585, 2590, 54512),
+    (0, 0, 0): (33608192, -14088, 0),
+    (1048575, 1048575, 65535): (4292524766, 18755, 102400),
+    (415148, 519888, 27000): (25767233, 2508, 46763),
+    (300000, 450000, 20000): (29829797, 313, 3452),
+    (500000, 600000, 40000): (22864454, 5011, 102400),
+    (200000, 380000, 10000): (32938039, -1897, 0),
+    (350000, 560000, 32000): (29207707, 3763, 79124),
+    (524288, 524288, 32768): (21003398, 2646, 80645),
+}
+
+
+def _expected_values(expected):
+    # the same conversions as testcal.c's main (to kPa, deg C, and %RH)
+    return [(pres/256000., temp/100., hum/1024.)
+            for pres, temp, hum in expected.values()]
+
+
+@pytest.mark.parametrize('calibs, expected',
+                         [(TESTCAL_CALIBS, TESTCAL_EXPECTED),
+                          (OTHER_CALIBS, OTHER_EXPECTED)])
+def test_matches_testcal(calibs, expected):
+    calib_vals = calibs_from_ints(calibs)
+    raw = list(expected)
+    expected_vals = _expected_values(expected)
+
+    kernel = CalibrationKernel(calib_vals)
+    assert [tuple(kernel.calibrate(*sample)) for sample in raw] == expected_vals
+
+    arrays = calibrate_raw_arrays(calib_vals,
+                                  *[np.array(col) for col in zip(*raw)])
+    assert list(zip(*[arr.tolist() for arr in arrays])) == expected_vals
+
+
+def test_kernel_matches_arrays():
+    rng = np.random.default_rng(21)
+    calibsets = [calibs_from_ints(TESTCAL_CALIBS), random_calibs(rng),
+                 random_calibs(rng),
+                 # which makes the pressure divisor 0
+                 calibs_from_ints(dict(TESTCAL_CALIBS, dig_P1=0))]
+    raw = random_raw(rng, 2000)
+    for calib_vals in calibsets:
+        kernel = CalibrationKernel(calib_vals)
+        scalar = [kernel.calibrate(*sample)
+                  for sample in zip(*[arr.tolist() for arr in raw])]
+        arrays = calibrate_raw_arrays(calib_vals, *raw)
+        assert scalar == list(zip(*[arr.tolist() for arr in arrays]))
+        # plain floats, not numpy scalars
+        assert {type(val) for val in scalar[0]} == {float}
+    assert not hasattr(kernel, '__dict__')
+
+
+def test_recorder_uses_kernel():
+    b, bus = make_emulated_recorder(raw_values=(265035, 522496, 28299))
+    expected = _expected_values(TESTCAL_EXPECTED)[0]
+    assert tuple(b.read()) == expected
+    assert tuple(b.read((265035, 522496, 28299))) == expected
+
+    # and a new one is made when the calibration values change
+    other = calibs_from_ints(OTHER_CALIBS)
+    b.calib_vals = other
+    assert tuple(b.read()) == _expected_values(OTHER_EXPECTED)[0]
+    assert b.calib_vals is other
@@ -0,0 +1,96 @@
+import os
+import time
+import threading
+
+import pytest
+
+from ..daemon import RecorderDaemon, send_command
+from ..benchmarks import make_emulated_recorder
+from ..utils import read_dataset
+
+PARAMS = {'waitsec': 0.02, 'setled': False, 'binary': True}
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    recorder, bus = make_emulated_recorder()
+    daemon = RecorderDaemon(recorder, str(tmp_path))
+    yield daemon
+    daemon.stop()
+
+
+def test_commands(daemon, tmp_path):
+    response = daemon.handle({'command': 'status'})
+    assert response['ok'] and not response['recording']
+
+    response = daemon.handle(dict(PARAMS, command='start', series='s1'))
+    assert response['ok'] and response['recording']
+    assert response['series'] == 's1'
+    assert response['params'] == PARAMS
+    assert os.path.exists(str(tmp_path / 's1_cal'))
+
+    response = daemon.handle(dict(PARAMS, command='start', series='s2'))
+    assert not response['ok']
+    assert 'Already recording series "s1"' in response['error']
+
+    # a bad change leaves it recording as it was
+    response = daemon.handle({'command': 'reconfigure', 'wiatsec': 1})
+    assert not response['ok'] and 'wiatsec' in response['error']
+    assert daemon.recording and daemon.params == PARAMS
+
+    time.sleep(0.2)
+    response = daemon.handle({'command': 'reconfigure', 'waitsec': 0.05})
+    assert response['ok'] and response['recording']
+    assert response['params'] == dict(PARAMS, waitsec=0.05)
+    time.sleep(0.2)
+
+    response = daemon.handle({'command': 'stop'})
+    assert response['ok'] and not response['recording']
+    nsamples = len(read_dataset(str(tmp_path / 's1_cal')))
+    assert nsamples > 5
+    time.sleep(0.1)
+    assert len(read_dataset(str(tmp_path / 's1_cal'))) == nsamples
+
+    response = daemon.handle({'command': 'stop'})
+    assert response['ok'] and not response['recording']
+    assert not daemon.handle({'command': 'reconfigure', 'waitsec': 1})['ok']
+    response = daemon.handle({'command': 'dance'})
+    assert not response['ok'] and 'Unknown command' in response['error']
+
+
+def test_start_errors(daemon, tmp_path):
+    for series in ('', '../s1', '.hidden', None):
+        response = daemon.handle({'command': 'start', 'series': series})
+        assert not response['ok'] and 'Invalid series name' in response['error']
+    response = daemon.handle({'command': 'start', 'series': 's1',
+                              'waitsecs': 1})
+    assert not response['ok'] and 'waitsecs' in response['error']
+
+    # can't carry on a CSV series in binary
+    with open(str(tmp_path / 's1_cal'), 'w') as f:
+        f.write('time,pressure,temperature,humidity\n')
+    response = daemon.handle(dict(PARAMS, command='start', series='s1'))
+    assert not response['ok']
+    assert 'Could not record series "s1"' in response['error']
+    assert daemon.last_error is not None
+    assert not daemon.recording
+    assert sorted(os.listdir(str(tmp_path))) == ['s1_cal']
+
+
+def test_socket(daemon, tmp_path):
+    socketpath = str(tmp_path / 'sock')
+    thread = threading.Thread(target=daemon.serve, args=(socketpath,),
+                              daemon=True)
+    thread.start()
+    for i in range(100):
+        if os.path.exists(socketpath):
+            break
+        time.sleep(0.01)
+
+    response = send_command(socketpath, 'start', series='s1', **PARAMS)
+    assert response['ok'] and response['recording']
+    response = send_command(socketpath, 'status')
+    assert response['series'] == 's1'
+    assert not send_command(socketpath, 'start', series='s2')['ok']
+    response = send_command(socketpath, 'stop')
+    assert response['ok'] and not response['recording']
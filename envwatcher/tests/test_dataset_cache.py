@@ -0,0 +1,122 @@
+import os
+import time
+
+import numpy as np
+
+from ..dataset_cache import DatasetCache
+from ..binary_dataset import (CAL_FIELDS, create_binary_dataset,
+                              append_binary_records)
+from ..series_query import CSV_TIME_FORMAT
+from ..utils import read_dataset
+
+
+def _csv_lines(start, n):
+    return ''.join(['{},{},{},{}\n'.format(
+                        time.strftime(CSV_TIME_FORMAT,
+                                      time.localtime(1600000000 + i)),
+                        100 + i/100, 20 + i/100, 40 + i/100)
+                    for i in range(start, start + n)])
+
+
+def _write_csv(fn, n):
+    with open(fn, 'w') as f:
+        f.write('time,pressure,temperature,humidity\n')
+        f.write(_csv_lines(0, n))
+
+
+def _records(start, n):
+    records = np.zeros(n, dtype=CAL_FIELDS)
+    records['time'] = 1600000000 + np.arange(start, start + n)
+    records['pressure'] = 100 + np.arange(start, start + n)
+    return records
+
+
+def test_csv_only_new_rows_parsed(tmp_path, monkeypatch):
+    fn = str(tmp_path / 'series_cal')
+    _write_csv(fn, 50)
+
+    parsed = []
+    loadtxt = np.loadtxt
+
+    def counting_loadtxt(*args, **kwargs):
+        rows = loadtxt(*args, **kwargs)
+        parsed.append(len(rows))
+        return rows
+    monkeypatch.setattr(np, 'loadtxt', counting_loadtxt)
+
+    cache = DatasetCache()
+    dset = cache.get(fn)
+    assert len(dset) == 50
+    assert not dset.flags.writeable
+    assert parsed == [50]
+
+    # with a partly written line at the end, which is left for later
+    lines = _csv_lines(50, 11)
+    with open(fn, 'a') as f:
+        f.write(lines[:-10])
+    dset = cache.get(fn)
+    assert len(dset) == 60
+    assert parsed == [50, 10]
+
+    with open(fn, 'a') as f:
+        f.write(lines[-10:])
+    dset = cache.get(fn)
+    assert parsed == [50, 10, 1]
+    monkeypatch.undo()
+    assert np.array_equal(dset, read_dataset(fn))
+
+
+def test_binary_incremental(tmp_path):
+    fn = str(tmp_path / 'series_cal')
+    create_binary_dataset(fn, CAL_FIELDS)
+    cache = DatasetCache()
+    assert len(cache.get(fn)) == 0
+
+    append_binary_records(fn, _records(0, 5), CAL_FIELDS)
+    first = cache.get(fn)
+    with open(fn, 'ab') as f:
+        f.write(_records(5, 3).tobytes()[:-4])
+    dset = cache.get(fn)
+    assert np.array_equal(dset, _records(0, 7))
+    # what was handed out before is unchanged
+    assert np.array_equal(first, _records(0, 5))
+
+
+def test_replaced_and_truncated(tmp_path):
+    fn = str(tmp_path / 'series_cal')
+    _write_csv(fn, 20)
+    cache = DatasetCache()
+    assert len(cache.get(fn)) == 20
+
+    # replaced by a different file
+    create_binary_dataset(fn + '.tmp', CAL_FIELDS)
+    append_binary_records(fn + '.tmp', _records(0, 3), CAL_FIELDS)
+    os.replace(fn + '.tmp', fn)
+    assert np.array_equal(cache.get(fn), _records(0, 3))
+
+    # written again in place, shorter
+    create_binary_dataset(fn, CAL_FIELDS)
+    append_binary_records(fn, _records(10, 2), CAL_FIELDS)
+    assert np.array_equal(cache.get(fn), _records(10, 2))
+
+
+def test_lru_eviction(tmp_path):
+    fns = [str(tmp_path / 'series{}_cal'.format(i)) for i in range(3)]
+    for fn in fns:
+        create_binary_dataset(fn, CAL_FIELDS)
+        append_binary_records(fn, _records(0, 100), CAL_FIELDS)
+
+    nbytes = 100 * np.dtype(CAL_FIELDS).itemsize
+    # room for two of them
+    cache = DatasetCache(max_bytes=int(2.5 * nbytes))
+    cache.get(fns[0])
+    cache.get(fns[1])
+    cache.get(fns[0])
+    cache.get(fns[2])
+    assert list(cache._entries) == [fns[0], fns[2]]
+
+    # the one just asked for is kept even if it doesn't fit
+    cache = DatasetCache(max_bytes=nbytes // 2)
+    cache.get(fns[0])
+    cache.get(fns[1])
+    assert list(cache._entries) == [fns[1]]
@@ -0,0 +1,76 @@
+import numpy as np
+
+from .. import derived
+from ..derived import DerivedColumns
+from ..utils import temphum_to_dewpoint
+
+FIELDS = ('pressure', 'temperature', 'humidity')
+
+
+def make_dset(n):
+    dset = np.zeros(n, dtype=[('time', '<i8')] + [(nm, '<f8') for nm in FIELDS])
+    dset['time'] = 1700000000 + 10*np.arange(n)
+    dset['pressure'] = 101 - 0.001*np.arange(n)
+    dset['temperature'] = 15 + 0.01*np.arange(n)
+    dset['humidity'] = 30 + 0.02*np.arange(n)
+    return dset
+
+
+def test_dewpoint_and_absolute_humidity_agree():
+    # saturated air at the dewpoint holds the same water
+    temp = np.array([-10., 5., 20., 35.])
+    rh = np.array([20., 50., 70., 95.])
+    dewpoint = temphum_to_dewpoint(temp, rh)
+    np.testing.assert_allclose(derived.absolute_humidity(dewpoint, 100.) *
+                               (dewpoint + 273.15),
+                               derived.absolute_humidity(temp, rh) *
+                               (temp + 273.15))
+
+
+def test_only_asked_for_columns(monkeypatch):
+    called = []
+    for nm, quantity in derived.DERIVED_QUANTITIES.items():
+        def func(*args, nm=nm, orig=quantity.func):
+            called.append(nm)
+            return orig(*args)
+        monkeypatch.setattr(quantity, 'func', func)
+
+    dset = make_dset(10)
+    columns = DerivedColumns()
+    assert sorted(columns.get(dset, ['dewpoint'])) == ['dewpoint']
+    assert called == ['dewpoint']
+    assert columns.nbytes == len(dset)*8
+
+    # the deg F dewpoint needs (the already worked out) dewpoint
+    del called[:]
+    assert sorted(columns.get(dset, ['dewpoint_f'])) == ['dewpoint',
+                                                         'dewpoint_f']
+    assert called == ['dewpoint_f']
+
+    assert columns.get(dset, []) == {}
+
+
+def test_incremental(monkeypatch):
+    lengths = []
+    quantity = derived.DERIVED_QUANTITIES['heat_index']
+    orig = quantity.func
+
+    def func(temp, rh):
+        lengths.append(len(temp))
+        return orig(temp, rh)
+    monkeypatch.setattr(quantity, 'func', func)
+
+    full = make_dset(1000)
+    columns = DerivedColumns()
+    for n in (10, 11, 500, 1000, 1000):
+        result = columns.get(full[:n], ['heat_index'])
+        np.testing.assert_allclose(result['heat_index'],
+                                   orig(full['temperature'][:n],
+                                        full['humidity'][:n]))
+    # only the new samples each time
+    assert lengths == [10, 1, 489, 500]
+
+    # a shorter dataset isn't the same one, so it's worked out again
+    del lengths[:]
+    columns.get(full[:5], ['heat_index'])
+    assert lengths == [5]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from ..downsample import downsample_indices, lttb_indices, minmax_indices
+
+
+def _series(n=10000):
+    rng = np.random.default_rng(2)
+    x = (np.datetime64('2021-06-01T00:00:00') +
+         np.arange(n) * np.timedelta64(30, 's'))
+    y = np.sin(np.arange(n) / 500.) + rng.normal(0, 0.01, n)
+    # a one-sample spike either way
+    y[n*1234 // 10000] = 5
+    y[n*7777 // 10000] = -5
+    return x, y
+
+
+@pytest.mark.parametrize('npoints', [3, 10, 500, 2000])
+def test_lttb(npoints):
+    x, y = _series()
+    idxs = lttb_indices(x, y, npoints)
+    assert len(idxs) == npoints
+    assert idxs[0] == 0 and idxs[-1] == len(y) - 1
+    assert np.all(np.diff(idxs) > 0)
+    if npoints >= 10:
+        assert 1234 in idxs and 7777 in idxs
+
+
+@pytest.mark.parametrize('npoints', [2, 10, 500, 2000])
+def test_minmax(npoints):
+    x, y = _series()
+    idxs = minmax_indices(y, npoints)
+    assert idxs[0] == 0 and idxs[-1] == len(y) - 1
+    assert np.all(np.diff(idxs) > 0)
+    # a min and max from each bucket, plus the ends
+    assert len(idxs) <= npoints + 2
+    assert len(idxs) >= npoints // 2
+    assert 1234 in idxs and 7777 in idxs
+
+
+def test_short_series_kept():
+    x, y = _series(100)
+    for method in ('lttb', 'minmax', None):
+        assert np.array_equal(downsample_indices(x, y, 100, method),
+                              np.arange(100))
+    assert np.array_equal(downsample_indices(x, y, 10, None), np.arange(100))
+    assert np.array_equal(lttb_indices(x, y, 2), np.arange(100))
+    with pytest.raises(ValueError):
+        downsample_indices(x, y, 10, 'decimate')
@@ -0,0 +1,81 @@
+import random
+
+from ..bme280 import BME280Recorder, CALIB_REGISTERS, decode_calibs
+from ..emulator import (EmulatedBME280, EmulatedSMBus, encode_calibs,
+                        DEFAULT_CALIBS)
+from ..streaming import StreamingReader
+from ..calibration_harness import CALIB_RANGES
+from ..benchmarks import make_emulated_recorder
+
+
+def test_calibs_round_trip():
+    rng = random.Random(1)
+    calibsets = [DEFAULT_CALIBS]
+    for i in range(200):
+        calibsets.append({nm: rng.randint(*CALIB_RANGES[regs[0]])
+                          for nm, regs in CALIB_REGISTERS.items()})
+    # the extremes of each type too
+    for end in (0, 1):
+        calibsets.append({nm: CALIB_RANGES[regs[0]][end]
+                          for nm, regs in CALIB_REGISTERS.items()})
+
+    for calibs in calibsets:
+        decoded = decode_calibs(encode_calibs(calibs))
+        assert {nm: int(val) for nm, val in decoded.items()} == calibs
+
+
+def test_recorder_reads_emulated_calibs():
+    calibs = dict(DEFAULT_CALIBS, dig_H4=-1000, dig_H5=1234)
+    bus = EmulatedSMBus({0x77: EmulatedBME280(calibs)})
+    b = BME280Recorder(bus=bus, calib_cache=None)
+    assert {nm: int(val) for nm, val in b.calib_vals.items()} == calibs
+
+
+def test_read_transactions():
+    b, bus = make_emulated_recorder()
+    b.read()
+    bus.reset_counts()
+    for i in range(10):
+        b.read()
+    # a trigger, a status poll or more, and one block read of the data
+    assert bus.transactions['write_byte_data'] == 10
+    assert bus.transactions['read_i2c_block_data'] == 10
+    assert 10 <= bus.transactions['read_byte_data'] <= 100
+    assert bus.transactions['write_i2c_block_data'] == 0
+
+
+def test_trigger_collect():
+    raws = {0x76: (300000, 500000, 30000), 0x77: (250000, 520000, 28000)}
+    bus = EmulatedSMBus({addr: EmulatedBME280(raw_values=raw)
+                         for addr, raw in raws.items()})
+    recs = {addr: BME280Recorder(addr, bus=bus, calib_cache=None)
+            for addr in raws}
+    for rec in recs.values():
+        rec.trigger()
+    for addr, rec in recs.items():
+        assert rec.collect() == raws[addr]
+    for addr, rec in recs.items():
+        assert bus.devices[addr].nconversions == 1
+
+
+def test_streaming_reader():
+    count = [0]
+
+    def next_raw():
+        count[0] += 1
+        return (250000 + count[0], 520000, 28000)
+
+    b, bus = make_emulated_recorder(raw_values=next_raw)
+    mode = b.mode
+    reader = StreamingReader(b, t_standby_ms=10, buffer_size=4)
+    rows = [reader.read_next() for i in range(6)]
+    reader.stop()
+
+    pressures = [row[1] for row in rows]
+    # each is a new conversion
+    assert pressures == sorted(set(pressures))
+    assert len(reader.buffer) == 4
+    assert list(reader.buffer.latest()['pressure']) == pressures[-4:]
+    assert len(reader.latest()) == 4
+    # back to how it was
+    assert b.mode == mode
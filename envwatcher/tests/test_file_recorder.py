@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from ..file_recorder import DatasetWriter
+from ..binary_dataset import cal_fields
+from ..utils import read_dataset
+
+T0 = 1700000000
+
+
+def rows(start, stop):
+    return [(T0 + i, 100. + i, 20. + i, 50. + i) for i in range(start, stop)]
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_rows_written_once(tmp_path, binary):
+    fn = str(tmp_path / 's_cal')
+    writer = DatasetWriter(fn, cal_fields(), binary=binary, flush_rows=3)
+    flushed = [writer.add_row(row) for row in rows(0, 7)]
+    assert flushed == [False, False, True]*2 + [False]
+    assert list(read_dataset(fn)['pressure']) == [100. + i for i in range(6)]
+
+    writer.close()
+    writer.close()
+    assert list(read_dataset(fn)['pressure']) == [100. + i for i in range(7)]
+
+
+class _InterruptedFile:
+    # a file where the first write gets interrupted by (e.g. a signal handler
+    # doing) another flush
+    def __init__(self, f, writer):
+        self.f = f
+        self.writer = writer
+        self.interrupted = False
+
+    def write(self, data):
+        if not self.interrupted:
+            self.interrupted = True
+            self.writer.flush()
+        return self.f.write(data)
+
+    def __getattr__(self, nm):
+        return getattr(self.f, nm)
+
+
+def test_flush_interrupted_by_flush(tmp_path):
+    fn = str(tmp_path / 's_cal')
+    writer = DatasetWriter(fn, cal_fields(), binary=True, flush_rows=100)
+    for row in rows(0, 5):
+        writer.add_row(row)
+    writer._file = _InterruptedFile(writer._file, writer)
+    writer.flush()
+    for row in rows(5, 8):
+        writer.add_row(row)
+    writer.close()
+
+    dset = read_dataset(fn)
+    np.testing.assert_array_equal(dset['time'], T0 + np.arange(8))
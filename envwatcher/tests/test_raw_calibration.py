@@ -0,0 +1,85 @@
+import os
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from ..raw_calibration import (read_calibrated, raw_only_series,
+                               dataset_source_fn, write_calib_snapshot,
+                               read_calib_snapshot)
+from ..bme280 import calibs_from_ints
+from ..emulator import DEFAULT_CALIBS
+from ..benchmarks import make_emulated_recorder
+from ..dataset_cache import DatasetCache
+from ..file_recorder import output_session_file
+from ..utils import read_dataset
+
+
+def _record(bme280, fn, secs=0.3, **kwargs):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=output_session_file, args=(bme280, fn),
+                              kwargs=dict(kwargs, waitsec=0.02, setled=False,
+                                          writecal=False,
+                                          stop_event=stop_event))
+    thread.start()
+    time.sleep(secs)
+    stop_event.set()
+    thread.join()
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_raw_only_series(tmp_path, binary):
+    b, bus = make_emulated_recorder()
+    fn = str(tmp_path / 'series')
+    _record(b, fn, binary=binary)
+    assert sorted(os.listdir(str(tmp_path))) == ['series_calib', 'series_raw']
+    assert raw_only_series(fn + '_cal') == fn
+    assert dataset_source_fn(fn + '_cal') == fn + '_raw'
+    assert read_calib_snapshot(fn) == [(b.fields, b.calib_vals)]
+
+    raw = read_dataset(fn + '_raw')
+    cal = read_dataset(fn + '_cal')
+    assert len(cal) == len(raw) > 3
+    assert np.array_equal(cal['time'], raw['time'])
+    for rawrow, calrow in zip(raw, cal):
+        assert tuple(calrow)[1:] == tuple(b.read(tuple(rawrow)[1:]))
+
+    # worked out again only when the raw dataset changes
+    assert read_calibrated(fn + '_cal') is cal
+    cache = DatasetCache()
+    assert np.array_equal(cache.get(fn + '_cal'), cal)
+    _record(b, fn, binary=binary)
+    newcal = read_calibrated(fn + '_cal')
+    assert len(newcal) > len(cal)
+    assert np.array_equal(newcal[:len(cal)], cal)
+    assert np.array_equal(cache.get(fn + '_cal'), newcal)
+
+
+def test_snapshot_mismatch(tmp_path):
+    b, bus = make_emulated_recorder()
+    fn = str(tmp_path / 'series')
+    write_calib_snapshot(fn, b)
+    write_calib_snapshot(fn, b)
+
+    b.calib_vals = calibs_from_ints(dict(DEFAULT_CALIBS, dig_T2=27000))
+    with pytest.raises(ValueError, match='different'):
+        write_calib_snapshot(fn, b)
+
+
+def test_not_raw_only(tmp_path):
+    fn = str(tmp_path / 'series')
+    with pytest.raises(FileNotFoundError):
+        read_calibrated(fn + '_cal')
+    assert raw_only_series(fn + '_cal') is None
+    assert dataset_source_fn(fn + '_cal') == fn + '_cal'
+
+    b, bus = make_emulated_recorder()
+    _record(b, fn, secs=0.1)
+    assert raw_only_series(fn + '_raw') is None
+    # a "_cal" dataset is used as it is
+    with open(fn + '_cal', 'w') as f:
+        f.write('time,pressure,temperature,humidity\n'
+                '2021-06-01_12:00:00,101.3,20.5,45.25\n')
+    assert raw_only_series(fn + '_cal') is None
+    assert read_dataset(fn + '_cal')['temperature'].tolist() == [20.5]
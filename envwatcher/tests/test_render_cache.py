@@ -0,0 +1,122 @@
+import os
+import time
+import threading
+
+from ..render_cache import PlotCache
+from ..binary_dataset import (CAL_FIELDS, create_binary_dataset,
+                              append_binary_records)
+
+
+def _renderer(outdir, nbytes=1000):
+    rendered = []
+
+    def render(key):
+        rendered.append(key)
+        img_name = key + '_pressure.png'
+        with open(os.path.join(outdir, img_name), 'wb') as f:
+            f.write(bytes(nbytes))
+        return [('pressure', img_name)]
+    return render, rendered
+
+
+def test_key_follows_dataset(tmp_path):
+    dsetfn = str(tmp_path / 'series_cal')
+    create_binary_dataset(dsetfn, CAL_FIELDS)
+    cache = PlotCache(str(tmp_path))
+
+    key = cache.key(dsetfn, degf=False)
+    assert cache.key(dsetfn, degf=False) == key
+    assert cache.key(dsetfn, degf=True) != key
+    append_binary_records(dsetfn, [(1600000000, 100., 20., 40.)], CAL_FIELDS)
+    assert cache.key(dsetfn, degf=False) != key
+
+
+def test_render_once_and_invalidate(tmp_path):
+    outdir = str(tmp_path)
+    cache = PlotCache(outdir)
+    render, rendered = _renderer(outdir)
+
+    assert cache.get('a') is None
+    plot_names = cache.get_or_render('a', render)
+    assert plot_names == [('pressure', 'a_pressure.png')]
+    assert cache.get_or_render('a', render) == plot_names
+    assert cache.get('a') == plot_names
+    assert rendered == ['a']
+
+    # an entry with an image gone is rendered again
+    os.unlink(os.path.join(outdir, 'a_pressure.png'))
+    assert cache.get('a') is None
+    assert cache.get_or_render('a', render) == plot_names
+    assert rendered == ['a', 'a']
+
+
+def test_eviction(tmp_path):
+    outdir = str(tmp_path)
+    # room for two entries (an image and a small manifest each)
+    cache = PlotCache(outdir, max_bytes=2500)
+    render, rendered = _renderer(outdir)
+
+    now = time.time()
+    for i, key in enumerate(['a', 'b']):
+        cache.get_or_render(key, render)
+        os.utime(cache._manifest_fn(key), (now - 100 + i, now - 100 + i))
+    # using "a" makes "b" the least recently used
+    assert cache.get('a') is not None
+    cache.get_or_render('c', render)
+
+    assert cache.get('b') is None
+    assert not os.path.exists(os.path.join(outdir, 'b_pressure.png'))
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+    # the newest entry is kept even when it's too big by itself
+    cache.max_bytes = 10
+    cache.get_or_render('d', render)
+    assert sorted(os.listdir(outdir)) == ['d_manifest.json', 'd_pressure.png']
+
+
+def test_renders_of_different_keys_overlap(tmp_path):
+    outdir = str(tmp_path)
+    cache = PlotCache(outdir)
+    render, rendered = _renderer(outdir)
+    started = {key: threading.Event() for key in 'ab'}
+    overlapped = []
+
+    def slow_render(key):
+        started[key].set()
+        # each waits for the other to start
+        overlapped.append(started['b' if key == 'a' else 'a'].wait(5))
+        return render(key)
+
+    threads = [threading.Thread(target=cache.get_or_render,
+                                args=(key, slow_render))
+               for key in 'ab']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlapped == [True, True]
+    assert sorted(rendered) == ['a', 'b']
+    assert cache._key_locks == {}
+
+
+def test_same_key_rendered_once(tmp_path):
+    outdir = str(tmp_path)
+    cache = PlotCache(outdir)
+    render, rendered = _renderer(outdir)
+
+    def slow_render(key):
+        time.sleep(0.1)
+        return render(key)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+                   cache.get_or_render('a', slow_render)))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert rendered == ['a']
+    assert results == [[('pressure', 'a_pressure.png')]] * 4
+    assert cache._key_locks == {}
@@ -0,0 +1,117 @@
+import os
+import sys
+import signal
+import threading
+import subprocess
+
+import numpy as np
+
+from ..rollups import (ROLLUP_TIERS, Rollups, aggregate_buckets, read_rollup,
+                       rollup_variables, _with_derived)
+from ..utils import read_dataset, data_fields
+from ..benchmarks import make_emulated_recorder
+from ..file_recorder import output_session_file
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+                           os.path.abspath(__file__))))
+
+# records samples into the series given as the first argument (flushing
+# every second argument sec, or "None"), and then sends itself the signal
+# named by the third in the middle of reading the 20th sample
+RECORD_AND_DIE = """
+import os, sys, signal
+from envwatcher.benchmarks import make_emulated_recorder
+from envwatcher.file_recorder import output_session_file
+
+bme280 = make_emulated_recorder()[0]
+read_raw = bme280.read_raw
+nread = [0]
+def dying_read_raw(*args, **kwargs):
+    nread[0] += 1
+    if nread[0] == 20:
+        os.kill(os.getpid(), getattr(signal, sys.argv[3]))
+    return read_raw(*args, **kwargs)
+bme280.read_raw = dying_read_raw
+
+output_session_file(bme280, sys.argv[1], waitsec=0.01, setled=False,
+                    binary=True, rollups=True,
+                    flush_interval=eval(sys.argv[2]))
+"""
+
+
+def check_rollups(fn):
+    # the rollup files should have all the samples in the "_cal" dataset
+    dset = read_dataset(fn + '_cal')
+    values = _with_derived({nm: dset[nm] for nm in data_fields(dset)})
+    variables = rollup_variables(data_fields(dset))
+    for tiername, width in ROLLUP_TIERS:
+        rollup = read_rollup(fn, tiername)
+        expected = aggregate_buckets(dset['time'], values, variables, width)
+        np.testing.assert_array_equal(rollup['time'], expected['time'])
+        np.testing.assert_array_equal(rollup['count'], expected['count'])
+        for nm in expected.dtype.names[2:]:
+            np.testing.assert_allclose(rollup[nm], expected[nm])
+
+
+def record_and_die(fn, flush_interval, signame):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR, env.get('PYTHONPATH', '')])
+    return subprocess.run([sys.executable, '-c', RECORD_AND_DIE, fn,
+                           repr(flush_interval), signame], env=env,
+                          timeout=60).returncode
+
+
+def test_rollups_survive_recorder_kill(tmp_path):
+    fn = str(tmp_path / 's')
+    assert record_and_die(fn, 0, 'SIGKILL') == -signal.SIGKILL
+
+    # the bucket in progress (of every tier) made it to disk
+    assert len(read_dataset(fn + '_cal')) == 19
+    check_rollups(fn)
+
+    # and picking the series up again carries on with it
+    stop_event = threading.Event()
+    bme280 = make_emulated_recorder()[0]
+    read_raw = bme280.read_raw
+
+    def counting_read_raw(*args, **kwargs):
+        if len(read_dataset(fn + '_cal')) >= 30:
+            stop_event.set()
+        return read_raw(*args, **kwargs)
+    bme280.read_raw = counting_read_raw
+
+    output_session_file(bme280, fn, waitsec=0.01, setled=False, binary=True,
+                        rollups=True, stop_event=stop_event)
+    assert len(read_dataset(fn + '_cal')) > 19
+    check_rollups(fn)
+
+
+def test_rollups_flushed_on_sigterm(tmp_path):
+    fn = str(tmp_path / 's')
+    # the rollups aren't written out during this, only when it stops
+    assert record_and_die(fn, None, 'SIGTERM') == 1
+    assert len(read_dataset(fn + '_cal')) == 19
+    check_rollups(fn)
+
+
+def test_rollups_not_flushed_every_sample(tmp_path, monkeypatch):
+    nflushes = []
+    monkeypatch.setattr(Rollups, 'flush',
+                        lambda self: nflushes.append(len(nflushes)))
+    stop_event = threading.Event()
+    bme280 = make_emulated_recorder()[0]
+    read_raw = bme280.read_raw
+    nread = []
+
+    def counting_read_raw(*args, **kwargs):
+        nread.append(1)
+        if len(nread) >= 20:
+            stop_event.set()
+        return read_raw(*args, **kwargs)
+    bme280.read_raw = counting_read_raw
+
+    output_session_file(bme280, str(tmp_path / 's'), waitsec=0.01,
+                        setled=False, binary=True, rollups=True,
+                        stop_event=stop_event)
+    assert nflushes == []
+    check_rollups(str(tmp_path / 's'))
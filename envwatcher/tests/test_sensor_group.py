@@ -0,0 +1,84 @@
+import time
+import threading
+
+import pytest
+
+from ..bme280 import BME280Recorder
+from ..emulator import EmulatedBME280, EmulatedSMBus, DEFAULT_CALIBS
+from ..sensor_group import BME280Group
+from ..file_recorder import output_session_file
+from ..rollups import rollup_variables
+from ..utils import read_dataset
+
+RAWS = {0x76: (300000, 500000, 30000), 0x77: (250000, 520000, 28000)}
+
+
+def _group(measure_time_ms=None, labels=None, raws=RAWS):
+    calibs = {0x76: dict(DEFAULT_CALIBS, dig_T2=27000),
+              0x77: DEFAULT_CALIBS}
+    bus = EmulatedSMBus({addr: EmulatedBME280(calibs[addr],
+                                              raw_values=raws[addr],
+                                              measure_time_ms=measure_time_ms)
+                         for addr in RAWS})
+    recs = [BME280Recorder(addr, bus=bus, calib_cache=None) for addr in RAWS]
+    return BME280Group(recs, labels), bus
+
+
+def test_group_reads():
+    group, bus = _group()
+    assert group.fields == ('pressure_1_76', 'temperature_1_76',
+                            'humidity_1_76', 'pressure_1_77',
+                            'temperature_1_77', 'humidity_1_77')
+    raw = group.read_raw()
+    assert raw == RAWS[0x76] + RAWS[0x77]
+    values = group.read(raw)
+    assert values == (tuple(group.recorders[0].read(RAWS[0x76])) +
+                      tuple(group.recorders[1].read(RAWS[0x77])))
+    # the different calibrations
+    assert values[1] != values[4]
+    assert [dev.nconversions for dev in bus.devices.values()] == [1, 1]
+
+    with pytest.raises(ValueError):
+        BME280Group(group.recorders, ['one'])
+    group = BME280Group(group.recorders, ['in', 'out'])
+    assert group.fields[:3] == ('pressure_in', 'temperature_in',
+                                'humidity_in')
+    assert [fields for fields, calib_vals in group.calibrations()] == [
+        ('pressure_in', 'temperature_in', 'humidity_in'),
+        ('pressure_out', 'temperature_out', 'humidity_out')]
+
+
+def test_conversions_overlap():
+    group, bus = _group(measure_time_ms=50)
+    group.read_raw()
+    st = time.perf_counter()
+    for i in range(3):
+        group.read_raw()
+    # one after the other would be at least 100 ms each
+    assert (time.perf_counter() - st) / 3 < 0.09
+
+
+def test_record_group(tmp_path):
+    # (values that change, or the recorder takes it as stuck)
+    group, bus = _group(raws={addr: None for addr in RAWS})
+    fn = str(tmp_path / 'series')
+    stop_event = threading.Event()
+    thread = threading.Thread(target=output_session_file,
+                              args=(group, fn),
+                              kwargs=dict(waitsec=0.02, setled=False,
+                                          binary=True, rollups=True,
+                                          stop_event=stop_event))
+    thread.start()
+    time.sleep(0.5)
+    stop_event.set()
+    thread.join()
+
+    raw = read_dataset(fn + '_raw')
+    cal = read_dataset(fn + '_cal')
+    assert raw.dtype.names == ('time',) + group.fields
+    assert cal.dtype.names == ('time',) + group.fields
+    assert len(cal) > 3
+    assert tuple(cal[-1])[1:] == pytest.approx(group.read(tuple(raw[-1])[1:]))
+    # a dewpoint for each sensor
+    variables = rollup_variables(group.fields)
+    assert 'dewpoint_1_76' in variables and 'dewpoint_1_77' in variables
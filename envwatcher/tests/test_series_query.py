@@ -0,0 +1,60 @@
+import numpy as np
+
+from ..rollups import Rollups, rollup_variables
+from ..series_query import query_series
+
+FIELDS = ('pressure', 'temperature', 'humidity')
+
+
+def make_series(t0, nsamples, interval):
+    dset = np.zeros(nsamples, dtype=[('time', '<i8')] +
+                                    [(nm, '<f8') for nm in FIELDS])
+    dset['time'] = t0 + interval*np.arange(nsamples)
+    dset['pressure'] = 100 + np.sin(np.arange(nsamples)/50.)
+    dset['temperature'] = 20 + np.arange(nsamples)*0.01
+    dset['humidity'] = 50 - np.arange(nsamples)*0.005
+    return dset
+
+
+def test_rollup_query_includes_bucket_in_progress(tmp_path):
+    # 3.5 hours, so the last hour bucket is only half done
+    t0 = 1700000000 - 1700000000 % 86400
+    dset = make_series(t0, 1260, 10)
+    fn = str(tmp_path / 's')
+
+    # as the recorder keeps them, with the last bucket not closed
+    rollups = Rollups(fn, rollup_variables(FIELDS))
+    for row in dset:
+        rollups.add(int(row['time']), {nm: row[nm] for nm in FIELDS})
+
+    records, resolution = query_series(dset, max_points=3, rollups_of=fn)
+    assert resolution == '1hour'
+    assert len(records) == 4
+    np.testing.assert_array_equal(records['time'],
+                                  t0 + 3600*np.arange(4) + 1800)
+    for i in range(4):
+        inbucket = (dset['time'] - t0) // 3600 == i
+        for nm in FIELDS:
+            np.testing.assert_allclose(records[nm][i], dset[nm][inbucket].mean())
+
+
+
+def test_rollup_query_of_past_range(tmp_path):
+    t0 = 1700000000 - 1700000000 % 86400
+    dset = make_series(t0, 8640, 10)
+    fn = str(tmp_path / 's')
+    rollups = Rollups(fn, rollup_variables(FIELDS))
+    for row in dset:
+        rollups.add(int(row['time']), {nm: row[nm] for nm in FIELDS})
+    rollups.close()
+
+    start, end = t0 + 2*3600, t0 + 5*3600 - 1
+    records, resolution = query_series(dset, start, end, max_points=2,
+                                       rollups_of=fn)
+    assert resolution == '1hour'
+    assert len(records) == 3
+    assert np.all((records['time'] >= start) & (records['time'] <= end))
+    for i, t in enumerate(records['time']):
+        inbucket = (dset['time'] >= t - 1800) & (dset['time'] < t + 1800)
+        np.testing.assert_allclose(records['temperature'][i],
+                                   dset['temperature'][inbucket].mean())
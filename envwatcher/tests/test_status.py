@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from ..status import StatusWriter, read_status, STATUS_SIZE
+from ..utils import check_for_recorder
+
+
+def test_long_and_non_ascii_strings(tmp_path):
+    fn = str(tmp_path / 'status')
+    writer = StatusWriter(fn)
+    try:
+        # longer than the fixed-size fields these used to be packed into, with
+        # multi-byte characters across where they would have been cut off
+        name = 'séries_' * 40 + '°C'
+        writer.update(series_name=name, plot_state='rendering…' * 3,
+                      led_setting='λ' * 100, outputs=['a.csv', 'b.csv'],
+                      pid=123, nsamples=4)
+        status = read_status(fn)
+    finally:
+        writer.close()
+
+    assert status['series_name'] == name
+    assert status['plot_state'] == 'rendering…' * 3
+    assert status['led_setting'] == 'λ' * 100
+    assert status['outputs'] == ['a.csv', 'b.csv']
+    assert status['plot_names'] == []
+    assert status['pid'] == 123
+    assert status['nsamples'] == 4
+
+
+def test_too_long_strings_are_rejected(tmp_path):
+    fn = str(tmp_path / 'status')
+    writer = StatusWriter(fn)
+    try:
+        writer.update(series_name='ok', nsamples=1)
+        with pytest.raises(ValueError, match='too long'):
+            writer.update(series_name='x' * STATUS_SIZE, nsamples=2)
+        # and the failed update changed nothing
+        status = read_status(fn)
+        assert status['series_name'] == 'ok'
+        assert status['nsamples'] == 1
+        writer.update(nsamples=3)
+        assert read_status(fn)['series_name'] == 'ok'
+    finally:
+        writer.close()
+
+
+def test_reads_are_never_torn(tmp_path):
+    fn = str(tmp_path / 'status')
+    writer = StatusWriter(fn)
+    writer.update(nsamples=0, pressure=0., temperature=0., humidity=0.,
+                  plot_state='0')
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            writer.update(nsamples=i, pressure=float(i), temperature=float(i),
+                          humidity=float(i), plot_state=str(i) * (i % 50 + 1))
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        last = 0
+        for _ in range(5000):
+            status = read_status(fn)
+            i = status['nsamples']
+            assert status['pressure'] == status['temperature'] == i
+            assert status['humidity'] == i
+            assert status['plot_state'] == str(i) * (i % 50 + 1)
+            assert i >= last
+            last = i
+    finally:
+        stop.set()
+        thread.join()
+        writer.close()
+    assert last > 0
+
+
+def test_check_for_recorder(tmp_path):
+    fn = str(tmp_path / 'status')
+    writer = StatusWriter(fn)
+    try:
+        writer.update(expires=0, series_name='ünïcode', led_setting='off')
+        info = {}
+        assert not check_for_recorder(fn, info)
+        assert info['Series name'] == 'ünïcode'
+        assert info['LED setting'] == 'off'
+        assert 'Plot state' not in info
+    finally:
+        writer.close()
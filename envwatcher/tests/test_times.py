@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+import pytest
+
+from ..series_query import CSV_TIME_FORMAT
+from ..utils import csv_times_to_epoch, epoch_to_local_datetime64
+
+
+@pytest.fixture(params=['America/New_York', 'Australia/Lord_Howe',
+                        'Asia/Kathmandu'])
+def timezone(request, monkeypatch):
+    # Lord Howe Island's DST is only 30 min, and Nepal went from +5:30 to
+    # +5:45 at midnight at the start of 1986
+    monkeypatch.setenv('TZ', request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _transitions(start, end):
+    # the times the UTC offset changes, to the nearest 15 min
+    ts = np.arange(start, end, 900)
+    offsets = np.array([time.localtime(t).tm_gmtoff for t in ts.tolist()])
+    return ts[1:][offsets[1:] != offsets[:-1]]
+
+
+def test_round_trip_across_dst(timezone):
+    start = time.mktime((1985, 7, 1, 0, 0, 0, 0, 0, -1))
+    transitions = _transitions(start, start + 2*365*86400)
+    assert len(transitions)
+
+    for transition in transitions.tolist():
+        epoch = np.arange(transition - 3*3600, transition + 3*3600, 60)
+        strs = np.array([time.strftime(CSV_TIME_FORMAT,
+                                       time.localtime(t)).encode()
+                         for t in epoch.tolist()], dtype='S19')
+        # the local times repeated when the clocks go back are ambiguous
+        uniq, counts = np.unique(strs, return_counts=True)
+        ok = ~np.isin(strs, uniq[counts > 1])
+
+        assert np.array_equal(csv_times_to_epoch(strs[ok]), epoch[ok])
+        local = epoch_to_local_datetime64(epoch)
+        assert np.array_equal(np.datetime_as_string(local).astype('S19'),
+                              np.char.replace(strs, b'_', b'T'))
@@ -0,0 +1,146 @@
+import re
+import json
+
+import numpy as np
+import pytest
+
+from .. import webapp
+from ..binary_dataset import (CAL_FIELDS, create_binary_dataset,
+                              append_binary_records)
+
+T0 = 1600000000
+
+
+def _records(start, n):
+    records = np.zeros(n, dtype=CAL_FIELDS)
+    records['time'] = T0 + 30*np.arange(start, start + n)
+    records['pressure'] = 101. + np.arange(start, start + n)/100.
+    records['temperature'] = 20. + np.arange(start, start + n)/10.
+    records['humidity'] = 40.
+    return records
+
+
+@pytest.fixture
+def datasets_dir(tmp_path, monkeypatch):
+    datasets_dir = tmp_path / 'datasets'
+    plots_dir = tmp_path / 'plots'
+    datasets_dir.mkdir()
+    plots_dir.mkdir()
+    # (absolute, so they're not under the app's root path)
+    monkeypatch.setitem(webapp.app.config, 'DATASETS_DIR', str(datasets_dir))
+    monkeypatch.setitem(webapp.app.config, 'PLOTS_DIR', str(plots_dir))
+    monkeypatch.setitem(webapp.app.config, 'STREAM_POLL_INTERVAL', 0.01)
+    monkeypatch.setitem(webapp.app.config, 'TESTING', True)
+    monkeypatch.setattr(webapp, '_dataset_cache', None)
+    monkeypatch.setattr(webapp, '_plot_cache', None)
+
+    dsetfn = str(datasets_dir / 'series_cal')
+    create_binary_dataset(dsetfn, CAL_FIELDS)
+    append_binary_records(dsetfn, _records(0, 10), CAL_FIELDS)
+    return datasets_dir
+
+
+@pytest.fixture
+def client(datasets_dir):
+    return webapp.app.test_client()
+
+
+def _next_event(chunks):
+    event = {}
+    for line in next(chunks).decode().strip().split('\n'):
+        field, value = line.split(': ', 1)
+        event[field] = value
+    return event
+
+
+def test_stream(client, datasets_dir):
+    assert client.get('/api/stream/nonesuch').status_code == 404
+    assert client.get('/api/stream/series?after=x').status_code == 400
+
+    response = client.get('/api/stream/series?after=8')
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    try:
+        event = _next_event(chunks)
+        assert event['id'] == '10'
+        data = json.loads(event['data'])
+        assert len(data['time']) == 2
+        assert data['pressure'] == _records(8, 2)['pressure'].tolist()
+        assert len(data['dewpoint']) == 2
+        # the times are local time in ms since the epoch
+        assert np.diff(data['time']).tolist() == [30000]
+
+        # then the new samples as they're written
+        append_binary_records(str(datasets_dir / 'series_cal'),
+                              _records(10, 3), CAL_FIELDS)
+        event = _next_event(chunks)
+        assert event['id'] == '13'
+        data = json.loads(event['data'])
+        assert data['pressure'] == _records(10, 3)['pressure'].tolist()
+    finally:
+        response.close()
+
+    # carrying on after a reconnect
+    response = client.get('/api/stream/series',
+                          headers={'Last-Event-ID': '12'})
+    try:
+        event = _next_event(iter(response.response))
+        assert event['id'] == '13'
+        assert len(json.loads(event['data'])['time']) == 1
+    finally:
+        response.close()
+
+
+def _check_conditional(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    response = client.get(url, headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+    response = client.get(url, headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+    return etag
+
+
+@pytest.mark.parametrize('url', ['/api/series/series',
+                                 '/api/series/series?format=binary',
+                                 '/mpl/series', '/bokeh/series'])
+def test_conditional_pages(client, datasets_dir, url):
+    etag = _check_conditional(client, url)
+    assert client.get(url).headers['Cache-Control'] == 'no-cache'
+
+    # new samples make a new version
+    append_binary_records(str(datasets_dir / 'series_cal'), _records(10, 1),
+                          CAL_FIELDS)
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_series_versions(client):
+    etag = client.get('/api/series/series').headers['ETag']
+    # different queries are different versions
+    response = client.get('/api/series/series?max_points=5')
+    assert response.headers['ETag'] != etag
+    response = client.get('/api/series/series?start={}'.format(T0 + 60),
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()['time']) == 8
+
+
+def test_conditional_plots(client, datasets_dir):
+    response = client.get('/mpl/series')
+    paths = re.findall(r'src="(/plots/[^"]+)"', response.get_data(True))
+    assert paths and all(['?v=' in path for path in paths])
+
+    response = client.get(paths[0])
+    assert response.mimetype == 'image/png'
+    assert response.cache_control.max_age == webapp.PLOT_MAX_AGE
+    _check_conditional(client, paths[0])
+    assert client.get('/plots/..%2Fdatasets%2Fseries_cal').status_code == 404
@@ -3,23 +3,111 @@ import time
 
 import numpy as np
 
+from .binary_dataset import is_binary_dataset, read_binary_dataset
+from .status import is_status_file, read_status, status_is_live
+
+# dataset fields that are part of the time rather than data.  "time_frac" is
+# the (optional) fraction of a second to add to "time".
+TIME_FIELDS = ('time', 'time_frac')
+
+# the Sonntag90 constants for the Magnus formula for the saturation vapor
+# pressure (in hPa) over water, A*exp(B*T/(C + T)) with T in deg C
+MAGNUS_A = 6.112  # hPa
+MAGNUS_B = 17.62
+MAGNUS_C = 243.12  # deg C
+
 
 def read_dataset(fn):
+    if not os.path.exists(fn):
+        # the "_cal" dataset of a series recorded with only raw values is
+        # worked out from them
+        from .raw_calibration import raw_only_series, read_calibrated
+        if raw_only_series(fn) is not None:
+            return read_calibrated(fn)
+
+    if is_binary_dataset(fn):
+        return read_binary_dataset(fn)
+
     with open(fn) as f:
         firstline = f.readline().strip()
-    fields = firstline.split(',')
-    dt = np.dtype([(fi, 'S19' if fi=='time' else float) for fi in fields])
-    
-    return np.loadtxt(fn, dt, skiprows=1, delimiter=',')
+    dt = dataset_dtype(firstline.split(','))
+
+    return np.loadtxt(fn, dt, skiprows=1, delimiter=',', ndmin=1)
+
+
+def dataset_dtype(fields):
+    """
+    The dtype for a CSV dataset with the given field names
+    """
+    return np.dtype([(fi, 'S19' if fi=='time' else float) for fi in fields])
+
+
+def data_fields(dset):
+    """
+    The names of the fields in `dset` that aren't times
+    """
+    return [nm for nm in dset.dtype.names if nm not in TIME_FIELDS]
+
+
+def dataset_datetimes(dset):
+    """
+    Returns the times of the samples in `dset` as a (local time) datetime64
+    array, for either CSV or binary datasets.
+    """
+    if dset['time'].dtype.kind == 'i':
+        dts = epoch_to_local_datetime64(dset['time'])
+    else:
+        dts = csv_times_to_datetime64(dset['time'])
+
+    if 'time_frac' in dset.dtype.names:
+        frac_us = np.round(dset['time_frac'] * 1e6).astype('timedelta64[us]')
+        dts = dts.astype('datetime64[us]') + frac_us
+    return dts
+
+
+def csv_times_to_datetime64(timecol):
+    """
+    Converts the strings in the time column of a CSV dataset to (local time)
+    datetime64s.
+    """
+    timecol = np.char.replace(np.asarray(timecol).astype('U19'), '_', 'T')
+    return timecol.astype('datetime64[s]')
+
+
+def epoch_to_local_datetime64(epoch):
+    """
+    Converts seconds since the epoch to (local time) datetime64s.
+    """
+    epoch = np.asarray(epoch, dtype='int64')
+    # the UTC offset can only change every 15 min at most, so the (slow)
+    # localtime is only needed once per 15 min rather than once per sample
+    blocks, inverse = np.unique(epoch // 900, return_inverse=True)
+    offsets = np.array([time.localtime(b*900).tm_gmtoff
+                        for b in blocks.tolist()], dtype='int64')
+    return (epoch + offsets[inverse.ravel()]).astype('datetime64[s]')
+
+
+def csv_times_to_epoch(timecol):
+    """
+    Converts the (local time) strings in the time column of a CSV dataset to
+    integer seconds since the epoch.
+    """
+    naive = csv_times_to_datetime64(timecol).astype('int64')
+
+    # as in epoch_to_local_datetime64, the UTC offset can only change every
+    # 15 min at most (not just on the hour: on Lord Howe Island DST ends at
+    # 1:30 standard time), so the (slow) mktime is only needed once per 15 min
+    blocks, inverse = np.unique(naive // 900, return_inverse=True)
+    offsets = np.array([time.mktime(time.gmtime(b*900)[:8] + (-1,)) - b*900
+                        for b in blocks.tolist()], dtype='int64')
+    return naive + offsets[inverse.ravel()]
 
 
 def temphum_to_dewpoint(temp, rh):
     """
-    Uses the Sonntag90 constants
+    Uses the Magnus formula with the Sonntag90 constants
     """
-    a = 6.112 #mbar
-    b = 17.62
-    c = 234.12 # deg C
+    b, c = MAGNUS_B, MAGNUS_C
 
     # this is the Magnus fomula
     gamma = np.log(rh/100.) + b*temp/(c + temp)
@@ -35,28 +123,63 @@ def deg_c_to_f(degc):
     
 
 def check_for_recorder(recorder_fn, infodct=None):
-    # Should probably do some locking here just in case?  Or maybe it's atomic-enough?
+    """
+    Returns True if there's a live recorder with status file `recorder_fn`,
+    and puts its status (as strings) in `infodct` if given.
+    """
     if infodct is None:
         infodct = {}
-    if os.path.isfile(recorder_fn):
-        with open(recorder_fn, 'r') as f:
-            rec = f.read()
-
-        for l in rec.split('\n'):
-            res = l.strip().split(':')
-            if len(res) == 1:
-                continue
-            elif len(res) == 2:
-                infodct[res[0]] = res[1].strip()
-            else:
-                raise ValueError('Invalid line encountered in recorder file '
-                                 '"{}"!: "{}"'.format(recorder_fn, l))
-
-        if 'Expires-on' in infodct:
-            expire_time = float(infodct['Expires-on'])
-            if expire_time > time.time():
-                return True
+    if not os.path.isfile(recorder_fn):
+        return False
+    if not is_status_file(recorder_fn):
+        return _check_progress_text(recorder_fn, infodct)
+
+    status = read_status(recorder_fn)
+    if status is None:
+        return False
+    infodct['Expires-on'] = str(status['expires'])
+    infodct['PID'] = str(status['pid'])
+    infodct['Sample-time(s)'] = str(status['waitsec'])
+    infodct['Series name'] = status['series_name']
+    infodct['Samples'] = str(status['nsamples'])
+    infodct['Resets'] = str(status['reset_count'])
+    if status['reset_count']:
+        infodct['Reset-occurred'] = 'True'
+    if status['nsamples']:
+        infodct['Last-sample-time'] = str(status['last_sample_time'])
+        for nm in ('pressure', 'temperature', 'humidity'):
+            infodct[nm.capitalize()] = str(status[nm])
+    if status.get('outputs'):
+        infodct['Output(s)'] = ', '.join(status['outputs'])
+    if status.get('plot_names'):
+        infodct['Plot names'] = ', '.join(status['plot_names'])
+    if status['plot_state']:
+        infodct['Plot state'] = status['plot_state']
+    if status['led_setting']:
+        infodct['LED setting'] = status['led_setting']
+    return status_is_live(status)
+
+
+def _check_progress_text(recorder_fn, infodct):
+    # the text progress files written by older recorders
+    with open(recorder_fn, 'r') as f:
+        rec = f.read()
+
+    for l in rec.split('\n'):
+        res = l.strip().split(':')
+        if len(res) == 1:
+            continue
+        elif len(res) == 2:
+            infodct[res[0]] = res[1].strip()
         else:
-            raise ValueError('Expires-on entry not found in recorder file '
-                             '"{}"'.format(recorder_fn))
+            raise ValueError('Invalid line encountered in recorder file '
+                             '"{}"!: "{}"'.format(recorder_fn, l))
+
+    if 'Expires-on' in infodct:
+        expire_time = float(infodct['Expires-on'])
+        if expire_time > time.time():
+            return True
+    else:
+        raise ValueError('Expires-on entry not found in recorder file '
+                         '"{}"'.format(recorder_fn))
     return False
@@ -1,36 +1,179 @@
 import os
 import sys
+import json
 import time
+import hashlib
+import datetime
 import subprocess
 from textwrap import dedent
 
-from flask import Flask, render_template, abort, send_file, request
+from flask import (Flask, Response, render_template, abort, send_file,
+                   request, jsonify, url_for)
+from werkzeug.http import is_resource_modified
 
 
 import matplotlib
 matplotlib.use('agg')  # non-interactive backend
-from .plots import write_series_plots, make_bokeh_plots
-
-from .utils import check_for_recorder
+from .plots import (write_series_plots, make_bokeh_plots, series_plot_data,
+                    plot_derived_names)
+
+from .utils import check_for_recorder, read_dataset, dataset_datetimes
+from .dataset_cache import DatasetCache
+from .downsample import DOWNSAMPLE_METHODS
+from .binary_dataset import is_binary_dataset, binary_dataset_bytes
+from .series_query import parse_time, query_series, time_range_slice
+from .render_cache import PlotCache
+from .raw_calibration import dataset_source_fn
+from .rollups import available_tiers, rollup_fn
+from .daemon import send_command
 
 DATASETS_DIR = 'datasets'
 PLOTS_DIR = 'plots'
 PROGRESS_NAME = 'recorder_progress'
 DEG_F = False
+# the (I2C bus number, address) of each BME280 to record - several get
+# sampled together as a `sensor_group.BME280Group`
+SENSORS = [(1, 0x77)]
 MAKE_PLOTS_CONTINUOUSLY = False
+# the least time between redraws of the plots when made continuously (in sec)
+CONTINUOUS_PLOT_INTERVAL = 60
+DATASET_CACHE_BYTES = 64*2**20  # memory to use for caching parsed datasets
+# how the plots reduce series to about as many points as can be seen.  Can be
+# overridden with the "downsample" and "points" query parameters.
+DOWNSAMPLE_METHOD = 'minmax'  # or 'lttb', or None for all points
+DOWNSAMPLE_POINTS = 2000
+BINARY_DATASETS = False  # record in the binary_dataset format instead of CSV
+# how often the recorder writes out samples - see file_recorder.DatasetWriter
+RECORDER_FLUSH_ROWS = 1
+RECORDER_FLUSH_INTERVAL = None
+RECORDER_FSYNC = False
+RECORD_SUBSECOND = False  # also record fractions of a second in sample times
+RECORD_ROLLUPS = True  # keep the 1 min/1 hour/1 day summaries up to date
+# False to record only the raw values (and the calibration values), with the
+# calibrated values worked out when they're looked at
+RECORD_CALIBRATED = True
+PLOT_CACHE_BYTES = 50*2**20  # disk space for keeping rendered plots around
+# the socket of a running `envwatcher.daemon` (with the same datasets dir) to
+# record with, or None to start a new recorder process for each series
+RECORDER_SOCKET = None
+# how often the live stream checks for new samples (in sec), and the most
+# points the live bokeh plots keep
+STREAM_POLL_INTERVAL = 1
+STREAM_ROLLOVER = 5000
+# how long (in sec) browsers can keep plot images without checking back.  The
+# pages link to them with their version in the URL, so they never go stale.
+PLOT_MAX_AGE = 24*3600
 
 app = Flask(__name__.split('.')[0])
 app.config.from_object(__name__)
 
+_dataset_cache = None
+_plot_cache = None
+_made_dirs = False
+
+
+def get_dataset_cache():
+    global _dataset_cache
+    if _dataset_cache is None:
+        _dataset_cache = DatasetCache(app.config['DATASET_CACHE_BYTES'])
+    return _dataset_cache
+
+
+def get_dataset(dsetfn):
+    """
+    Reads a dataset through the app's (incremental) dataset cache
+    """
+    return get_dataset_cache().get(dsetfn)
+
+
+def get_derived(dsetfn, names=None):
+    """
+    Returns a dataset and its derived columns in `names` (see
+    `derived.compute_derived`), from the app's dataset cache.  The derived
+    columns count towards the cache's size, so ask for just the ones needed.
+    """
+    return get_dataset_cache().get_derived(dsetfn, names)
 
-@app.before_first_request
+
+def get_plot_cache():
+    global _plot_cache
+    if _plot_cache is None:
+        plotsdir = os.path.join(app.root_path, app.config['PLOTS_DIR'])
+        _plot_cache = PlotCache(plotsdir, app.config['PLOT_CACHE_BYTES'])
+    return _plot_cache
+
+
+def dataset_version(dsetfn):
+    """
+    The `os.stat` of the file the dataset `dsetfn` comes from (see
+    `raw_calibration.dataset_source_fn`), which changes whenever samples are
+    added.
+    """
+    return os.stat(dataset_source_fn(dsetfn))
+
+
+def conditional(etag_parts, last_modified, make_response):
+    """
+    Returns a "304 Not Modified" response if the request's If-None-Match
+    (or If-Modified-Since) shows the client already has the version
+    identified by `etag_parts` (anything with a repr that's the same for the
+    same version) and `last_modified` (sec since the epoch).  Otherwise
+    returns `make_response()`.  Either way, the ETag and Last-Modified are
+    set, and clients are told to check back each time (which is then cheap).
+    """
+    etag = hashlib.sha1(repr(etag_parts).encode()).hexdigest()[:20]
+    last_modified = datetime.datetime.fromtimestamp(int(last_modified),
+                                                    datetime.timezone.utc)
+    if is_resource_modified(request.environ, etag=etag,
+                            last_modified=last_modified):
+        response = app.make_response(make_response())
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def plot_url(img_name):
+    """
+    The URL of a plot image, with its version so it can be cached
+    """
+    plotfn = os.path.join(app.root_path, app.config['PLOTS_DIR'], img_name)
+    return '/plots/{}?v={}'.format(img_name, os.stat(plotfn).st_mtime_ns)
+
+
+def get_downsample_args():
+    """
+    Returns the downsampling method and number of points for this request
+    """
+    method = request.args.get('downsample', app.config['DOWNSAMPLE_METHOD'])
+    if method == 'none':
+        method = None
+    if method is not None and method not in DOWNSAMPLE_METHODS:
+        abort(400)
+    try:
+        npoints = int(request.args.get('points', app.config['DOWNSAMPLE_POINTS']))
+    except ValueError:
+        abort(400)
+    if npoints < 3:
+        abort(400)
+    return method, npoints
+
+
+# (before_first_request is gone from newer versions of Flask)
+@app.before_request
 def before_first():
+    global _made_dirs
+    if _made_dirs:
+        return
     dsetdir = os.path.join(app.root_path, app.config['DATASETS_DIR'])
     plotsdir = os.path.join(app.root_path, app.config['PLOTS_DIR'])
     if not os.path.exists(dsetdir):
         os.mkdir(dsetdir)
     if not os.path.exists(plotsdir):
         os.mkdir(plotsdir)
+    _made_dirs = True
 
 
 @app.route("/")
@@ -44,7 +187,7 @@ def index():
     recorder_present = check_for_recorder(recorder_fn, recorder_info)
     if 'Output(s)' in recorder_info:
         for entry in recorder_info['Output(s)'].split(','):
-            if entry.endswith('_cal'):
+            if entry.endswith('_cal') or entry.endswith('_raw'):
                 recorder_info['series_name'] = os.path.split(entry)[-1][:-4]
 
 
@@ -53,6 +196,10 @@ def index():
         for fn in dsls:
             if fn.endswith('_cal'):
                 series.append(fn[:-4])
+            elif (fn.endswith('_raw') and fn[:-4] + '_cal' not in dsls and
+                  fn[:-4] + '_calib' in dsls):
+                # recorded without calibrated values
+                series.append(fn[:-4])
 
     return render_template('index.html',
                            series=series,
@@ -72,13 +219,43 @@ def mpl(series_name):
         infodct['Series name'].strip() != series_name.strip()):
         dsetfn = os.path.join(dsetdir, series_name + '_cal')
         plotsdir = os.path.join(app.root_path, app.config['PLOTS_DIR'])
-        plot_names = write_series_plots(dsetfn, plotsdir, app.config['DEG_F'])
+        downsample, npoints = get_downsample_args()
+
+        def render(key):
+            dset, derived = get_derived(dsetfn,
+                                        plot_derived_names(app.config['DEG_F']))
+            return write_series_plots(dsetfn, plotsdir, app.config['DEG_F'],
+                                      dset=dset, derived=derived,
+                                      downsample=downsample, npoints=npoints,
+                                      prefix=key + '_')
+        plot_cache = get_plot_cache()
+        key = plot_cache.key(dsetfn, degf=app.config['DEG_F'],
+                             downsample=downsample, npoints=npoints)
+        plot_names = plot_cache.get_or_render(key, render)
+        # the key is the version of the dataset and how it's plotted
+        etag_parts = ('mpl', series_name, key)
+        last_modified = dataset_version(dsetfn).st_mtime
+    elif 'Plot names' not in infodct:
+        # the recorder hasn't finished the first plots yet
+        return render_template('generating.html', series_name=series_name)
     else:
         plot_names = [pair.split('|') for pair in infodct['Plot names'].split(', ')]
-
-    plots = [dict(name=nm, path='/plots/{}?{}'.format(path,time.time()))
-             for nm, path in plot_names]
-    return render_template('series.html', series_name=series_name, plots=plots)
+        etag_parts = None
+        last_modified = None
+
+    plots = [dict(name=nm, path=plot_url(img_name))
+             for nm, img_name in plot_names]
+    if etag_parts is None:
+        # the recorder redraws the plots in place, so the page changes when
+        # their versions do
+        plotsdir = os.path.join(app.root_path, app.config['PLOTS_DIR'])
+        etag_parts = ('mpl', series_name, [plot['path'] for plot in plots])
+        last_modified = max([os.stat(os.path.join(plotsdir, img_name)).st_mtime
+                             for nm, img_name in plot_names])
+    return conditional(etag_parts, last_modified,
+                       lambda: render_template('series.html',
+                                               series_name=series_name,
+                                               plots=plots))
 
 
 @app.route("/plots/<plotid>")
@@ -86,7 +263,32 @@ def plots(plotid):
     if plotid.startswith('..') or plotid.startswith('/'):
         abort(404)
     plotfn = os.path.join(app.root_path, app.config['PLOTS_DIR'], plotid)
-    return send_file(plotfn)
+    # with ETag and Last-Modified, and 304s for requests that have them
+    return send_file(plotfn, conditional=True, etag=True,
+                     max_age=app.config['PLOT_MAX_AGE'])
+
+
+def get_session_params():
+    """
+    The `file_recorder.output_session_file` arguments from the app config
+    """
+    params = {}
+    if app.config['MAKE_PLOTS_CONTINUOUSLY']:
+        plotsdir = os.path.join(app.root_path, app.config['PLOTS_DIR'])
+        params['writeplots'] = (plotsdir, app.config['DEG_F'])
+        params['plot_interval'] = app.config['CONTINUOUS_PLOT_INTERVAL']
+    if app.config['BINARY_DATASETS']:
+        params['binary'] = True
+    params['flush_rows'] = app.config['RECORDER_FLUSH_ROWS']
+    params['flush_interval'] = app.config['RECORDER_FLUSH_INTERVAL']
+    params['fsync'] = app.config['RECORDER_FSYNC']
+    if app.config['RECORD_SUBSECOND']:
+        params['subsecond'] = True
+    if app.config['RECORD_ROLLUPS']:
+        params['rollups'] = True
+    if not app.config['RECORD_CALIBRATED']:
+        params['writecal'] = False
+    return params
 
 
 @app.route("/start_recorder", methods=['POST'])
@@ -101,24 +303,30 @@ def start_recorder():
     series_name = request.form['series']
     waittime = int(request.form['sampletime'])
 
-    recfn = os.path.abspath(os.path.join(dsetdir, series_name))
+    params = get_session_params()
+    if app.config['RECORDER_SOCKET']:
+        response = send_command(app.config['RECORDER_SOCKET'], 'start',
+                                series=series_name, waitsec=waittime, **params)
+        if response['ok']:
+            return 'Recorder started!'
+        else:
+            return 'Starting recorder failed with: ' + response['error']
 
-    if not app.config['MAKE_PLOTS_CONTINUOUSLY']:
-        plotsparam = ''
-    else:
-        plotsdir = os.path.join(app.root_path, app.config['PLOTS_DIR'])
-        plotsparam = ", writeplots=('{}', {})".format(plotsdir, app.config['DEG_F'])
+    recfn = os.path.abspath(os.path.join(dsetdir, series_name))
+    sensors = [tuple(sensor) for sensor in app.config['SENSORS']]
+    sessionparams = ''.join([', {}={!r}'.format(nm, val)
+                             for nm, val in params.items()])
 
     # the read() call below ensures everything is ready to go...
     code = dedent("""
     import time
-    from envwatcher.bme280 import BME280Recorder
+    from envwatcher.sensor_group import make_recorder
     from envwatcher.file_recorder import output_session_file
     print("Initalizing recorder at ", time.strftime('%m-%d-%Y %H:%M:%S',time.localtime()))
-    b = BME280Recorder()
+    b = make_recorder({sensors!r})
     b.read()
     print("Starting output session")
-    output_session_file(b, '{recfn}', {waittime}, progressfn='{progressfn}'{plotsparam})
+    output_session_file(b, '{recfn}', {waittime}, progressfn='{progressfn}'{sessionparams})
     print("Finished output session")
     """).format(**locals()).strip()
 
@@ -140,6 +348,10 @@ def start_recorder():
 
 @app.route("/stop_recorder", methods=['POST'])
 def stop_recorder():
+    if app.config['RECORDER_SOCKET']:
+        send_command(app.config['RECORDER_SOCKET'], 'stop')
+        return 'Recorder stopped.'
+
     dsetdir = os.path.join(app.root_path, app.config['DATASETS_DIR'])
     stopfn = os.path.join(dsetdir, app.config['PROGRESS_NAME']) + '_stop'
     print('Writing to', stopfn)
@@ -158,14 +370,156 @@ def bokeh(series_name):
 
     plotsdir = os.path.join(app.root_path, app.config['PLOTS_DIR'])
 
-    figs = make_bokeh_plots(dsetfn, plotsdir, app.config['DEG_F'])
+    downsample, npoints = get_downsample_args()
+    st = dataset_version(dsetfn)
+    etag_parts = ('bokeh', series_name, st.st_ino, st.st_size,
+                  st.st_mtime_ns, app.config['DEG_F'], downsample, npoints,
+                  app.config['STREAM_ROLLOVER'])
+
+    def make_page():
+        dset, derived = get_derived(dsetfn,
+                                    plot_derived_names(app.config['DEG_F']))
+        figs = make_bokeh_plots(dsetfn, plotsdir, app.config['DEG_F'],
+                                dset=dset, derived=derived,
+                                downsample=downsample, npoints=npoints)
+
+        figlist = [figs.pop('temperature', None),
+                   figs.pop('dewpoint', None),
+                   figs.pop('humidity', None),
+                   figs.pop('pressure', None)]
+        figlist.extend(figs.values())
+        figlist = [fig for fig in figlist if fig is not None]
+
+        html = embed.file_html(figlist, resources.INLINE,
+                               'Pienvwatcher (bokeh): ' + series_name)
+        # new samples get streamed in starting after the ones already plotted
+        stream_url = url_for('stream_series', series_name=series_name,
+                             after=len(dset))
+        script = render_template('bokeh_stream.html', stream_url=stream_url,
+                                 rollover=app.config['STREAM_ROLLOVER'])
+        return html.replace('</body>', script + '</body>')
+
+    return conditional(etag_parts, st.st_mtime, make_page)
+
+
+@app.route("/api/stream/<series_name>")
+def stream_series(series_name):
+    """
+    Server-Sent Events with the new samples of a series as they are written:
+    each event is a JSON object of "time" (local time in ms since the epoch,
+    as bokeh uses) and the `plots.series_plot_data` variables, and its id is
+    the number of samples so far.  Starts after the "after"th sample (or the
+    Last-Event-ID when reconnecting), or else with the next new sample.
+    """
+    dsetdir = os.path.join(app.root_path, app.config['DATASETS_DIR'])
+    dsetfn = os.path.join(dsetdir, series_name + '_cal')
+    if not os.path.isfile(dataset_source_fn(dsetfn)):
+        abort(404)
 
-    figlist = [figs.pop('temperature', None),
-               figs.pop('dewpoint', None),
-               figs.pop('humidity', None),
-               figs.pop('pressure', None)]
-    figlist.extend(figs.values())
-    figlist = [fig for fig in figlist if fig is not None]
+    after = request.headers.get('Last-Event-ID', request.args.get('after'))
+    try:
+        nsent = len(get_dataset(dsetfn)) if after is None else int(after)
+    except ValueError:
+        abort(400)
+    degf = app.config['DEG_F']
+    derived_names = plot_derived_names(degf)
+    poll_interval = app.config['STREAM_POLL_INTERVAL']
+
+    def events():
+        nsent_ = nsent
+        lastsent = time.monotonic()
+        while True:
+            # only parses what's been added since the last look
+            dset, derived = get_derived(dsetfn, derived_names)
+            if len(dset) > nsent_:
+                new = dset[nsent_:]
+                newderived = {nm: col[nsent_:] for nm, col in derived.items()}
+                times = dataset_datetimes(new).astype('datetime64[ms]')
+                msg = {'time': times.astype('int64').tolist()}
+                for nm, data in series_plot_data(new, degf,
+                                                 newderived).items():
+                    msg[nm] = data.tolist()
+                nsent_ = len(dset)
+                yield 'id: {}\ndata: {}\n\n'.format(nsent_, json.dumps(msg))
+                lastsent = time.monotonic()
+            elif time.monotonic() - lastsent > 15:
+                # so proxies don't time out the connection
+                yield ': keepalive\n\n'
+                lastsent = time.monotonic()
+            time.sleep(poll_interval)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+@app.route("/api/series/<series_name>")
+def api_series(series_name):
+    """
+    The samples of a series in a time range.  Query parameters are "start"
+    and "end" (see `series_query.parse_time`), "fields" (comma-separated,
+    and can include derived quantities like "dewpoint" - see `derived`),
+    "max_points", and "format" ("json" or "binary", a `binary_dataset`).
+    """
+    dsetdir = os.path.join(app.root_path, app.config['DATASETS_DIR'])
+    seriesfn = os.path.join(dsetdir, series_name)
+    dsetfn = seriesfn + '_cal'
+    if not os.path.isfile(dataset_source_fn(dsetfn)):
+        abort(404)
 
-    return embed.standalone_html_page_for_models(figlist, resources.INLINE,
-                                         'Pienvwatcher (bokeh): ' + series_name)
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'binary'):
+        abort(400)
+    fields = request.args.get('fields')
+    try:
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+        max_points = request.args.get('max_points')
+        if max_points is not None:
+            max_points = int(max_points)
+            if max_points < 2:
+                abort(400)
+    except ValueError:
+        abort(400)
+
+    # (before reading it, so the version is never newer than the data)
+    st = dataset_version(dsetfn)
+    if os.path.isfile(dsetfn) and is_binary_dataset(dsetfn):
+        # memory-mapped, so only the part in the range actually gets read
+        # (and any derived columns are only worked out for that)
+        dset = read_dataset(dsetfn)
+        derived = None
+    else:
+        # (the recorded fields in this are just left out of the derived ones)
+        dset, derived = get_derived(dsetfn,
+                                    fields.split(',') if fields else [])
+
+    # the result only depends on which samples are in the range (so it
+    # still has the same version when relative times like "-1h" move on
+    # while nothing's being recorded) and on the rollups
+    sl = time_range_slice(dset, start, end)
+    etag_parts = ['series', series_name, st.st_ino, st.st_size,
+                  st.st_mtime_ns, sl.start, sl.stop, fmt, fields, max_points]
+    for tiername, width in available_tiers(seriesfn):
+        rollupst = os.stat(rollup_fn(seriesfn, tiername))
+        etag_parts.extend([tiername, rollupst.st_size, rollupst.st_mtime_ns])
+
+    def make_response():
+        try:
+            records, resolution = query_series(dset, start, end,
+                                               fields.split(',') if fields
+                                               else None, max_points,
+                                               rollups_of=seriesfn,
+                                               derived=derived)
+        except ValueError:
+            abort(400)
+
+        if fmt == 'binary':
+            return Response(binary_dataset_bytes(records),
+                            mimetype='application/octet-stream',
+                            headers={'X-Resolution': resolution})
+        result = {'series': series_name, 'resolution': resolution}
+        for nm in records.dtype.names:
+            result[nm] = records[nm].tolist()
+        return jsonify(result)
+
+    return conditional(etag_parts, st.st_mtime, make_response)
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
 from envwatcher.webapp import app
-app.config['DEG_F'] = True
-app.run(debug=True)
\ No newline at end of file
+
+if __name__ == '__main__':
+    app.config['DEG_F'] = True
+    app.run(debug=True)
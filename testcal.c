@@ -1,8 +1,11 @@
 #include <stdio.h>
+#include <stdint.h>
 
-typedef long signed int BME280_S32_t;
-typedef long unsigned int BME280_U32_t;
-typedef long long signed int BME280_S64_t;
+// the datasheet's types, which have to be exactly these widths for the
+// overflow to come out the same on 64-bit machines as on the Pi
+typedef int32_t BME280_S32_t;
+typedef uint32_t BME280_U32_t;
+typedef int64_t BME280_S64_t;
 
 int dig_P6 = -7 ;
 int dig_P9 = 4285 ;
@@ -84,6 +87,8 @@ return (BME280_U32_t)(v_x1_u32r>>12);
 // time,pressure,temperature,humidity
 // 2016-01-29_02:56:47,274239,527824,29244
 
+// envwatcher.calibration_harness builds this as a library without main
+#ifndef TESTCAL_LIBRARY
 int main(int argc, char * argv[])
 {
    //code
@@ -93,4 +98,5 @@ int main(int argc, char * argv[])
 	printf("temp=%f", temp/100.);
 	printf(" pressure=%f", pres/256000.);
 	printf(" humidity=%f\n", hum/1024.);
-}
\ No newline at end of file
+}
+#endif